@@ -0,0 +1,131 @@
+"""
+Микро-бенчмарк разбора ответа LLM (parse_character_profile).
+
+Проверяет корректность извлечения полей на корпусе parser_corpus.json
+(реальные и испорченные ответы модели) и сравнивает скорость текущего
+однопроходного парсера с прежней реализацией на регулярных выражениях.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_parser [--iterations 2000]
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import time
+
+from gemini_utils import parse_character_profile
+
+logger = logging.getLogger(__name__)
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "parser_corpus.json")
+
+
+# Прежняя реализация parse_character_profile - для сравнения скорости и качества.
+def legacy_parse_character_profile(raw_text):
+    profile = {}
+    fields_ordered = [
+        ("Имя", "name"),
+        ("Раса", "race"),
+        ("Класс", "class"),
+        ("Предыстория (Background)", "background_name"),
+        ("Мировоззрение", "alignment"),
+        ("Характеристики", "stats"),
+        ("Инвентарь", "inventory"),
+        ("Черта Характера", "trait"),
+        ("Идеал", "ideal"),
+        ("Привязанность", "bond"),
+        ("Слабость", "flaw")
+    ]
+
+    current_text = raw_text
+    for field_ru, field_en in fields_ordered:
+        pattern = re.compile(rf"^{re.escape(field_ru)}:\s*([\s\S]+?)(?=\n[А-ЯЁ][\w\s\(\)-]+:|$)", re.MULTILINE | re.UNICODE)
+        match = pattern.search(current_text)
+        if match:
+            value = match.group(1).strip()
+            profile[field_en] = value
+        else:
+            pattern_looser = re.compile(rf"{re.escape(field_ru)}:\s*([\s\S]+?)(?=\n[А-ЯЁ][\w\s\(\)-]+:|$)", re.MULTILINE | re.UNICODE)
+            match_looser = pattern_looser.search(raw_text)
+            if match_looser:
+                 profile[field_en] = match_looser.group(1).strip()
+            else:
+                profile[field_en] = "Не указано"
+                logger.warning(f"Не удалось извлечь поле '{field_ru}' из ответа LLM.")
+
+    backstory_text_match = re.search(
+        r"\nИнвентарь:[^\n]*\n+Предыстория:\s*([\s\S]+?)(?=\nЧерта Характера:|$)",
+        raw_text,
+        re.MULTILINE | re.UNICODE
+    )
+    if backstory_text_match:
+        profile["backstory_text"] = backstory_text_match.group(1).strip()
+    else:
+        simple_bs_match = re.search(r"(?<!\(Background\):\s*\n)Предыстория:\s*([\s\S]+?)(?=\n[А-ЯЁ][\w\s\(\)-]+:|$)", raw_text, re.MULTILINE | re.UNICODE)
+        if simple_bs_match:
+            if "Предыстория (Background):" not in simple_bs_match.group(0):
+                 profile["backstory_text"] = simple_bs_match.group(1).strip()
+            else:
+                 profile["backstory_text"] = "Не удалось извлечь описание предыстории."
+                 logger.warning("Не удалось извлечь текстовое описание 'Предыстория:' (возможно, конфликт с 'Предыстория (Background):').")
+        else:
+            profile["backstory_text"] = "Не удалось извлечь описание предыстории."
+            logger.warning("Не удалось извлечь текстовое описание 'Предыстория:'. Проверьте структуру ответа LLM.")
+
+
+    return profile
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_corpus(parse_function, corpus):
+    """Возвращает список расхождений (кейс, поле, ожидалось, получено)."""
+    mismatches = []
+    for case in corpus:
+        try:
+            profile = parse_function(case["raw"])
+        except Exception as e:
+            mismatches.append((case["name"], "*", "профиль", f"исключение: {e}"))
+            continue
+        for field, expected in case["expected"].items():
+            if profile.get(field) != expected:
+                mismatches.append((case["name"], field, expected, profile.get(field)))
+    return mismatches
+
+
+def time_parser(parse_function, corpus, iterations):
+    raw_texts = [case["raw"] for case in corpus]
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for raw_text in raw_texts:
+            try:
+                parse_function(raw_text)
+            except Exception:
+                pass
+    elapsed = time.perf_counter() - started
+    return elapsed / (iterations * len(raw_texts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING) # Предупреждения о пропущенных полях ожидаемы на испорченных ответах
+    corpus = load_corpus()
+
+    for title, parse_function in (("текущий", parse_character_profile), ("прежний", legacy_parse_character_profile)):
+        mismatches = check_corpus(parse_function, corpus)
+        per_call = time_parser(parse_function, corpus, args.iterations)
+        print(f"Парсер ({title}): {per_call * 1e6:.1f} мкс на ответ, "
+              f"{len(corpus)} кейсов, расхождений с эталоном: {len(mismatches)}")
+        for case_name, field, expected, actual in mismatches:
+            print(f"    {case_name}.{field}: ожидалось {expected!r}, получено {actual!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Бенчмарк рендеринга PDF листа персонажа.
+
+Сравнивает быстрый рендеринг по шаблону (прямое рисование на canvas) с раскладкой
+platypus: PDF в секунду и средний размер файла на профилях из parser_corpus.json.
+Отдельно показывает, сколько профилей с очень длинной предысторией уходят в раскладку
+platypus как запасной путь.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_pdf [--iterations 200] [--font DejaVuSans.ttf]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import pdf_generator
+from gemini_utils import parse_character_profile, is_profile_complete
+from srd_rules import build_character_sheet
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "parser_corpus.json")
+DEFAULT_FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "DejaVuSans.ttf")
+
+
+def load_profiles(path=CORPUS_PATH):
+    """Полностью разобранные профили корпуса с характеристиками от движка правил."""
+    with open(path, encoding="utf-8") as f:
+        corpus = json.load(f)
+    profiles = []
+    for case in corpus:
+        profile = parse_character_profile(case["raw"])
+        if is_profile_complete(profile):
+            profile["stats"] = build_character_sheet(profile["race"], profile["class"]).text
+            profiles.append(profile)
+    return profiles
+
+
+def platypus_render(character_data):
+    return pdf_generator._build_pdf(pdf_generator._character_sheet_story(character_data))
+
+
+def fast_render(character_data):
+    return pdf_generator._render_fast([character_data]) or platypus_render(character_data)
+
+
+def time_renderer(render_function, profiles, iterations):
+    total_bytes = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for profile in profiles:
+            total_bytes += len(render_function(profile).getvalue())
+    elapsed = time.perf_counter() - started
+    renders = iterations * len(profiles)
+    return renders / elapsed, total_bytes / renders
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--font", default=DEFAULT_FONT_PATH, help="Шрифт TTF с кириллицей")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    pdf_generator.FONT_PATH_FOR_BOT_SESSION = args.font
+    pdf_generator.register_font()
+    profiles = load_profiles()
+
+    print(f"Профилей: {len(profiles)}, итераций: {args.iterations}, шрифт: "
+          f"{'DejaVuSans' if pdf_generator.HAS_DEJAVU_FONT else 'Helvetica'}")
+    for title, render_function in (("шаблон", fast_render), ("platypus", platypus_render)):
+        per_second, average_size = time_renderer(render_function, profiles, args.iterations)
+        print(f"Рендеринг ({title}): {per_second:.1f} PDF/с, средний размер {average_size / 1024:.1f} КБ")
+
+    long_profiles = [dict(profile, backstory_text="\n".join([profile["backstory_text"]] * 40)) for profile in profiles]
+    fallbacks = sum(1 for profile in long_profiles if pdf_generator._render_fast([profile]) is None)
+    print(f"Профили с предысторией в 40 раз длиннее: {fallbacks} из {len(long_profiles)} рендерятся через platypus")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Бенчмарк хранилища ответов диалога /create.
+
+Заполняет ответы для множества одновременных сессий двумя способами: словарями, как в
+context.user_data, и компактным SessionStore. Показывает память по tracemalloc,
+время операций и оценку памяти самого хранилища, затем проверяет вытеснение при
+ограничении числа сессий.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_sessions [--sessions 100000] [--max-sessions 10000]
+"""
+import argparse
+import gc
+import logging
+import random
+import time
+import tracemalloc
+
+from session_store import SessionStore, SESSION_FIELDS
+from telegram_handlers import (
+    srd_races_options, srd_classes_options, srd_backgrounds_options, srd_alignments_options,
+)
+
+CHOICE_OPTIONS = {
+    "race": srd_races_options, "class": srd_classes_options,
+    "background": srd_backgrounds_options, "alignment": srd_alignments_options,
+}
+TEXT_ANSWERS = {
+    "location": ["Портовый город на побережье", "Северные горы", "Лесная деревня у границы королевства"],
+    "stats_preference": ["Сильный и выносливый", "Покупка очков", "Упор на мудрость"],
+    "details": ["Ищет пропавшего брата", "Бывший наёмник, уставший от войны", "Боится темноты"],
+}
+
+
+def make_answers(count, seed=1):
+    """Ответы пользователей: пары (поле, значение), половина текстовых ответов - "Авто" (None)."""
+    rng = random.Random(seed)
+    answers = []
+    for _ in range(count):
+        user_answers = []
+        for field in SESSION_FIELDS:
+            if field in CHOICE_OPTIONS:
+                user_answers.append((field, rng.choice(CHOICE_OPTIONS[field])))
+            else:
+                user_answers.append((field, rng.choice(TEXT_ANSWERS[field]) if rng.random() < 0.5 else None))
+        answers.append(user_answers)
+    return answers
+
+
+def incoming(value):
+    """Текст из нового сообщения Telegram: строка декодируется заново, даже для кнопки клавиатуры."""
+    return None if value is None else value.encode().decode()
+
+
+def fill_user_data(answers):
+    all_user_data = {}
+    for user_id, user_answers in enumerate(answers):
+        user_data = all_user_data[user_id] = {}
+        for field, value in user_answers:
+            user_data[field] = incoming(value)
+    return all_user_data
+
+
+def fill_store(answers, max_sessions):
+    store = SessionStore(max_sessions, idle_timeout=3600, max_text_length=1000)
+    store.register_choices(option for options in CHOICE_OPTIONS.values() for option in options)
+    for user_id, user_answers in enumerate(answers):
+        store.start(user_id)
+        for field, value in user_answers:
+            store.set_answer(user_id, field, incoming(value))
+    return store
+
+
+def measure(fill_function, *args):
+    """Результат fill_function, прирост памяти по tracemalloc в байтах и время в секундах."""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fill_function(*args)
+    elapsed = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, memory, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--max-sessions", type=int, default=10000, help="Предел хранилища для проверки вытеснения")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    answers = make_answers(args.sessions)
+    operations = args.sessions * (len(SESSION_FIELDS) + 1)
+    print(f"Сессий: {args.sessions}, операций записи: {operations}")
+
+    _, dict_memory, dict_elapsed = measure(fill_user_data, answers)
+    print(f"Словари user_data: {dict_memory / 2 ** 20:.1f} МБ, {dict_memory / args.sessions:.0f} Б на сессию, "
+          f"{operations / dict_elapsed / 1e6:.2f} млн оп/с")
+
+    store, store_memory, store_elapsed = measure(fill_store, answers, args.sessions)
+    print(f"SessionStore: {store_memory / 2 ** 20:.1f} МБ, {store_memory / args.sessions:.0f} Б на сессию, "
+          f"{operations / store_elapsed / 1e6:.2f} млн оп/с")
+    print(f"Оценка хранилища: {len(store)} сессий, {store.approximate_bytes / 2 ** 20:.1f} МБ "
+          f"(tracemalloc: {store_memory / 2 ** 20:.1f} МБ)")
+    del store
+
+    bounded_store, bounded_memory, _ = measure(fill_store, answers, args.max_sessions)
+    print(f"С пределом {args.max_sessions}: {len(bounded_store)} сессий, {bounded_memory / 2 ** 20:.1f} МБ, "
+          f"вытеснено {args.sessions - len(bounded_store)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Офлайн нагрузочный тест бота: настоящие обработчики telegram_handlers, планировщик
+запросов и рендеринг PDF, но вместо Gemini - локальная заглушка с настраиваемой
+задержкой, долей ошибок и текстом ответа, а вызовы Bot API перехватываются локально.
+
+Каждый симулированный пользователь проходит весь диалог /create (с --quick - одну
+команду /quick с теми же параметрами). Отчёт: генераций в минуту, p50/p95/p99
+длительности каждого шага диалога и задержка цикла событий.
+Квота API не расходуется.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --users 50 --model-latency 8 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import gemini_utils
+import gemini_scheduler
+import transcript_log
+from gemini_pool import ModelPool, ModelPoolEntry
+from config import (
+    GEMINI_RPM_LIMIT,
+    GEMINI_TPM_LIMIT,
+    GEMINI_QUOTA_COOLDOWN,
+    GEMINI_QUOTA_MAX_WAIT,
+    BOT_CONCURRENT_UPDATES,
+    BOT_MAX_PENDING_UPDATES,
+)
+from pdf_render_pool import shutdown_pdf_render_pool
+from tgbot_main import add_handlers
+from telegram_rate_limiter import create_rate_limiter
+from update_processor import PerUserUpdateProcessor
+from startup import mark_ready
+from profiling import init_profiling
+
+logger = logging.getLogger(__name__)
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "parser_corpus.json")
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "DndBot", "username": "dnd_bot"}
+
+# Шаги диалога /create: (название шага, текст сообщения пользователя)
+CONVERSATION_STEPS = [
+    ("create", "/create"),
+    ("race", "Эльф (Высший)"),
+    ("class", "Волшебник"),
+    ("background", "Мудрец"),
+    ("alignment", "Нейтрально-Добрый"),
+    ("location", "Авто"),
+    ("stats", "Авто"),
+    ("details", "Авто"),
+]
+# Те же параметры одной командой /quick
+QUICK_STEPS = [
+    ("quick", "/quick Эльф Волшебник Мудрец Нейтрально-Добрый"),
+]
+
+
+class StubGeminiModel:
+    """Заглушка модели Gemini: отвечает заданным текстом с задержкой и случайными ошибками."""
+
+    def __init__(self, response_text, latency, jitter, error_rate, chunks=8):
+        self.response_text = response_text
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.calls = 0
+        self.errors = 0
+
+    def _response_for(self, generation_config):
+        if getattr(generation_config, "response_mime_type", None) == "application/json":
+            return json.dumps(gemini_utils.parse_character_profile(self.response_text), ensure_ascii=False)
+        return self.response_text
+
+    def _next_latency(self):
+        return max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter))
+
+    async def generate_content_async(self, contents=None, generation_config=None, stream=False, **kwargs):
+        self.calls += 1
+        latency = self._next_latency()
+        if random.random() < self.error_rate:
+            await asyncio.sleep(latency)
+            self.errors += 1
+            raise RuntimeError("500 Internal error (заглушка)")
+        text = self._response_for(generation_config)
+        if not stream:
+            await asyncio.sleep(latency)
+            return StubResponse(text)
+        return StubResponse(text, latency, self.chunks)
+
+
+class StubResponse:
+    """Ответ в форме, которую ожидает gemini_utils._extract_generated_text; при потоке - асинхронный итератор."""
+
+    def __init__(self, text, stream_latency=0.0, chunks=1):
+        self.text = text
+        self.parts = [SimpleNamespace(text=text)]
+        self.prompt_feedback = None
+        self.candidates = [SimpleNamespace(finish_reason=SimpleNamespace(name="STOP"), safety_ratings=[])]
+        self._stream_latency = stream_latency
+        self._chunks = chunks
+
+    async def __aiter__(self):
+        chunk_size = max(1, len(self.text) // self._chunks + 1)
+        for start in range(0, len(self.text), chunk_size):
+            await asyncio.sleep(self._stream_latency / self._chunks)
+            yield SimpleNamespace(text=self.text[start:start + chunk_size])
+
+
+class CapturingRequest(BaseRequest):
+    """Перехватывает вызовы Bot API: запоминает метод и отвечает правдоподобным результатом."""
+
+    def __init__(self, api_latency=0.0):
+        self.api_latency = api_latency
+        self.calls = {}
+        self._message_ids = itertools.count(1000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        parameters = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method in ("sendMessage", "editMessageText", "sendDocument"):
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(parameters.get("chat_id", 0)), "type": "private"},
+                "from": BOT_USER,
+                "text": parameters.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+class LoopLagMonitor:
+    """Замеряет, насколько позже запланированного просыпается задача в цикле событий."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _make_update(update_id, user_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def simulate_user(application, user_id, update_ids, think_time, step_latencies, steps):
+    for step_name, text in steps:
+        await asyncio.sleep(random.uniform(0, think_time))
+        update = Update.de_json(_make_update(next(update_ids), user_id, text), application.bot)
+        started = time.perf_counter()
+        # Тот же путь, что у обновлений из Updater/вебхука: через процессор обновлений
+        await application.update_processor.process_update(update, application.process_update(update))
+        step_latencies[step_name].append(time.perf_counter() - started)
+
+
+def build_stub_pool(stub_model, keys, rpm):
+    """
+    Пул, в котором все пары отвечают заглушкой. При keys > 1 пул сначала строит настоящий
+    init_gemini с фиктивными ключами (без обращений к сети): проверяется создание клиентов
+    дополнительных ключей, синхронных и асинхронных. Затем модели пар заменяются заглушкой.
+    """
+    if keys <= 1:
+        return ModelPool([ModelPoolEntry("stub", "stub", stub_model)], rpm, GEMINI_QUOTA_COOLDOWN)
+    gemini_utils.GOOGLE_API_KEYS = [f"load-test-key-{key_index + 1}" for key_index in range(keys)]
+    if not gemini_utils.init_gemini():
+        raise RuntimeError(f"init_gemini не смог построить пул из {keys} ключей")
+    real_pool = gemini_utils.get_model_pool()
+    for entry in real_pool.entries:
+        entry.async_model()
+        entry.async_model("системная инструкция нагрузочного теста")
+    logger.warning(f"Пул init_gemini построен: {real_pool.size} пар, клиенты всех ключей созданы.")
+    return ModelPool([ModelPoolEntry(entry.key_id, entry.model_name, stub_model) for entry in real_pool.entries],
+                     rpm, GEMINI_QUOTA_COOLDOWN)
+
+
+async def run_load_test(args):
+    with open(args.response_file or CORPUS_PATH, encoding="utf-8") as f:
+        response_text = f.read() if args.response_file else json.load(f)[0]["raw"]
+    stub_model = StubGeminiModel(response_text, args.model_latency, args.latency_jitter, args.error_rate)
+    gemini_utils.use_model_pool(build_stub_pool(stub_model, args.keys, args.rpm))
+    gemini_scheduler._scheduler = gemini_scheduler.GeminiScheduler(
+        args.rpm, GEMINI_TPM_LIMIT, GEMINI_QUOTA_COOLDOWN, GEMINI_QUOTA_MAX_WAIT)
+    transcript_dir = tempfile.mkdtemp(prefix="dndbot_load_test_")
+    transcript_log._writer = transcript_log.TranscriptWriter(transcript_dir, 64 * 1024 * 1024, 3600, 2)
+    # В боте эти модули загружает фоновый прогрев; здесь - до начала замеров
+    gemini_utils.load_genai()
+    importlib.import_module("pdf_generator")
+    mark_ready()
+    init_profiling() # PROFILING_SAMPLE_RATE и SLOW_CALLBACK_THRESHOLD работают и в нагрузочном тесте
+
+    bot_request = CapturingRequest(args.api_latency)
+    application = (
+        Application.builder()
+        .token("123456:LOAD-TEST")
+        .request(bot_request)
+        .get_updates_request(CapturingRequest())
+        .rate_limiter(create_rate_limiter())
+        .concurrent_updates(PerUserUpdateProcessor(args.workers, BOT_MAX_PENDING_UPDATES))
+        .build()
+    )
+    add_handlers(application)
+
+    steps = QUICK_STEPS if args.quick else CONVERSATION_STEPS
+    step_latencies = {step_name: [] for step_name, _ in steps}
+    lag_monitor = LoopLagMonitor()
+    update_ids = itertools.count(1)
+    async with application:
+        lag_monitor.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            simulate_user(application, 100000 + user_index, update_ids, args.think_time, step_latencies, steps)
+            for user_index in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        lag_monitor.stop()
+        await transcript_log._writer.close()
+    await shutdown_pdf_render_pool()
+
+    print(f"Пользователей: {args.users}, обработчиков: {args.workers}, RPM: {args.rpm}, "
+          f"задержка модели: {args.model_latency}±{args.latency_jitter} с, доля ошибок: {args.error_rate}")
+    print(f"Время прогона: {elapsed:.1f} с, генераций в минуту: {args.users / elapsed * 60:.1f}")
+    print(f"Запросов к модели: {stub_model.calls} (ошибок: {stub_model.errors}), "
+          f"вызовов Bot API: {sum(bot_request.calls.values())} {dict(sorted(bot_request.calls.items()))}")
+    print(f"{'шаг':<12}{'p50, с':>10}{'p95, с':>10}{'p99, с':>10}{'макс, с':>10}")
+    for step_name, latencies in step_latencies.items():
+        print(f"{step_name:<12}{_percentile(latencies, 50):>10.3f}{_percentile(latencies, 95):>10.3f}"
+              f"{_percentile(latencies, 99):>10.3f}{max(latencies):>10.3f}")
+    lags = lag_monitor.lags or [0.0]
+    print(f"Задержка цикла событий: среднее {statistics.mean(lags) * 1000:.1f} мс, "
+          f"p99 {_percentile(lags, 99) * 1000:.1f} мс, макс {max(lags) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн нагрузочный тест бота с заглушкой Gemini.")
+    parser.add_argument("--users", type=int, default=20, help="Число симулированных пользователей")
+    parser.add_argument("--workers", type=int, default=max(1, BOT_CONCURRENT_UPDATES),
+                        help="Число одновременно обрабатываемых обновлений")
+    parser.add_argument("--rpm", type=int, default=GEMINI_RPM_LIMIT, help="Лимит запросов к модели в минуту")
+    parser.add_argument("--model-latency", type=float, default=5.0, help="Средняя задержка ответа модели, с")
+    parser.add_argument("--latency-jitter", type=float, default=2.0, help="Разброс задержки модели, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля запросов, завершающихся ошибкой")
+    parser.add_argument("--response-file", help="Файл с текстом ответа модели (по умолчанию - из parser_corpus.json)")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Задержка ответа Bot API, с")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Максимальная пауза пользователя между шагами, с")
+    parser.add_argument("--keys", type=int, default=1,
+                        help="Число ключей API: при 2 и более пул строится настоящим init_gemini с фиктивными ключами")
+    parser.add_argument("--quick", action="store_true", help="Создавать персонажа командой /quick вместо диалога")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(args.seed)
+    asyncio.run(run_load_test(args))
+
+
+if __name__ == "__main__":
+    main()
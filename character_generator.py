@@ -1,25 +1,180 @@
 
 # character_generator.py
+import asyncio
 import logging
-import os
+import re
 from config import (
-    TEXT_OUTPUT_DIR,
     GEMINI_MODEL_NAME,
-    SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX
+    GEMINI_EXPECTED_OUTPUT_TOKENS,
+    GEMINI_OUTPUT_FORMAT,
+    GEMINI_SYSTEM_INSTRUCTION,
+    SRD_RULES_ENABLED,
+    PROFILE_REPAIR_ENABLED,
+    PROFILE_REPAIR_MAX_FIELDS,
+    SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX,
+    SYSTEM_MESSAGE_FULL_CHAR_GEMINI_JSON_PREFIX,
+    SYSTEM_MESSAGE_PROFILE_REPAIR
 )
 from gemini_utils import (
-    generate_content_with_gemini,
     parse_character_profile,
-    get_timestamp_filename
+    parse_character_profile_json,
+    format_character_profile,
+    is_profile_complete,
+    record_profile_decode,
+    profile_fields_to_repair,
+    profile_repair_schema,
+    parse_profile_repair_json,
+    PROFILE_JSON_SCHEMA,
+    PROFILE_JSON_FIELDS,
+    MISSING_FIELD_VALUE,
+    count_prompt_tokens
 )
-from pdf_generator import create_character_sheet_pdf 
+from gemini_scheduler import get_gemini_scheduler
+from srd_rules import build_character_sheets
+from transcript_log import get_transcript_writer
+from pdf_render_pool import render_character_pdf, render_party_pdf
+from metrics import STAGE_SECONDS, PROFILE_REPAIRS
+from profiling import sampled_profile
 
 logger = logging.getLogger(__name__)
 
-async def generate_dnd_character_profile_for_bot(
-    user_race=None, user_class=None, user_background=None, user_alignment=None,
-    user_location=None, user_stats_preference=None, user_details="", user_id="unknown_user"
-):
+LLM_ERROR_PREFIXES = ("ЗАПРОС ЗАБЛОКИРОВАН", "КОНТЕНТ ЗАБЛОКИРОВАН", "ОШИБКА API", "Модель не вернула", "Модель вернула пустой")
+PARTY_SEPARATOR_RE = re.compile(r"^\s*=+\s*Персонаж\s*\d+\s*=+\s*$", re.MULTILINE | re.UNICODE)
+REPAIR_OUTPUT_TOKENS_PER_FIELD = 150  # оценка длины ответа дозапроса для планировщика
+
+def _save_llm_transcript(user_id, system_prompt, user_request_string, raw_llm_response, temperature=0.85, route_info=None):
+    # Ответ LLM уходит в фоновый журнал; системный промпт хранится в журнале один раз на версию.
+    # route_info - какая пара ключ/модель пула ответила (см. generate_content_with_gemini_async)
+    route_info = route_info or {}
+    get_transcript_writer().record(user_id, route_info.get("model", GEMINI_MODEL_NAME), temperature, system_prompt,
+                                   user_request_string, raw_llm_response, routing=route_info)
+    logger.info(f"Сырой текстовый результат для user_id {user_id} передан в журнал LLM.")
+
+def _prompt_with_system(system_prompt, user_request_string):
+    """
+    Части промпта и системная инструкция для запроса. Неизменный системный промпт
+    передаётся модели отдельно (GEMINI_SYSTEM_INSTRUCTION), чтобы не отправлять его
+    одним сообщением с каждым запросом; иначе он склеивается с запросом пользователя.
+    """
+    if GEMINI_SYSTEM_INSTRUCTION:
+        return [user_request_string], system_prompt
+    return [system_prompt + user_request_string], None
+
+def _apply_srd_rules(profiles, stats_preference=None):
+    """Заполняет характеристики, хиты и КД профилей локальным расчётом по правилам SRD по их расе и классу."""
+    if not SRD_RULES_ENABLED:
+        return
+    sheets = build_character_sheets([(profile.get("race"), profile.get("class")) for profile in profiles], stats_preference)
+    for profile, sheet in zip(profiles, sheets):
+        profile["stats"] = sheet.text
+
+async def _repair_profile(profile, user_id, on_queue_position=None):
+    """
+    Дозапрашивает у модели только недостающие или испорченные поля профиля, передавая
+    уже разобранные поля как контекст, и вписывает ответ в profile.
+    Возвращает число восстановленных полей.
+    """
+    fields = profile_fields_to_repair(profile)
+    if not PROFILE_REPAIR_ENABLED or not fields:
+        return 0
+    if len(fields) > PROFILE_REPAIR_MAX_FIELDS:
+        logger.warning(f"В профиле для user_id {user_id} не хватает {len(fields)} полей, дозапрос не выполняется.")
+        return 0
+
+    missing_keys = {field_en for _, field_en in fields}
+    known_fields = "\n".join(f"{field_ru}: {profile[field_en]}" for field_ru, field_en in PROFILE_JSON_FIELDS
+                             if field_en not in missing_keys and profile.get(field_en) not in (None, MISSING_FIELD_VALUE))
+    user_request_string = (f"Профиль персонажа:\n{known_fields}\n\n"
+                           f"Недостающие поля: {', '.join(field_ru for field_ru, _ in fields)}.")
+    logger.info(f"Дозапрос полей профиля для user_id {user_id}: {', '.join(sorted(missing_keys))}.")
+
+    route_info = {}
+    with STAGE_SECONDS.time(stage="repair"):
+        raw_llm_response = await get_gemini_scheduler().submit(
+            user_id, [user_request_string], temperature=0.85, on_queue_position=on_queue_position,
+            expected_output_tokens=REPAIR_OUTPUT_TOKENS_PER_FIELD * len(fields),
+            response_schema=profile_repair_schema(fields), route_info=route_info,
+            system_instruction=SYSTEM_MESSAGE_PROFILE_REPAIR
+        )
+    if not raw_llm_response or raw_llm_response.startswith(LLM_ERROR_PREFIXES):
+        logger.error(f"Дозапрос полей профиля для user_id {user_id} не удался. Ответ: {raw_llm_response}")
+        PROFILE_REPAIRS.inc(result="failed")
+        return 0
+    _save_llm_transcript(user_id, SYSTEM_MESSAGE_PROFILE_REPAIR, user_request_string, raw_llm_response,
+                         route_info=route_info)
+
+    values = parse_profile_repair_json(raw_llm_response, fields)
+    profile.update(values)
+    PROFILE_REPAIRS.inc(result="repaired" if len(values) == len(fields) else "partial" if values else "failed")
+    logger.info(f"Восстановлено полей профиля для user_id {user_id}: {len(values)} из {len(fields)}.")
+    return len(values)
+
+def _profile_text(raw_llm_response, parsed_profile, repaired=False):
+    """
+    Текст профиля для пользователя: с характеристиками, если их рассчитал движок правил,
+    и с восстановленными дозапросом полями.
+    """
+    if not SRD_RULES_ENABLED and not repaired:
+        return raw_llm_response
+    if is_profile_complete(parsed_profile):
+        return format_character_profile(parsed_profile)
+    if not SRD_RULES_ENABLED:
+        return raw_llm_response
+    return f"{raw_llm_response}\n\nХарактеристики: {parsed_profile['stats']}"
+
+async def log_prompt_token_counts():
+    """Пишет в лог число входных токенов типового запроса со склеенным промптом и с системной инструкцией."""
+    user_request_string = build_character_request_string()
+    try:
+        inline_tokens = await count_prompt_tokens([SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX + user_request_string])
+        request_tokens = await count_prompt_tokens([user_request_string])
+        instruction_tokens = await count_prompt_tokens([user_request_string], SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX)
+    except Exception as e:
+        logger.warning(f"Не удалось подсчитать токены промпта: {e}")
+        return
+    logger.info(f"Токены типового запроса: промпт одним сообщением - {inline_tokens}, "
+                f"с системной инструкцией - {instruction_tokens}, из них запрос пользователя - {request_tokens}, "
+                f"неизменная часть - {instruction_tokens - request_tokens}.")
+
+async def _generate_profile_json(user_request_string, user_id, on_queue_position, stats_preference=None):
+    """
+    Генерация в режиме структурированного ответа (JSON по PROFILE_JSON_SCHEMA).
+    Возвращает результат генерации или None, если JSON не удалось разобрать
+    (тогда вызывающий код повторяет запрос в текстовом формате).
+    Потоковый показ не используется: фрагменты JSON не читаемы для пользователя.
+    """
+    full_prompt_for_gemini, system_instruction = _prompt_with_system(SYSTEM_MESSAGE_FULL_CHAR_GEMINI_JSON_PREFIX,
+                                                                     user_request_string)
+    route_info = {}
+    raw_llm_response = await get_gemini_scheduler().submit(
+        user_id, full_prompt_for_gemini, temperature=0.85, on_queue_position=on_queue_position,
+        response_schema=PROFILE_JSON_SCHEMA, route_info=route_info, system_instruction=system_instruction
+    )
+
+    if not raw_llm_response or raw_llm_response.startswith(LLM_ERROR_PREFIXES):
+        # Блокировку или ошибку API текстовый формат не исправит
+        logger.error(f"Не удалось получить валидный ответ от LLM для user_id {user_id}. Ответ: {raw_llm_response}")
+        return {"text_profile": raw_llm_response, "pdf_buffer": None, "parsed_data": None}
+
+    _save_llm_transcript(user_id, SYSTEM_MESSAGE_FULL_CHAR_GEMINI_JSON_PREFIX, user_request_string, raw_llm_response,
+                         route_info=route_info)
+
+    with STAGE_SECONDS.time(stage="parse"):
+        parsed_profile = parse_character_profile_json(raw_llm_response)
+    record_profile_decode("json", parsed_profile is not None)
+    if parsed_profile is None:
+        return None
+    _apply_srd_rules([parsed_profile], stats_preference)
+
+    return {
+        "text_profile": format_character_profile(parsed_profile),
+        "pdf_buffer": await render_character_pdf(parsed_profile),
+        "parsed_data": parsed_profile
+    }
+
+def build_character_request_string(user_race=None, user_class=None, user_background=None, user_alignment=None,
+                                   user_location=None, user_stats_preference=None, user_details=""):
+    """Изменяемая часть промпта: параметры персонажа, выбранные пользователем."""
     user_request_parts = ["Сгенерируй полного персонажа D&D 5e (SRD)."]
     def add_param(label, value, default_text_llm):
         if value: user_request_parts.append(f"{label}: {value} (из SRD 5.1, если применимо).")
@@ -33,46 +188,62 @@ async def generate_dnd_character_profile_for_bot(
     if user_location: user_request_parts.append(f"Происхождение/Локация: {user_location}.")
     else: user_request_parts.append("Происхождение/Локация: Придумай подходящее.")
 
-    if user_stats_preference: user_request_parts.append(f"Пожелания по характеристикам: {user_stats_preference}.")
-    else: user_request_parts.append("Пожелания по характеристикам: Сбалансированное распределение.")
+    # С движком правил характеристики считаются локально, модели пожелания к ним не нужны
+    if not SRD_RULES_ENABLED:
+        if user_stats_preference: user_request_parts.append(f"Пожелания по характеристикам: {user_stats_preference}.")
+        else: user_request_parts.append("Пожелания по характеристикам: Сбалансированное распределение.")
 
     if user_details: user_request_parts.append(f"Дополнительные детали/пожелания к текстовой предыстории и характеру: {user_details}")
 
     user_request_parts.append("\nПредставь результат в указанном структурированном формате, включая Черту Характера, Идеал, Привязанность и Слабость.")
-    user_request_string = "\n".join(user_request_parts)
+    return "\n".join(user_request_parts)
 
-    full_prompt_for_gemini = [SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX + user_request_string]
+@sampled_profile
+async def generate_dnd_character_profile_for_bot(
+    user_race=None, user_class=None, user_background=None, user_alignment=None,
+    user_location=None, user_stats_preference=None, user_details="", user_id="unknown_user",
+    on_queue_position=None, on_partial_text=None
+):
+    user_request_string = build_character_request_string(user_race, user_class, user_background, user_alignment,
+                                                         user_location, user_stats_preference, user_details)
 
     logger.info(f"Запрос на генерацию от user_id: {user_id}. Параметры: Раса='{user_race}', Класс='{user_class}', Фон='{user_background}', Мировоззрение='{user_alignment}', Локация='{user_location}', Статы='{user_stats_preference}', Детали='{user_details}'")
 
-    raw_llm_response = generate_content_with_gemini(full_prompt_for_gemini, temperature=0.85)
+    if GEMINI_OUTPUT_FORMAT == "json":
+        json_result = await _generate_profile_json(user_request_string, user_id, on_queue_position,
+                                                   user_stats_preference)
+        if json_result is not None:
+            return json_result
+        logger.warning(f"JSON-ответ для user_id {user_id} не разобран, повторяем запрос в текстовом формате.")
+
+    full_prompt_for_gemini, system_instruction = _prompt_with_system(SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX,
+                                                                     user_request_string)
+
+    route_info = {}
+    raw_llm_response = await get_gemini_scheduler().submit(
+        user_id, full_prompt_for_gemini, temperature=0.85, on_queue_position=on_queue_position,
+        on_partial_text=on_partial_text, route_info=route_info, system_instruction=system_instruction
+    )
 
     pdf_buffer_to_return = None # Инициализируем буфер для возврата
 
-    if raw_llm_response and not raw_llm_response.startswith(("ЗАПРОС ЗАБЛОКИРОВАН", "КОНТЕНТ ЗАБЛОКИРОВАН", "ОШИБКА API", "Модель не вернула", "Модель вернула пустой")):
-        # Сохранение текстового файла ответа LLM 
-        text_filename_base = f"character_profile_text_{user_id}"
-        text_filename_ts = get_timestamp_filename(text_filename_base, "txt", GEMINI_MODEL_NAME)
-        text_filepath = os.path.join(TEXT_OUTPUT_DIR, text_filename_ts)
-        try:
-            with open(text_filepath, "w", encoding="utf-8") as f:
-                f.write(f"UserID: {user_id}\nМодель: {GEMINI_MODEL_NAME}\nТемпература: 0.85\n\n")
-                f.write(f"--- ЗАПРОС ПОЛЬЗОВАТЕЛЯ (обработанный) ---\n{user_request_string}\n\n")
-                f.write(f"--- ПОЛНЫЙ ПРОМПТ ДЛЯ GEMINI ---\n{full_prompt_for_gemini[0]}\n\n")
-                f.write(f"--- ОТВЕТ LLM (СЫРОЙ) ---\n{raw_llm_response}")
-            logger.info(f"Сырой текстовый результат для user_id {user_id} сохранен в: {text_filepath}")
-        except Exception as e_save_text:
-            logger.error(f"Ошибка при сохранении текстового файла {text_filepath}: {e_save_text}")
-
-        parsed_profile = parse_character_profile(raw_llm_response)
+    if raw_llm_response and not raw_llm_response.startswith(LLM_ERROR_PREFIXES):
+        _save_llm_transcript(user_id, SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX, user_request_string, raw_llm_response,
+                             route_info=route_info)
+
+        with STAGE_SECONDS.time(stage="parse"):
+            parsed_profile = parse_character_profile(raw_llm_response)
+        record_profile_decode("text", is_profile_complete(parsed_profile))
+        repaired = await _repair_profile(parsed_profile, user_id, on_queue_position)
+        _apply_srd_rules([parsed_profile], user_stats_preference)
 
         if parsed_profile: # Только если парсинг был успешным
             # Генерация PDF в памяти
-            pdf_buffer_to_return = create_character_sheet_pdf(parsed_profile)
+            pdf_buffer_to_return = await render_character_pdf(parsed_profile)
 
 
         return {
-            "text_profile": raw_llm_response,
+            "text_profile": _profile_text(raw_llm_response, parsed_profile, repaired),
             "pdf_buffer": pdf_buffer_to_return, # Возвращаем буфер
             "parsed_data": parsed_profile
         }
@@ -83,3 +254,60 @@ async def generate_dnd_character_profile_for_bot(
             "pdf_buffer": None, # Возвращаем None для буфера
             "parsed_data": None
         }
+
+
+def split_party_response(raw_text):
+    """Делит ответ модели с несколькими персонажами на тексты отдельных персонажей."""
+    return [part.strip() for part in PARTY_SEPARATOR_RE.split(raw_text) if "Имя:" in part]
+
+@sampled_profile
+async def generate_dnd_party_for_bot(party_size, user_id="unknown_user", on_queue_position=None):
+    """
+    Генерирует группу из party_size персонажей одним запросом к модели:
+    системный промпт отправляется один раз на всю группу.
+    Возвращает тексты персонажей, их разобранные профили и общий многостраничный PDF.
+    """
+    user_request_parts = [
+        f"Сгенерируй группу (партию) из {party_size} разных персонажей D&D 5e (SRD), которые хорошо дополняют друг друга в приключении.",
+        "Все параметры (раса, класс, предыстория, мировоззрение) выбери сам, избегая повторов классов.",
+        f"Перед каждым персонажем напиши отдельную строку-разделитель вида \"=== Персонаж N ===\", где N - номер от 1 до {party_size}.",
+        "\nКаждого персонажа представь в указанном структурированном формате, включая Черту Характера, Идеал, Привязанность и Слабость.",
+    ]
+    user_request_string = "\n".join(user_request_parts)
+    full_prompt_for_gemini, system_instruction = _prompt_with_system(SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX,
+                                                                     user_request_string)
+
+    logger.info(f"Запрос на генерацию группы из {party_size} персонажей от user_id: {user_id}.")
+
+    route_info = {}
+    raw_llm_response = await get_gemini_scheduler().submit(
+        user_id, full_prompt_for_gemini, temperature=0.85, on_queue_position=on_queue_position,
+        expected_output_tokens=GEMINI_EXPECTED_OUTPUT_TOKENS * party_size, route_info=route_info,
+        system_instruction=system_instruction
+    )
+
+    if not raw_llm_response or raw_llm_response.startswith(LLM_ERROR_PREFIXES):
+        logger.error(f"Не удалось получить валидный ответ от LLM для группы user_id {user_id}. Ответ: {raw_llm_response}")
+        return {"text_profiles": [], "error": raw_llm_response, "pdf_buffer": None, "parsed_data": []}
+
+    _save_llm_transcript(user_id, SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX, user_request_string, raw_llm_response,
+                         route_info=route_info)
+
+    text_profiles = split_party_response(raw_llm_response)
+    if len(text_profiles) != party_size:
+        logger.warning(f"Ожидалось {party_size} персонажей, в ответе LLM найдено {len(text_profiles)}.")
+    parsed_profiles = [parse_character_profile(text_profile) for text_profile in text_profiles]
+    repaired_counts = await asyncio.gather(*(_repair_profile(parsed_profile, user_id, on_queue_position)
+                                             for parsed_profile in parsed_profiles))
+    _apply_srd_rules(parsed_profiles)
+    text_profiles = [_profile_text(text_profile, parsed_profile, repaired)
+                     for text_profile, parsed_profile, repaired in zip(text_profiles, parsed_profiles, repaired_counts)]
+
+    pdf_buffer_to_return = await render_party_pdf(parsed_profiles) if parsed_profiles else None
+
+    return {
+        "text_profiles": text_profiles,
+        "error": None if text_profiles else raw_llm_response,
+        "pdf_buffer": pdf_buffer_to_return,
+        "parsed_data": parsed_profiles
+    }
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+from config import (
+    CHARACTER_POOL_ENABLED,
+    CHARACTER_POOL_SIZE,
+    CHARACTER_POOL_POPULAR_KEYS,
+    CHARACTER_POOL_REFILL_INTERVAL,
+    CHARACTER_POOL_IDLE_ONLY,
+    CHARACTER_POOL_MAX_QUOTA_SHARE,
+    GEMINI_RPM_LIMIT,
+)
+from character_generator import generate_dnd_character_profile_for_bot
+from gemini_scheduler import get_gemini_scheduler
+from metrics import Gauge
+from startup import is_ready
+
+logger = logging.getLogger(__name__)
+
+POOL_USER_ID = "character_pool"
+ALL_AUTO_KEY = (None, None, None, None)
+MAX_TRACKED_DEMAND_KEYS = 1000
+
+
+class CharacterPool:
+    """
+    Пул заранее сгенерированных персонажей (текст, разобранный профиль и PDF).
+    Ключ - кортеж (раса, класс, предыстория, мировоззрение), None означает "Авто".
+    Всегда пополняется ключ "всё Авто" и несколько самых востребованных ключей.
+    Каждый персонаж выдаётся только одному пользователю.
+    """
+
+    def __init__(self, size_per_key, popular_keys, refill_interval, idle_only, max_generations_per_minute):
+        self._size_per_key = size_per_key
+        self._popular_keys = popular_keys
+        self._refill_interval = refill_interval
+        self._idle_only = idle_only
+        self._max_generations_per_minute = max_generations_per_minute
+        self._characters = {}  # ключ -> deque готовых результатов генерации
+        self._demand = Counter()
+        self._recent_generations = deque()
+        self._refill_task = None
+
+    def take(self, key):
+        """Забирает готового персонажа для ключа или возвращает None."""
+        self._demand[key] += 1
+        if len(self._demand) > MAX_TRACKED_DEMAND_KEYS:
+            self._demand = Counter(dict(self._demand.most_common(MAX_TRACKED_DEMAND_KEYS // 10)))
+        pooled_characters = self._characters.get(key)
+        if not pooled_characters:
+            return None
+        logger.info(f"Персонаж выдан из пула для ключа {key}. Осталось: {len(pooled_characters) - 1}.")
+        return pooled_characters.popleft()
+
+    def size(self, key=None):
+        if key is not None:
+            return len(self._characters.get(key, ()))
+        return sum(len(pooled_characters) for pooled_characters in self._characters.values())
+
+    def _target_keys(self):
+        popular = [key for key, _ in self._demand.most_common(self._popular_keys + 1) if key != ALL_AUTO_KEY]
+        return [ALL_AUTO_KEY] + popular[:self._popular_keys]
+
+    def _next_key_to_refill(self):
+        for key in self._target_keys():
+            if self.size(key) < self._size_per_key:
+                return key
+        return None
+
+    def _quota_allows_generation(self):
+        now = time.monotonic()
+        while self._recent_generations and now - self._recent_generations[0] > 60:
+            self._recent_generations.popleft()
+        return len(self._recent_generations) < self._max_generations_per_minute
+
+    async def _refill_once(self):
+        if not is_ready(): # Модели ещё готовятся после запуска
+            return
+        key = self._next_key_to_refill()
+        if key is None:
+            return
+        if self._idle_only and not get_gemini_scheduler().is_idle:
+            return
+        if not self._quota_allows_generation():
+            return
+
+        self._recent_generations.append(time.monotonic())
+        race, char_class, background, alignment = key
+        result = await generate_dnd_character_profile_for_bot(
+            user_race=race, user_class=char_class, user_background=background,
+            user_alignment=alignment, user_id=POOL_USER_ID
+        )
+        if result.get("parsed_data") and result.get("pdf_buffer"):
+            self._characters.setdefault(key, deque()).append(result)
+            logger.info(f"Пул персонажей пополнен для ключа {key}: {self.size(key)}/{self._size_per_key}.")
+        else:
+            logger.warning(f"Не удалось пополнить пул персонажей для ключа {key}: {result.get('text_profile')}")
+
+    async def _refill_loop(self):
+        while True:
+            await asyncio.sleep(self._refill_interval)
+            try:
+                await self._refill_once()
+            except Exception as e:
+                logger.error(f"Ошибка при пополнении пула персонажей: {e}")
+
+    def start(self):
+        if self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill_loop())
+            logger.info(f"Пул персонажей запущен: до {self._size_per_key} на ключ, "
+                        f"не более {self._max_generations_per_minute} генераций в минуту.")
+
+    async def stop(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+
+
+_pool = None
+
+Gauge("dndbot_character_pool_size", "Готовые персонажи в пуле.", lambda: _pool.size() if _pool else 0)
+
+def get_character_pool():
+    global _pool
+    if _pool is None:
+        max_generations_per_minute = max(1, int(GEMINI_RPM_LIMIT * CHARACTER_POOL_MAX_QUOTA_SHARE))
+        _pool = CharacterPool(CHARACTER_POOL_SIZE, CHARACTER_POOL_POPULAR_KEYS, CHARACTER_POOL_REFILL_INTERVAL,
+                              CHARACTER_POOL_IDLE_ONLY, max_generations_per_minute)
+    return _pool
+
+def take_pooled_character(race=None, char_class=None, background=None, alignment=None,
+                          location=None, stats_preference=None, details=None):
+    """
+    Возвращает готового персонажа из пула, если запрос не содержит пользовательских
+    пожеланий (локация, характеристики, детали), иначе None.
+    """
+    if not CHARACTER_POOL_ENABLED or location or stats_preference or details:
+        return None
+    return get_character_pool().take((race, char_class, background, alignment))
@@ -3,14 +3,165 @@ import os
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GEMINI_MODEL_NAME = "gemini-1.5-flash-latest"
+# Пул ключей и моделей: несколько ключей через запятую (по умолчанию - GOOGLE_API_KEY)
+# и несколько моделей через запятую (по умолчанию - GEMINI_MODEL_NAME); у каждой пары своя квота
+GOOGLE_API_KEYS = [key.strip() for key in os.getenv("GOOGLE_API_KEYS", GOOGLE_API_KEY or "").split(",") if key.strip()]
+GEMINI_MODEL_NAMES = [name.strip() for name in os.getenv("GEMINI_MODEL_NAMES", GEMINI_MODEL_NAME).split(",") if name.strip()]
+# На сколько секунд пара ключ/модель исключается из пула после ошибки квоты (429)
+GEMINI_KEY_QUARANTINE_SECONDS = float(os.getenv("GEMINI_KEY_QUARANTINE_SECONDS", "60"))
+# Максимальное число одновременных запросов к Gemini из асинхронного пути
+GEMINI_MAX_CONCURRENT_REQUESTS = int(os.getenv("GEMINI_MAX_CONCURRENT_REQUESTS", "8"))
+# Лимиты квоты Gemini (запросов и токенов в минуту) на одну пару ключ/модель пула
+GEMINI_RPM_LIMIT = int(os.getenv("GEMINI_RPM_LIMIT", "15"))
+GEMINI_TPM_LIMIT = int(os.getenv("GEMINI_TPM_LIMIT", "1000000"))
+# Ожидаемое число токенов ответа, учитываемое при резервировании TPM
+GEMINI_EXPECTED_OUTPUT_TOKENS = int(os.getenv("GEMINI_EXPECTED_OUTPUT_TOKENS", "800"))
+# Пауза (сек.) после ошибки квоты и максимальное время ожидания восстановления квоты
+GEMINI_QUOTA_COOLDOWN = float(os.getenv("GEMINI_QUOTA_COOLDOWN", "60"))
+GEMINI_QUOTA_MAX_WAIT = float(os.getenv("GEMINI_QUOTA_MAX_WAIT", "600"))
+# Общий срок (сек.) на запрос к Gemini со всеми повторами и предел ожидания ответа попытки:
+# при потоке - первого фрагмента и каждого следующего
+GEMINI_REQUEST_DEADLINE = float(os.getenv("GEMINI_REQUEST_DEADLINE", "90"))
+GEMINI_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "45"))
+# Экспоненциальная пауза между повторами (со случайным разбросом): начальная и максимальная, сек.
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "2"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "20"))
+# Дублирующий (hedged) запрос, если ответа нет дольше заданного перцентиля задержки
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "1") == "1"
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+# Задержка дублирования (сек.), пока замеров меньше GEMINI_HEDGE_MIN_SAMPLES, и нижняя граница задержки
+GEMINI_HEDGE_DEFAULT_DELAY = float(os.getenv("GEMINI_HEDGE_DEFAULT_DELAY", "15"))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "2"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+# Доля запросов, которые разрешено дублировать (чтобы дубли не съедали квоту)
+GEMINI_HEDGE_BUDGET = float(os.getenv("GEMINI_HEDGE_BUDGET", "0.1"))
+# Автомат защиты: при доле ошибок выше порога за окно запросы отклоняются сразу на заданное время
+GEMINI_BREAKER_ERROR_RATE = float(os.getenv("GEMINI_BREAKER_ERROR_RATE", "0.5"))
+GEMINI_BREAKER_MIN_REQUESTS = int(os.getenv("GEMINI_BREAKER_MIN_REQUESTS", "10"))
+GEMINI_BREAKER_WINDOW = float(os.getenv("GEMINI_BREAKER_WINDOW", "60"))
+GEMINI_BREAKER_OPEN_SECONDS = float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", "30"))
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Способ получения обновлений: "polling" или "webhook" (встроенный HTTP-сервер)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Настройки режима вебхука
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Публичный адрес бота (например, https://bot.example.com); если пуст, вебхук в Telegram не регистрируется
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+
+# Лимиты исходящих запросов к Bot API: всего в секунду; интервал (сек.) между сообщениями в личный чат
+# после серии из TELEGRAM_CHAT_BURST сообщений подряд; сообщений в минуту в группу;
+# срок показа действия "печатает..." и число повторов после RetryAfter
+TELEGRAM_GLOBAL_MESSAGES_PER_SECOND = int(os.getenv("TELEGRAM_GLOBAL_MESSAGES_PER_SECOND", "30"))
+TELEGRAM_CHAT_MESSAGE_INTERVAL = float(os.getenv("TELEGRAM_CHAT_MESSAGE_INTERVAL", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_MESSAGES_PER_MINUTE = int(os.getenv("TELEGRAM_GROUP_MESSAGES_PER_MINUTE", "20"))
+TELEGRAM_CHAT_ACTION_TTL = float(os.getenv("TELEGRAM_CHAT_ACTION_TTL", "5"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+# Параллельная обработка обновлений Telegram (0 - последовательная обработка)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "16"))
+# Сколько обновлений может ожидать обработки одновременно
+BOT_MAX_PENDING_UPDATES = int(os.getenv("BOT_MAX_PENDING_UPDATES", "512"))
+# Интервал (сек.) логирования глубины очереди обновлений (0 - отключено)
+BOT_QUEUE_DEPTH_LOG_INTERVAL = float(os.getenv("BOT_QUEUE_DEPTH_LOG_INTERVAL", "60"))
+
+# Быстрый запуск: бот сразу принимает обновления, а клиенты Gemini, шрифт и процессы PDF
+# готовятся в фоне (0 - всё готовится до запуска, как раньше)
+BOT_FAST_START = os.getenv("BOT_FAST_START", "1") == "1"
+# Сколько секунд генерация ждёт окончания фоновой подготовки
+BOT_WARM_UP_WAIT = float(os.getenv("BOT_WARM_UP_WAIT", "30"))
+# Повторы неудачного шага фоновой подготовки и пауза перед первым повтором (сек., далее удваивается);
+# если шаг так и не удался, бот останавливается с ненулевым кодом выхода
+BOT_WARM_UP_RETRIES = int(os.getenv("BOT_WARM_UP_RETRIES", "3"))
+BOT_WARM_UP_RETRY_DELAY = float(os.getenv("BOT_WARM_UP_RETRY_DELAY", "2"))
+
+# Хранилище ответов диалога /create: максимум сессий и оценка занятой ими памяти в байтах
+# (при превышении любого предела вытесняются давно не использованные), время простоя
+# до удаления сессии в секундах и максимальная длина свободного текстового ответа
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "50000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(32 * 1024 * 1024)))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "1200"))
+SESSION_TEXT_MAX_LENGTH = int(os.getenv("SESSION_TEXT_MAX_LENGTH", "1000"))
+
+# Потоковая генерация: профиль появляется в сообщении по мере генерации
+GENERATION_STREAMING = os.getenv("GENERATION_STREAMING", "1") == "1"
+# Минимальный интервал (сек.) между правками сообщения с прогрессом
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Пул заранее сгенерированных персонажей для запросов "Авто"
+CHARACTER_POOL_ENABLED = os.getenv("CHARACTER_POOL_ENABLED", "1") == "1"
+# Сколько готовых персонажей держать на каждый ключ (раса, класс, предыстория, мировоззрение)
+CHARACTER_POOL_SIZE = int(os.getenv("CHARACTER_POOL_SIZE", "3"))
+# Сколько самых востребованных ключей пополнять помимо "всё Авто"
+CHARACTER_POOL_POPULAR_KEYS = int(os.getenv("CHARACTER_POOL_POPULAR_KEYS", "3"))
+# Интервал (сек.) между попытками пополнения пула
+CHARACTER_POOL_REFILL_INTERVAL = float(os.getenv("CHARACTER_POOL_REFILL_INTERVAL", "20"))
+# Пополнять пул только когда нет пользовательских запросов к модели
+CHARACTER_POOL_IDLE_ONLY = os.getenv("CHARACTER_POOL_IDLE_ONLY", "1") == "1"
+# Максимальная доля лимита RPM, которую может расходовать пул
+CHARACTER_POOL_MAX_QUOTA_SHARE = float(os.getenv("CHARACTER_POOL_MAX_QUOTA_SHARE", "0.2"))
+
+# Размер группы для команды /party по умолчанию и максимальный
+PARTY_DEFAULT_SIZE = int(os.getenv("PARTY_DEFAULT_SIZE", "4"))
+PARTY_MAX_SIZE = int(os.getenv("PARTY_MAX_SIZE", "6"))
+
+# Число процессов для рендеринга PDF (0 - рендеринг в потоке основного процесса)
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+
+# Быстрый рендеринг листа по готовому шаблону (1); лист, не помещающийся
+# на страницу, и режим 0 используют раскладку platypus
+PDF_FAST_RENDERER = os.getenv("PDF_FAST_RENDERER", "1") == "1"
+
+# Формат ответа модели: "text" - текст с заголовками, "json" - JSON по схеме профиля
+# (при ошибке разбора JSON запрос автоматически повторяется в текстовом формате)
+GEMINI_OUTPUT_FORMAT = os.getenv("GEMINI_OUTPUT_FORMAT", "text")
+
+# Передавать неизменную часть промпта как системную инструкцию модели (1) или
+# склеивать её с запросом пользователя в одно сообщение (0)
+GEMINI_SYSTEM_INSTRUCTION = os.getenv("GEMINI_SYSTEM_INSTRUCTION", "1") == "1"
+
+# Дозапрос у модели только тех полей профиля, которые не удалось разобрать
+# (если их не больше PROFILE_REPAIR_MAX_FIELDS; иначе ответ считается неудачным целиком)
+PROFILE_REPAIR_ENABLED = os.getenv("PROFILE_REPAIR_ENABLED", "1") == "1"
+PROFILE_REPAIR_MAX_FIELDS = int(os.getenv("PROFILE_REPAIR_MAX_FIELDS", "6"))
+
 # Пути к Директориям
 OUTPUT_DIR_BOT_GENERATED = "telegram_bot_generated_characters"
 PDF_OUTPUT_DIR = os.path.join(OUTPUT_DIR_BOT_GENERATED, "pdfs")
 TEXT_OUTPUT_DIR = os.path.join(OUTPUT_DIR_BOT_GENERATED, "texts")
 FONT_PATH_FOR_BOT_SESSION = os.getenv("FONT_PATH_FOR_BOT_SESSION", "")
 
+# Журнал запросов к LLM: сжатые сегменты JSONL в TEXT_OUTPUT_DIR
+TRANSCRIPT_SEGMENT_MAX_BYTES = int(os.getenv("TRANSCRIPT_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+TRANSCRIPT_SEGMENT_MAX_AGE = float(os.getenv("TRANSCRIPT_SEGMENT_MAX_AGE", str(24 * 60 * 60)))
+# Интервал (сек.) фоновой записи накопленных записей журнала
+TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", "2"))
+
+# HTTP-эндпоинт метрик Prometheus (GET /metrics); 0 - отключен
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Профилирование по запросу (profiling.py): доля запусков генерации под cProfile и tracemalloc
+# (0 - выключено), папка файлов профилей и число мест выделения памяти в отчёте
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(OUTPUT_DIR_BOT_GENERATED, "profiles"))
+PROFILING_TOP_ALLOCATIONS = int(os.getenv("PROFILING_TOP_ALLOCATIONS", "25"))
+# Логировать обработчики, блокирующие цикл событий дольше заданного числа секунд; 0 - выключено
+SLOW_CALLBACK_THRESHOLD = float(os.getenv("SLOW_CALLBACK_THRESHOLD", "0"))
+# Telegram id администраторов через запятую: им доступна команда /profile
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+# Хранилище состояния диалогов и user_data: "sqlite" (переживает перезапуск одного процесса бота)
+# или "none" - только в памяти процесса
+PERSISTENCE_BACKEND = os.getenv("PERSISTENCE_BACKEND", "none")
+PERSISTENCE_SQLITE_PATH = os.getenv("PERSISTENCE_SQLITE_PATH", os.path.join(OUTPUT_DIR_BOT_GENERATED, "bot_state.sqlite3"))
+# Интервал (сек.) пакетной записи изменений в хранилище
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "5"))
+
 
 # Настройки Безопасности Gemini
 GEMINI_SAFETY_SETTINGS = [
@@ -20,23 +171,38 @@ GEMINI_SAFETY_SETTINGS = [
     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
 ]
 
+# Характеристики, хиты и КД считаются локально по правилам SRD (srd_rules.py), модель их не пишет.
+# 0 - характеристики пишет модель, как раньше
+SRD_RULES_ENABLED = os.getenv("SRD_RULES_ENABLED", "1") == "1"
+
 # Системное Сообщение для Gemini
-SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX = """Ты - ИИ-ассистент, создающий полных персонажей для Dungeons & Dragons 5-й редакции.
-Твоя задача - сгенерировать Имя, Расу, Класс, Предысторию (Background), Мировоззрение, Характеристики (стандартный набор из 6), стартовый Инвентарь и Предысторию (текстовое описание), Черту Характера, Идеал, Привязанность и Слабость.
+if SRD_RULES_ENABLED:
+    _STATS_TASK = ""
+    _STATS_INSTRUCTION = "Характеристики не пиши: они рассчитываются отдельно по правилам SRD 5.1.\n"
+    _STATS_FORMAT_LINE = ""
+    _STATS_JSON_FIELD = ""
+else:
+    _STATS_TASK = " Характеристики (стандартный набор из 6),"
+    _STATS_INSTRUCTION = "Если характеристики не указаны или есть только пожелания, предложи типичное или сбалансированное распределение.\n"
+    _STATS_FORMAT_LINE = "Характеристики: [текст, например: Сила 10, Ловкость 14,...]\n"
+    _STATS_JSON_FIELD = "stats (Характеристики, строкой, например: Сила 10, Ловкость 14,...), "
+
+SYSTEM_MESSAGE_CHAR_TASK = f"""Ты - ИИ-ассистент, создающий полных персонажей для Dungeons & Dragons 5-й редакции.
+Твоя задача - сгенерировать Имя, Расу, Класс, Предысторию (Background), Мировоззрение,{_STATS_TASK} стартовый Инвентарь и Предысторию (текстовое описание), Черту Характера, Идеал, Привязанность и Слабость.
 Строго придерживайся материалов из System Reference Document (SRD 5.1).
 Если какой-либо параметр не указан пользователем, выбери подходящий из SRD 5.1.
-Если характеристики не указаны или есть только пожелания, предложи типичное или сбалансированное распределение.
-Инвентарь должен состоять из 3-5 предметов, подходящих для стартового персонажа.
+{_STATS_INSTRUCTION}Инвентарь должен состоять из 3-5 предметов, подходящих для стартового персонажа.
 Текстовая Предыстория должна быть на 2-5 предложений и соответствовать всем выбранным элементам.
 
-Ответ должен быть структурирован СТРОГО следующим образом, с каждым заголовком на НОВОЙ СТРОКЕ:
+"""
+
+SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX = SYSTEM_MESSAGE_CHAR_TASK + f"""Ответ должен быть структурирован СТРОГО следующим образом, с каждым заголовком на НОВОЙ СТРОКЕ:
 Имя: [текст]
 Раса: [текст]
 Класс: [текст]
 Предыстория (Background): [текст]
 Мировоззрение: [текст]
-Характеристики: [текст, например: Сила 10, Ловкость 14,...]
-Инвентарь: [текст, предметы через запятую]
+{_STATS_FORMAT_LINE}Инвентарь: [текст, предметы через запятую]
 Предыстория: [многострочный текст]
 Черта Характера: [текст]
 Идеал: [текст]
@@ -46,3 +212,19 @@ SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX = """Ты - ИИ-ассистент, со
 ВАЖНО: Убедись, что заголовок "Предыстория:" (для текстового описания) не конфликтует с "Предыстория (Background):" (для названия бэкграунда).
 Каждый заголовок должен быть точно таким, как указано выше (например, "Предыстория (Background):", а не просто "Background:").
 """
+
+# Системное Сообщение для режима структурированного ответа (JSON)
+SYSTEM_MESSAGE_FULL_CHAR_GEMINI_JSON_PREFIX = SYSTEM_MESSAGE_CHAR_TASK + f"""Ответ должен быть ОДНИМ JSON-объектом по заданной схеме, без пояснений до или после него.
+Поля: name (Имя), race (Раса), class (Класс), background_name (название Предыстории (Background)), alignment (Мировоззрение),
+{_STATS_JSON_FIELD}inventory (Инвентарь, предметы через запятую),
+backstory_text (текстовая Предыстория), trait (Черта Характера), ideal (Идеал), bond (Привязанность), flaw (Слабость).
+Все значения - строки на русском языке.
+"""
+
+# Системное Сообщение для дозапроса недостающих полей профиля
+SYSTEM_MESSAGE_PROFILE_REPAIR = """Ты - ИИ-ассистент, дописывающий профиль персонажа Dungeons & Dragons 5-й редакции (SRD 5.1).
+Тебе дан профиль, в котором не хватает некоторых полей. Напиши ТОЛЬКО недостающие поля так,
+чтобы они соответствовали уже заполненным: расе, классу, предыстории и мировоззрению персонажа.
+Инвентарь - 3-5 предметов через запятую; текстовая Предыстория - 2-5 предложений.
+Ответ - ОДИН JSON-объект по заданной схеме, все значения - строки на русском языке.
+"""
@@ -0,0 +1,148 @@
+"""
+Пул пар ключ API / модель Gemini.
+
+У каждой пары свой клиент и свой учёт квоты (запросы за последнюю минуту). Запрос
+направляется в доступную пару с наименьшей недавней задержкой с учётом уже
+выполняющихся запросов; пара, получившая ошибку квоты (429), исключается из пула
+на время карантина. Ключи в логах и журнале обозначаются номерами (key1, key2...).
+"""
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SMOOTHING = 0.3  # вес нового замера в экспоненциальном среднем задержки
+
+
+# Публичного API для нескольких ключей в одном процессе у google-generativeai нет: genai.configure
+# задаёт один глобальный ключ. Клиенты остальных ключей создаются через внутренние объекты
+# библиотеки - client._ClientManager и атрибуты модели _client/_async_client (проверено на
+# google-generativeai 0.8.x, см. requirements.txt). Все обращения к ним - только в функциях ниже;
+# check_client_internals проверяет их при запуске, чтобы обновление библиотеки не ломало запросы молча.
+
+def check_client_internals(model):
+    """Выбрасывает RuntimeError, если в google-generativeai нет внутренних объектов, нужных для нескольких ключей."""
+    from google.generativeai import client as genai_client
+    missing = []
+    client_manager_class = getattr(genai_client, "_ClientManager", None)
+    if client_manager_class is None:
+        missing.append("client._ClientManager")
+    else:
+        missing += [f"client._ClientManager.{name}" for name in ("configure", "get_default_client")
+                    if not hasattr(client_manager_class, name)]
+    missing += [f"GenerativeModel.{name}" for name in ("_client", "_async_client") if not hasattr(model, name)]
+    if missing:
+        raise RuntimeError(f"Несколько ключей API не поддерживаются установленной версией google-generativeai: "
+                           f"нет {', '.join(missing)}. Нужна версия 0.8.x или один ключ в GOOGLE_API_KEYS.")
+
+def create_client_manager(api_key):
+    """Набор клиентов Gemini для отдельного ключа API."""
+    # Модуль client нужно импортировать явно: google.generativeai удаляет его из своего пространства имён
+    from google.generativeai import client as genai_client
+    client_manager = genai_client._ClientManager()
+    client_manager.configure(api_key=api_key)
+    return client_manager
+
+def bind_model_client(model, client_manager, async_client=False):
+    """
+    Направляет запросы модели в клиент client_manager вместо клиента ключа по умолчанию.
+    Асинхронный клиент (async_client=True) создаётся только внутри цикла событий.
+    """
+    if async_client:
+        if model._async_client is None:
+            model._async_client = client_manager.get_default_client("generative_async")
+    else:
+        model._client = client_manager.get_default_client("generative")
+
+
+class ModelPoolEntry:
+    """
+    Пара ключ/модель: модель, её клиент и статистика для маршрутизации.
+    model_factory(system_instruction) создаёт модель с системной инструкцией;
+    такие модели кэшируются и используют клиент этой же пары.
+    """
+
+    def __init__(self, key_id, model_name, model, client_manager=None, model_factory=None):
+        self.key_id = key_id
+        self.model_name = model_name
+        self.model = model
+        self._client_manager = client_manager
+        self._model_factory = model_factory
+        self._instruction_models = {}  # системная инструкция -> модель
+        self.average_latency = None
+        self.in_flight = 0
+        self.quarantined_until = 0.0
+        self.recent_requests = deque()  # время отправки запросов за последнюю минуту
+
+    @property
+    def label(self):
+        return f"{self.key_id}/{self.model_name}"
+
+    def async_model(self, system_instruction=None):
+        """
+        Модель (с системной инструкцией, если задана) и асинхронным клиентом своего ключа;
+        клиент создаётся в цикле событий при первом запросе.
+        """
+        model = self.model
+        if system_instruction is not None and self._model_factory is not None:
+            model = self._instruction_models.get(system_instruction)
+            if model is None:
+                model = self._instruction_models[system_instruction] = self._model_factory(system_instruction)
+                if self._client_manager is not None:
+                    bind_model_client(model, self._client_manager)
+        if self._client_manager is not None:
+            bind_model_client(model, self._client_manager, async_client=True)
+        return model
+
+    def requests_last_minute(self, now):
+        while self.recent_requests and now - self.recent_requests[0] > 60:
+            self.recent_requests.popleft()
+        return len(self.recent_requests)
+
+    def observe_latency(self, latency):
+        if self.average_latency is None:
+            self.average_latency = latency
+        else:
+            self.average_latency += LATENCY_SMOOTHING * (latency - self.average_latency)
+
+
+class ModelPool:
+    def __init__(self, entries, rpm_limit, quarantine_seconds):
+        self.entries = entries
+        self._rpm_limit = rpm_limit
+        self._quarantine_seconds = quarantine_seconds
+
+    @property
+    def size(self):
+        return len(self.entries)
+
+    def available_entries(self, now=None):
+        now = time.monotonic() if now is None else now
+        return [entry for entry in self.entries if entry.quarantined_until <= now]
+
+    def _score(self, entry):
+        # Пара без замеров считается быстрой, чтобы на неё тоже попадали запросы
+        return (entry.average_latency or 0.0) * (1 + entry.in_flight)
+
+    def choose(self, exclude=()):
+        """
+        Выбирает пару для запроса или возвращает None, если все пары на карантине.
+        exclude - пары, которые уже выполняют этот запрос (для дублирующего запроса).
+        """
+        now = time.monotonic()
+        candidates = [entry for entry in self.available_entries(now) if entry not in exclude] or self.available_entries(now)
+        if not candidates:
+            return None
+        with_quota = [entry for entry in candidates if entry.requests_last_minute(now) < self._rpm_limit]
+        entry = min(with_quota or candidates, key=lambda candidate: (self._score(candidate), len(candidate.recent_requests)))
+        entry.recent_requests.append(now)
+        logger.info(f"Запрос к Gemini направлен в {entry.label}: средняя задержка "
+                    f"{entry.average_latency or 0:.1f} с, выполняется {entry.in_flight}, "
+                    f"запросов за минуту {len(entry.recent_requests)}/{self._rpm_limit}.")
+        return entry
+
+    def quarantine(self, entry):
+        entry.quarantined_until = time.monotonic() + self._quarantine_seconds
+        logger.warning(f"Квота {entry.label} исчерпана, пара исключена из пула на {self._quarantine_seconds:.0f} с. "
+                       f"Доступно пар: {len(self.available_entries())}/{self.size}.")
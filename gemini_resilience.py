@@ -0,0 +1,118 @@
+"""
+Защита пути запросов к Gemini от долгих хвостов задержки и сбоев.
+
+LatencyTracker хранит недавние задержки и подсказывает, когда отправлять дублирующий
+запрос; CircuitBreaker отклоняет запросы сразу, если доля ошибок upstream слишком велика;
+backoff_delay считает экспоненциальную паузу со случайным разбросом.
+"""
+import logging
+import random
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Пауза перед повтором номер attempt (с 1): base * 2^(attempt-1), не больше max, со случайным разбросом."""
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class LatencyTracker:
+    """
+    Скользящее окно задержек успешных попыток. Задержка дублирования - заданный
+    перцентиль окна; дубли разрешены не более чем для доли budget запросов окна.
+    """
+
+    def __init__(self, percentile, default_delay, min_delay, min_samples, budget, window_size=200):
+        self._percentile = percentile
+        self._default_delay = default_delay
+        self._min_delay = min_delay
+        self._min_samples = min_samples
+        self._budget = budget
+        self._latencies = deque(maxlen=window_size)
+        self._hedged = deque(maxlen=window_size)  # по записи на запрос: был ли он продублирован
+
+    def observe(self, latency):
+        self._latencies.append(latency)
+
+    def hedge_delay(self):
+        if len(self._latencies) < self._min_samples:
+            return self._default_delay
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self._percentile / 100))
+        return max(self._min_delay, ordered[index])
+
+    def record_request(self, hedged):
+        self._hedged.append(hedged)
+
+    def hedge_allowed(self):
+        return sum(self._hedged) < self._budget * len(self._hedged) + 1
+
+
+class CircuitBreakerOpen(Exception):
+    """Автомат защиты разомкнут: запрос к upstream не отправляется."""
+
+
+class CircuitBreaker:
+    """
+    Считает успехи и сбои за последние window секунд. Если сбоев не меньше error_rate
+    при хотя бы min_requests запросах, размыкается на open_seconds; затем пропускает
+    один пробный запрос и замыкается при его успехе.
+    """
+
+    def __init__(self, error_rate, min_requests, window, open_seconds):
+        self._error_rate = error_rate
+        self._min_requests = min_requests
+        self._window = window
+        self._open_seconds = open_seconds
+        self._results = deque()  # (время, успех)
+        self._opened_at = None
+        self._probe_started_at = None  # время пробного запроса, если он выполняется
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def _trim(self, now):
+        while self._results and now - self._results[0][0] > self._window:
+            self._results.popleft()
+
+    def before_request(self):
+        """Выбрасывает CircuitBreakerOpen, если запрос отправлять нельзя."""
+        if self._opened_at is None:
+            return
+        now = time.monotonic()
+        # Пробный запрос, оставшийся без результата (например, отменённый), не блокирует автомат навсегда
+        probe_in_flight = self._probe_started_at is not None and now - self._probe_started_at < self._open_seconds
+        if now - self._opened_at < self._open_seconds or probe_in_flight:
+            raise CircuitBreakerOpen()
+        self._probe_started_at = now
+        logger.info("Автомат защиты Gemini: пробный запрос после паузы.")
+
+    def record_success(self):
+        now = time.monotonic()
+        if self._opened_at is not None:
+            logger.info("Автомат защиты Gemini замкнут: пробный запрос успешен.")
+            self._opened_at = None
+            self._probe_started_at = None
+            self._results.clear()
+        self._results.append((now, True))
+        self._trim(now)
+
+    def record_failure(self):
+        now = time.monotonic()
+        if self._opened_at is not None:
+            if self._probe_started_at is not None:
+                self._opened_at = now
+                self._probe_started_at = None
+                logger.warning("Автомат защиты Gemini: пробный запрос неуспешен, пауза продлена.")
+            return
+        self._results.append((now, False))
+        self._trim(now)
+        failures = sum(1 for _, success in self._results if not success)
+        if len(self._results) >= self._min_requests and failures >= self._error_rate * len(self._results):
+            self._opened_at = now
+            logger.error(f"Автомат защиты Gemini разомкнут: {failures} ошибок из {len(self._results)} "
+                         f"за {self._window:.0f} с. Запросы отклоняются {self._open_seconds:.0f} с.")
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from config import (
+    GEMINI_RPM_LIMIT,
+    GEMINI_TPM_LIMIT,
+    GEMINI_EXPECTED_OUTPUT_TOKENS,
+    GEMINI_QUOTA_COOLDOWN,
+    GEMINI_QUOTA_MAX_WAIT,
+)
+from gemini_utils import generate_content_with_gemini_async, GeminiQuotaError, get_model_pool
+from metrics import STAGE_SECONDS, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_prompt_tokens(prompt_parts):
+    """Грубая оценка числа токенов промпта (~4 символа на токен)."""
+    return sum(len(part) for part in prompt_parts if isinstance(part, str)) // 4 + 1
+
+
+class TokenBucket:
+    """Маркерная корзина: пополняется равномерно со скоростью rate_per_minute."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.rate_per_second = rate_per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def time_until_available(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate_per_second
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self):
+        self._refill()
+        self.tokens = 0.0
+
+
+class _QueuedRequest:
+    __slots__ = ("user_id", "prompt_parts", "temperature", "estimated_tokens",
+                 "future", "on_queue_position", "on_partial_text", "response_schema", "route_info", "system_instruction",
+                 "last_position", "enqueued_at")
+
+    def __init__(self, user_id, prompt_parts, temperature, on_queue_position, expected_output_tokens,
+                 on_partial_text=None, response_schema=None, route_info=None, system_instruction=None):
+        self.user_id = user_id
+        self.prompt_parts = prompt_parts
+        self.temperature = temperature
+        self.system_instruction = system_instruction
+        # Системная инструкция тоже входит во входные токены запроса
+        self.estimated_tokens = (estimate_prompt_tokens(prompt_parts + [system_instruction or ""])
+                                 + expected_output_tokens)
+        self.future = asyncio.get_running_loop().create_future()
+        self.on_queue_position = on_queue_position
+        self.on_partial_text = on_partial_text
+        self.response_schema = response_schema
+        self.route_info = route_info
+        self.last_position = None
+        self.enqueued_at = time.monotonic()
+
+
+class GeminiScheduler:
+    """
+    Планировщик запросов к Gemini.
+    Пропускает запросы не быстрее лимитов RPM/TPM, обслуживает пользователей по кругу
+    (один запрос от каждого пользователя за проход), сообщает ожидающим их место в очереди
+    и при ошибке квоты возвращает запрос в начало очереди до открытия нового окна.
+    """
+
+    def __init__(self, rpm_limit, tpm_limit, quota_cooldown, max_quota_wait):
+        self._rpm_bucket = TokenBucket(rpm_limit)
+        self._tpm_bucket = TokenBucket(tpm_limit)
+        self._quota_cooldown = quota_cooldown
+        self._max_quota_wait = max_quota_wait
+        self._queues = OrderedDict()  # user_id -> deque запросов; порядок ключей - порядок обхода
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._dispatcher_task = None
+        self._background_tasks = set()
+        self._running_requests = 0
+
+    @property
+    def queue_length(self):
+        return sum(len(user_queue) for user_queue in self._queues.values())
+
+    @property
+    def is_idle(self):
+        """Нет ни ожидающих, ни выполняющихся запросов."""
+        return not self._queues and self._running_requests == 0
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher_task is None or self._dispatcher_task.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher_task = asyncio.create_task(self._dispatch_loop())
+
+    async def submit(self, user_id, prompt_parts, temperature=0.7, on_queue_position=None,
+                     expected_output_tokens=GEMINI_EXPECTED_OUTPUT_TOKENS, on_partial_text=None, response_schema=None,
+                     route_info=None, system_instruction=None):
+        """
+        Ставит запрос в очередь и ждёт ответа модели (строку, как generate_content_with_gemini_async).
+        on_queue_position - необязательная корутина, получающая место в очереди
+        (0 - запрос отправлен в модель).
+        on_partial_text - необязательная корутина для потокового получения текста.
+        response_schema - схема JSON-ответа (режим структурированного вывода).
+        route_info - необязательный словарь, куда записывается, какая пара ключ/модель ответила.
+        system_instruction - неизменная часть промпта (системная инструкция модели).
+        """
+        self._ensure_dispatcher()
+        request = _QueuedRequest(user_id, prompt_parts, temperature, on_queue_position, expected_output_tokens,
+                                 on_partial_text, response_schema, route_info, system_instruction)
+        self._queues.setdefault(user_id, deque()).append(request)
+        self._wakeup.set()
+        return await request.future
+
+    def _ordered_requests(self):
+        """Запросы в порядке, в котором они будут отправлены при круговом обходе пользователей."""
+        user_queues = list(self._queues.values())
+        ordered = []
+        depth = 0
+        while True:
+            added = False
+            for user_queue in user_queues:
+                if depth < len(user_queue):
+                    ordered.append(user_queue[depth])
+                    added = True
+            if not added:
+                return ordered
+            depth += 1
+
+    def _notify(self, request, position):
+        if request.on_queue_position is None or request.last_position == position:
+            return
+        request.last_position = position
+        task = asyncio.create_task(self._safe_callback(request.on_queue_position, position))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    @staticmethod
+    async def _safe_callback(callback, position):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить пользователю место в очереди: {e}")
+
+    def _notify_positions(self):
+        for position, request in enumerate(self._ordered_requests(), start=1):
+            self._notify(request, position)
+
+    def _pop_next_request(self):
+        while self._queues:
+            user_id, user_queue = next(iter(self._queues.items()))
+            request = user_queue.popleft()
+            if user_queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if not request.future.done():  # Запрос мог быть отменён, пока ждал
+                return request
+        return None
+
+    def _peek_next_request(self):
+        for user_queue in self._queues.values():
+            return user_queue[0]
+        return None
+
+    async def _dispatch_loop(self):
+        while True:
+            request = self._peek_next_request()
+            if request is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            wait = max(
+                self._paused_until - time.monotonic(),
+                self._rpm_bucket.time_until_available(1),
+                self._tpm_bucket.time_until_available(request.estimated_tokens),
+            )
+            if wait > 0:
+                self._notify_positions()
+                await asyncio.sleep(wait)
+                continue
+
+            request = self._pop_next_request()
+            if request is None:
+                continue
+            self._rpm_bucket.consume(1)
+            self._tpm_bucket.consume(request.estimated_tokens)
+            STAGE_SECONDS.observe(time.monotonic() - request.enqueued_at, stage="queue")
+            if request.last_position is not None:
+                self._notify(request, 0)
+            task = asyncio.create_task(self._run_request(request))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def _run_request(self, request):
+        self._running_requests += 1
+        try:
+            result = await generate_content_with_gemini_async(
+                request.prompt_parts, temperature=request.temperature, raise_on_quota=True,
+                on_partial_text=request.on_partial_text, response_schema=request.response_schema,
+                route_info=request.route_info, system_instruction=request.system_instruction
+            )
+        except GeminiQuotaError as e:
+            waited = time.monotonic() - request.enqueued_at
+            if waited + self._quota_cooldown > self._max_quota_wait:
+                logger.error(f"Квота API не восстановилась за {waited:.0f} с, запрос user_id {request.user_id} отклонён.")
+                if not request.future.done():
+                    request.future.set_result("Ошибка квоты API.")
+                return
+            logger.warning(f"Ошибка квоты API ({e}). Запросы приостановлены на {self._quota_cooldown} с, "
+                           f"запрос user_id {request.user_id} возвращён в начало очереди.")
+            self._paused_until = max(self._paused_until, time.monotonic() + self._quota_cooldown)
+            self._rpm_bucket.drain()
+            self._requeue_front(request)
+            return
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+            return
+        finally:
+            self._running_requests -= 1
+        if not request.future.done():
+            request.future.set_result(result)
+
+    def _requeue_front(self, request):
+        self._queues.setdefault(request.user_id, deque()).appendleft(request)
+        self._queues.move_to_end(request.user_id, last=False)
+        self._wakeup.set()
+
+
+_scheduler = None
+
+Gauge("dndbot_gemini_queue_length", "Запросы к Gemini, ожидающие в очереди планировщика.",
+      lambda: _scheduler.queue_length if _scheduler else 0)
+Gauge("dndbot_gemini_running_requests", "Запросы к Gemini, выполняющиеся в данный момент.",
+      lambda: _scheduler._running_requests if _scheduler else 0)
+
+def get_gemini_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        # Лимиты заданы на одну пару ключ/модель, планировщик пропускает суммарную квоту пула
+        pool_size = get_model_pool().size if get_model_pool() else 1
+        _scheduler = GeminiScheduler(GEMINI_RPM_LIMIT * pool_size, GEMINI_TPM_LIMIT * pool_size,
+                                     GEMINI_QUOTA_COOLDOWN, GEMINI_QUOTA_MAX_WAIT)
+    return _scheduler
@@ -1,39 +1,106 @@
+import asyncio
+import json
 import logging
 import os
 import re
 import time
 import datetime
-import google.generativeai as genai
 from config import (
-    GOOGLE_API_KEY,
+    GOOGLE_API_KEYS,
     GEMINI_MODEL_NAME,
+    GEMINI_MODEL_NAMES,
+    GEMINI_RPM_LIMIT,
+    GEMINI_KEY_QUARANTINE_SECONDS,
+    GEMINI_MAX_CONCURRENT_REQUESTS,
     GEMINI_SAFETY_SETTINGS,
-    SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX
+    GEMINI_REQUEST_DEADLINE,
+    GEMINI_ATTEMPT_TIMEOUT,
+    GEMINI_RETRY_BASE_DELAY,
+    GEMINI_RETRY_MAX_DELAY,
+    GEMINI_HEDGE_ENABLED,
+    GEMINI_HEDGE_PERCENTILE,
+    GEMINI_HEDGE_DEFAULT_DELAY,
+    GEMINI_HEDGE_MIN_DELAY,
+    GEMINI_HEDGE_MIN_SAMPLES,
+    GEMINI_HEDGE_BUDGET,
+    GEMINI_BREAKER_ERROR_RATE,
+    GEMINI_BREAKER_MIN_REQUESTS,
+    GEMINI_BREAKER_WINDOW,
+    GEMINI_BREAKER_OPEN_SECONDS,
+    SYSTEM_MESSAGE_FULL_CHAR_GEMINI_PREFIX,
+    SRD_RULES_ENABLED
 )
+from gemini_pool import ModelPool, ModelPoolEntry, check_client_internals, create_client_manager, bind_model_client
+from gemini_resilience import backoff_delay, LatencyTracker, CircuitBreaker, CircuitBreakerOpen
+from metrics import STAGE_SECONDS, GEMINI_ATTEMPTS, GEMINI_HEDGED_REQUESTS, GEMINI_TOKENS, PARSE_FAILURES, Gauge
 
 logger = logging.getLogger(__name__)
-model_gemini = None
+_genai = None  # google.generativeai: импорт занимает около секунды, поэтому выполняется при первом обращении
+_model_pool = None
+_gemini_semaphore = None
+_latency_trackers = {}  # потоковый режим (bool) -> LatencyTracker
+_circuit_breaker = None
+
+CIRCUIT_OPEN_MESSAGE = "ОШИБКА API: Сервис генерации сейчас перегружен. Пожалуйста, попробуйте через минуту."
+
+class GeminiQuotaError(Exception):
+    """Исчерпана квота API (429 / RESOURCE_EXHAUSTED)."""
+
+def load_genai():
+    """Импортирует google.generativeai при первом вызове и возвращает модуль."""
+    global _genai
+    if _genai is None:
+        started = time.perf_counter()
+        import google.generativeai
+        _genai = google.generativeai
+        logger.info(f"Модуль google.generativeai импортирован за {time.perf_counter() - started:.2f} с.")
+    return _genai
 
 def init_gemini():
-    global model_gemini
-    if not GOOGLE_API_KEY or GOOGLE_API_KEY == "api_ключ_google_ai_studio":
+    if not GOOGLE_API_KEYS or GOOGLE_API_KEYS[0] == "api_ключ_google_ai_studio":
         logger.error("ОШИБКА: API ключ Google не установлен в config.py.")
         return False
 
     try:
-        genai.configure(api_key=GOOGLE_API_KEY)
-        logger.info("API ключ Google AI Studio успешно сконфигурирован.")
+        genai = load_genai()
+        # Первый ключ - ключ по умолчанию библиотеки; у остальных ключей собственные клиенты
+        genai.configure(api_key=GOOGLE_API_KEYS[0])
+        logger.info(f"API ключи Google AI Studio успешно сконфигурированы: {len(GOOGLE_API_KEYS)}.")
 
-        model_gemini = genai.GenerativeModel(
-            GEMINI_MODEL_NAME,
-            safety_settings=GEMINI_SAFETY_SETTINGS
-        )
-        logger.info(f"Модель '{GEMINI_MODEL_NAME}' успешно инициализирована.")
+        if len(GOOGLE_API_KEYS) > 1:
+            check_client_internals(genai.GenerativeModel(GEMINI_MODEL_NAMES[0]))
+
+        entries = []
+        for key_index, api_key in enumerate(GOOGLE_API_KEYS):
+            client_manager = None
+            if key_index > 0:
+                client_manager = create_client_manager(api_key)
+            for model_name in GEMINI_MODEL_NAMES:
+                model = genai.GenerativeModel(model_name, safety_settings=GEMINI_SAFETY_SETTINGS)
+                if client_manager is not None:
+                    bind_model_client(model, client_manager)
+                def model_factory(system_instruction, model_name=model_name):
+                    return genai.GenerativeModel(model_name, safety_settings=GEMINI_SAFETY_SETTINGS,
+                                                 system_instruction=system_instruction)
+                entries.append(ModelPoolEntry(f"key{key_index + 1}", model_name, model, client_manager, model_factory))
+        use_model_pool(ModelPool(entries, GEMINI_RPM_LIMIT, GEMINI_KEY_QUARANTINE_SECONDS))
+        logger.info(f"Модели {', '.join(GEMINI_MODEL_NAMES)} успешно инициализированы, пар ключ/модель в пуле: {len(entries)}.")
         return True
     except Exception as e:
         logger.error(f"Ошибка инициализации Gemini: {e}")
         return False
 
+def use_model_pool(pool):
+    """Назначает пул ключей/моделей для запросов."""
+    global _model_pool
+    _model_pool = pool
+
+def get_model_pool():
+    return _model_pool
+
+Gauge("dndbot_gemini_pool_available", "Пары ключ/модель, не находящиеся на карантине после ошибки квоты.",
+      lambda: len(_model_pool.available_entries()) if _model_pool else 0)
+
 def get_timestamp_filename(base_name, extension, model_name_for_file=""):
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     safe_model_name = ""
@@ -41,129 +108,553 @@ def get_timestamp_filename(base_name, extension, model_name_for_file=""):
         safe_model_name = "_" + model_name_for_file.replace(":", "_").replace("/", "_").replace(".", "_")
     return f"{base_name}{safe_model_name}_{timestamp}.{extension}"
 
-def generate_content_with_gemini(prompt_parts, temperature=0.7, retries=3, delay=5):
-    if not model_gemini:
+def _extract_generated_text(response):
+    """
+    Разбирает ответ модели. Возвращает сгенерированный текст или сообщение
+    о блокировке/пустом ответе (общая логика для синхронного и асинхронного вызова).
+    """
+    if response.prompt_feedback and response.prompt_feedback.block_reason:
+        reason = response.prompt_feedback.block_reason_message
+        logger.warning(f"Промпт был заблокирован: {reason}")
+        return f"ЗАПРОС ЗАБЛОКИРОВАН: {reason}"
+
+    if not response.candidates:
+        logger.warning("Модель не вернула кандидатов.")
+        return "Модель не вернула кандидатов."
+
+    generated_text = ""
+    if hasattr(response, 'text'):
+         generated_text = response.text
+    elif response.parts:
+         generated_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
+
+
+    candidate = response.candidates[0]
+    if candidate.finish_reason.name == "SAFETY":
+        safety_info = "Нет деталей"
+        if hasattr(candidate, 'safety_ratings') and candidate.safety_ratings:
+            safety_info = "; ".join(
+                f"{r.category.name}: {r.probability.name}"
+                for r in candidate.safety_ratings
+            )
+        logger.warning(f"Контент заблокирован (SAFETY). Детали: {safety_info}")
+        return f"КОНТЕНТ ЗАБЛОКИРОВАН (SAFETY): {generated_text or safety_info}"
+
+    if not generated_text:
+        reason = candidate.finish_reason.name
+        if reason != "STOP":
+            logger.warning(f"Пустой текст, причина: {reason}")
+        if not response.parts and not hasattr(response, 'text'):
+             logger.warning("Модель вернула пустой ответ без явной причины.")
+
+    logger.info(f"Ответ от {GEMINI_MODEL_NAME} получен.")
+    return generated_text
+
+def _is_quota_error(error_message):
+    return "429" in error_message or "quota" in error_message.lower() or "resource_exhausted" in error_message.lower()
+
+def _fatal_api_error_message(error_message):
+    """Возвращает текст ошибки, при которой повторять запрос бессмысленно, иначе None."""
+    if _is_quota_error(error_message):
+        return "Ошибка квоты API."
+    if "API key not valid" in error_message or "permission_denied" in error_message.lower():
+        return "Неверный API ключ или права."
+    return None
+
+def _get_gemini_semaphore():
+    global _gemini_semaphore
+    if _gemini_semaphore is None:
+        _gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENT_REQUESTS)
+    return _gemini_semaphore
+
+async def _stream_response(response, on_partial_text, chunk_timeout):
+    """
+    Читает потоковый ответ, передавая накопленный текст в on_partial_text после каждого фрагмента.
+    Если следующий фрагмент не пришёл за chunk_timeout секунд, выбрасывает TimeoutError.
+    """
+    accumulated_text = ""
+    chunks = aiter(response)
+    while True:
+        try:
+            chunk = await asyncio.wait_for(anext(chunks), chunk_timeout)
+        except StopAsyncIteration:
+            break
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"Модель не прислала продолжение ответа за {chunk_timeout:.0f} с.") from None
+        try:
+            chunk_text = chunk.text
+        except ValueError: # Фрагмент без текста (например, только причина завершения)
+            continue
+        if chunk_text:
+            accumulated_text += chunk_text
+            try:
+                await on_partial_text(accumulated_text)
+            except Exception as e:
+                logger.warning(f"Ошибка в обработчике потокового ответа: {e}")
+
+def record_token_usage(response):
+    """Учитывает токены ответа (usage_metadata): промпт, из них взятые из кэша модели, и ответ."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    GEMINI_TOKENS.inc(usage.prompt_token_count, kind="prompt")
+    GEMINI_TOKENS.inc(getattr(usage, "cached_content_token_count", 0) or 0, kind="cached")
+    GEMINI_TOKENS.inc(usage.candidates_token_count, kind="output")
+    logger.debug(f"Токены запроса: промпт {usage.prompt_token_count}, ответ {usage.candidates_token_count}.")
+
+async def count_prompt_tokens(prompt_parts, system_instruction=None):
+    """Число входных токенов запроса (вместе с системной инструкцией) по данным API."""
+    result = await _model_pool.entries[0].async_model(system_instruction).count_tokens_async(prompt_parts)
+    return result.total_tokens
+
+def _get_latency_tracker(streaming):
+    tracker = _latency_trackers.get(streaming)
+    if tracker is None:
+        tracker = _latency_trackers[streaming] = LatencyTracker(
+            GEMINI_HEDGE_PERCENTILE, GEMINI_HEDGE_DEFAULT_DELAY, GEMINI_HEDGE_MIN_DELAY,
+            GEMINI_HEDGE_MIN_SAMPLES, GEMINI_HEDGE_BUDGET
+        )
+    return tracker
+
+def get_circuit_breaker():
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker(GEMINI_BREAKER_ERROR_RATE, GEMINI_BREAKER_MIN_REQUESTS,
+                                          GEMINI_BREAKER_WINDOW, GEMINI_BREAKER_OPEN_SECONDS)
+    return _circuit_breaker
+
+Gauge("dndbot_gemini_circuit_open", "1, если автомат защиты запросов к Gemini разомкнут.",
+      lambda: int(_circuit_breaker is not None and _circuit_breaker.is_open))
+
+async def _request_once(entry, prompt_parts, generation_config, tracker, on_partial_text=None, system_instruction=None):
+    """
+    Один запрос к паре ключ/модель entry. Задержка (до первого фрагмента при потоке)
+    передаётся в tracker и в статистику пары; при ошибке квоты пара уходит на карантин.
+    Ответ (при потоке - первый фрагмент) и каждый следующий фрагмент ждутся не дольше
+    GEMINI_ATTEMPT_TIMEOUT, иначе выбрасывается TimeoutError.
+    """
+    async with _get_gemini_semaphore():
+        entry.in_flight += 1
+        try:
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(entry.async_model(system_instruction).generate_content_async(
+                    contents=prompt_parts,
+                    generation_config=generation_config,
+                    stream=on_partial_text is not None
+                ), GEMINI_ATTEMPT_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(f"Нет ответа модели за {GEMINI_ATTEMPT_TIMEOUT:.0f} с.") from None
+            latency = time.perf_counter() - started
+            tracker.observe(latency)
+            entry.observe_latency(latency)
+            if on_partial_text is not None:
+                await _stream_response(response, on_partial_text, GEMINI_ATTEMPT_TIMEOUT)
+            record_token_usage(response)
+        except Exception as e:
+            if _is_quota_error(str(e)):
+                _model_pool.quarantine(entry)
+            raise
+        finally:
+            entry.in_flight -= 1
+    return _extract_generated_text(response)
+
+async def _hedged_request(prompt_parts, generation_config, on_partial_text=None, system_instruction=None):
+    """
+    Запрос к модели с возможным дублем: если ответа нет дольше перцентиля недавних задержек,
+    отправляется второй такой же запрос, и используется ответ, пришедший первым.
+    При потоке побеждает запрос, первым приславший текст; второй отменяется.
+    Дубль по возможности отправляется в другую пару ключ/модель пула.
+    Возвращает (текст, пара ключ/модель ответившего запроса, был ли дубль).
+    """
+    streaming = on_partial_text is not None
+    tracker = _get_latency_tracker(streaming)
+    attempts = []
+    attempt_entries = []
+    stream_owner = None
+
+    def start_attempt():
+        entry = _model_pool.choose(exclude=attempt_entries)
+        if entry is None:
+            return False
+        attempt_index = len(attempts)
+        forward_partial_text = None
+        if streaming:
+            async def forward_partial_text(partial_text):
+                nonlocal stream_owner
+                if stream_owner is None:
+                    stream_owner = attempt_index
+                    for other_index, other_attempt in enumerate(attempts):
+                        if other_index != attempt_index:
+                            other_attempt.cancel()
+                if stream_owner == attempt_index:
+                    await on_partial_text(partial_text)
+        attempt_entries.append(entry)
+        attempts.append(asyncio.create_task(
+            _request_once(entry, prompt_parts, generation_config, tracker, forward_partial_text, system_instruction)))
+        return True
+
+    if not start_attempt():
+        raise GeminiQuotaError("RESOURCE_EXHAUSTED: все пары ключ/модель пула на карантине.")
+    pending = set(attempts)
+    hedged = False
+    last_error = None
+    try:
+        while pending:
+            can_hedge = GEMINI_HEDGE_ENABLED and not hedged and stream_owner is None and tracker.hedge_allowed()
+            hedge_delay = tracker.hedge_delay()
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay if can_hedge else None,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                # Пока ждали, первый запрос мог начать присылать текст
+                if stream_owner is None and start_attempt():
+                    GEMINI_HEDGED_REQUESTS.inc()
+                    logger.warning(f"Нет ответа от модели за {hedge_delay:.1f} с, отправлен дублирующий запрос "
+                                   f"в {attempt_entries[-1].label}.")
+                    pending.add(attempts[-1])
+                continue
+            for attempt in done:
+                if not attempt.cancelled() and attempt.exception() is None:
+                    return attempt.result(), attempt_entries[attempts.index(attempt)], hedged
+            for attempt in done:
+                if not attempt.cancelled():
+                    last_error = attempt.exception()
+                    if pending:
+                        logger.warning(f"Ошибка одного из дублирующих запросов, ждём второй: {last_error}")
+        raise last_error or RuntimeError("Все запросы к модели отменены.")
+    finally:
+        tracker.record_request(hedged)
+        for attempt in attempts:
+            if not attempt.done():
+                attempt.cancel()
+
+async def generate_content_with_gemini_async(prompt_parts, temperature=0.7, retries=3, delay=GEMINI_RETRY_BASE_DELAY,
+                                             raise_on_quota=False, on_partial_text=None, response_schema=None,
+                                             route_info=None, system_instruction=None):
+    """
+    Запрос к модели, не блокирующий цикл событий ни на ответе, ни на паузе между повторами.
+    Число одновременных запросов ограничено GEMINI_MAX_CONCURRENT_REQUESTS.
+    Медленная попытка дублируется (см. _hedged_request). Попытка считается неудачной, если
+    ответ (при потоке - первый фрагмент) или следующий фрагмент не пришёл за GEMINI_ATTEMPT_TIMEOUT;
+    весь вызов вместе с повторами ограничен GEMINI_REQUEST_DEADLINE, и новая попытка
+    не начинается, если до него осталось меньше GEMINI_HEDGE_MIN_DELAY. Повторы идут
+    с экспоненциальной паузой. При частых сбоях upstream автомат защиты сразу
+    возвращает CIRCUIT_OPEN_MESSAGE.
+    При raise_on_quota=True ошибка квоты выбрасывается как GeminiQuotaError,
+    чтобы планировщик мог повторить запрос позже.
+    Если передан on_partial_text, ответ запрашивается потоком и корутина
+    получает накопленный текст по мере генерации.
+    Если передан response_schema, модель отвечает JSON по этой схеме.
+    system_instruction - неизменная часть промпта, передаётся отдельно от prompt_parts.
+    Запрос направляется в пару ключ/модель пула (см. gemini_pool); если передан
+    словарь route_info, в него записывается, какая пара ответила.
+    """
+    if not _model_pool:
         logger.error("Модель Gemini не инициализирована. Вызовите init_gemini() сначала.")
         return "ОШИБКА: Модель Gemini не инициализирована."
 
-    logger.info(f"Отправка запроса к модели: {GEMINI_MODEL_NAME}...")
+    logger.info(f"Отправка асинхронного запроса к Gemini (пар ключ/модель в пуле: {_model_pool.size})...")
+    with STAGE_SECONDS.time(stage="gemini_call"):
+        return await _generate_content_with_retries_async(
+            prompt_parts, temperature, retries, delay, raise_on_quota, on_partial_text, response_schema,
+            route_info if route_info is not None else {}, system_instruction
+        )
+
+async def _generate_content_with_retries_async(prompt_parts, temperature, retries, delay, raise_on_quota,
+                                               on_partial_text, response_schema, route_info, system_instruction):
+    circuit_breaker = get_circuit_breaker()
+    json_output_options = {}
+    if response_schema is not None:
+        json_output_options = {"response_mime_type": "application/json", "response_schema": response_schema}
+    generation_config = load_genai().types.GenerationConfig(temperature=temperature, **json_output_options)
+    deadline = time.monotonic() + GEMINI_REQUEST_DEADLINE
     current_retry = 0
+    attempt_number = 0
+    error_message = None
 
     while current_retry < retries:
+        # Срок проверяется перед каждой попыткой, в том числе после мгновенного повтора при ошибке квоты
+        remaining = deadline - time.monotonic()
+        if remaining < GEMINI_HEDGE_MIN_DELAY:
+            return f"ОШИБКА API: Модель не ответила за {GEMINI_REQUEST_DEADLINE:.0f} с. Ошибка: {error_message or 'нет'}"
+        attempt_number += 1
         try:
-            generation_config = genai.types.GenerationConfig(temperature=temperature)
-            response = model_gemini.generate_content(
-                contents=prompt_parts,
-                generation_config=generation_config
-            )
+            circuit_breaker.before_request()
+        except CircuitBreakerOpen:
+            GEMINI_ATTEMPTS.inc(result="circuit_open")
+            logger.warning("Автомат защиты Gemini разомкнут, запрос отклонён без обращения к модели.")
+            return CIRCUIT_OPEN_MESSAGE
 
-            if response.prompt_feedback and response.prompt_feedback.block_reason:
-                reason = response.prompt_feedback.block_reason_message
-                logger.warning(f"Промпт был заблокирован: {reason}")
-                return f"ЗАПРОС ЗАБЛОКИРОВАН: {reason}"
-
-            if not response.candidates:
-                logger.warning("Модель не вернула кандидатов.")
-                return "Модель не вернула кандидатов."
-
-            generated_text = ""
-            if hasattr(response, 'text'):
-                 generated_text = response.text
-            elif response.parts:
-                 generated_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
-
-
-            candidate = response.candidates[0]
-            if candidate.finish_reason.name == "SAFETY":
-                safety_info = "Нет деталей"
-                if hasattr(candidate, 'safety_ratings') and candidate.safety_ratings:
-                    safety_info = "; ".join(
-                        f"{r.category.name}: {r.probability.name}"
-                        for r in candidate.safety_ratings
-                    )
-                logger.warning(f"Контент заблокирован (SAFETY). Детали: {safety_info}")
-                return f"КОНТЕНТ ЗАБЛОКИРОВАН (SAFETY): {generated_text or safety_info}"
-
-            if not generated_text:
-                reason = candidate.finish_reason.name
-                if reason != "STOP":
-                    logger.warning(f"Пустой текст, причина: {reason}")
-                if not response.parts and not hasattr(response, 'text'):
-                     logger.warning("Модель вернула пустой ответ без явной причины.")
-
-            logger.info(f"Ответ от {GEMINI_MODEL_NAME} получен.")
+        attempt_started = time.perf_counter()
+        try:
+            generated_text, entry, hedged = await asyncio.wait_for(
+                _hedged_request(prompt_parts, generation_config, on_partial_text, system_instruction), remaining)
+            STAGE_SECONDS.observe(time.perf_counter() - attempt_started, stage="gemini_attempt")
+            route_info.update(key=entry.key_id, model=entry.model_name, attempts=attempt_number, hedged=hedged,
+                              latency=round(time.perf_counter() - attempt_started, 3))
+            circuit_breaker.record_success()
+            GEMINI_ATTEMPTS.inc(result="blocked" if "ЗАБЛОКИРОВАН" in generated_text[:30] else "ok")
             return generated_text
 
         except Exception as e:
+            STAGE_SECONDS.observe(time.perf_counter() - attempt_started, stage="gemini_attempt")
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            error_message = str(e) or f"Модель не ответила за {GEMINI_REQUEST_DEADLINE:.0f} с."
+            if _is_quota_error(error_message) and _model_pool.available_entries():
+                # Пара ушла на карантин, но в пуле есть другие: повторяем сразу, не расходуя попытку
+                GEMINI_ATTEMPTS.inc(result="quota")
+                logger.warning(f"Ошибка квоты ({error_message}), запрос повторяется в другой паре ключ/модель.")
+                continue
             current_retry += 1
-            error_message = str(e)
             logger.error(f"Ошибка API (попытка {current_retry}/{retries}): {error_message}")
 
-            if "429" in error_message or "quota" in error_message.lower() or "resource_exhausted" in error_message.lower():
-                return "Ошибка квоты API."
-            if "API key not valid" in error_message or "permission_denied" in error_message.lower():
-                return "Неверный API ключ или права."
-
-            if current_retry < retries:
-                time.sleep(delay)
+            fatal_message = _fatal_api_error_message(error_message)
+            if _is_quota_error(error_message):
+                GEMINI_ATTEMPTS.inc(result="quota")
             else:
+                GEMINI_ATTEMPTS.inc(result="timeout" if timed_out else "error")
+                if not fatal_message: # Неверный ключ - не сбой upstream
+                    circuit_breaker.record_failure()
+
+            if raise_on_quota and _is_quota_error(error_message):
+                raise GeminiQuotaError(error_message) from e
+            if fatal_message:
+                return fatal_message
+
+            if current_retry >= retries:
                 return f"ОШИБКА API: Макс. попыток. Ошибка: {error_message}"
+            pause = backoff_delay(current_retry, delay, GEMINI_RETRY_MAX_DELAY)
+            if time.monotonic() + pause + GEMINI_HEDGE_MIN_DELAY > deadline:
+                return f"ОШИБКА API: Модель не ответила за {GEMINI_REQUEST_DEADLINE:.0f} с. Ошибка: {error_message}"
+            await asyncio.sleep(pause)
 
     return f"ОШИБКА API: Нет ответа после {retries} попыток."
 
 
+# Порядок полей профиля: (заголовок в ответе LLM, ключ в словаре профиля)
+PROFILE_FIELDS_ORDERED = [
+    ("Имя", "name"),
+    ("Раса", "race"),
+    ("Класс", "class"),
+    ("Предыстория (Background)", "background_name"),
+    ("Мировоззрение", "alignment"),
+    ("Характеристики", "stats"),
+    ("Инвентарь", "inventory"),
+    ("Черта Характера", "trait"),
+    ("Идеал", "ideal"),
+    ("Привязанность", "bond"),
+    ("Слабость", "flaw")
+]
+BACKSTORY_TEXT_KEY = "backstory_text"
+# Поля, которые модель не пишет: их заполняет локальный движок правил (srd_rules)
+LOCAL_PROFILE_KEYS = ("stats",) if SRD_RULES_ENABLED else ()
+MISSING_FIELD_VALUE = "Не указано"
+MISSING_BACKSTORY_VALUE = "Не удалось извлечь описание предыстории."
+
+# Заголовок поля в начале строки; допускаются маркеры списка и markdown-выделение вокруг заголовка.
+# "Предыстория (Background)" стоит раньше "Предыстория", чтобы два поля не путались.
+_PROFILE_HEADER_RE = re.compile(
+    r"^[ \t]*(?:[-*•>#]+[ \t]*|\d+[.)][ \t]*)*[*_]*"
+    r"(?P<header>Имя|Раса|Класс|Предыстория[ \t]*\((?:Background|Бэкграунд)\)|Background|Мировоззрение"
+    r"|Характеристики|Инвентарь|Предыстория|Черта[ \t]+Характера|Идеал|Привязанность|Слабость)"
+    r"[ \t]*[*_]*[ \t]*:[*_]*[ \t]*",
+    re.MULTILINE | re.IGNORECASE | re.UNICODE
+)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def _normalize_header(header):
+    return _WHITESPACE_RE.sub("", header.lower())
+
+_HEADER_TO_KEY = {_normalize_header(field_ru): field_en for field_ru, field_en in PROFILE_FIELDS_ORDERED}
+_HEADER_TO_KEY.update({
+    _normalize_header("Предыстория (Бэкграунд)"): "background_name",
+    _normalize_header("Background"): "background_name",
+    _normalize_header("Предыстория"): BACKSTORY_TEXT_KEY,
+})
+
+def _split_profile_sections(raw_text):
+    """
+    Делит ответ на пары (ключ поля, значение) за один проход по тексту:
+    значение поля - всё от его заголовка до следующего заголовка.
+    """
+    headers = list(_PROFILE_HEADER_RE.finditer(raw_text))
+    sections = []
+    for index, header_match in enumerate(headers):
+        value_end = headers[index + 1].start() if index + 1 < len(headers) else len(raw_text)
+        value = raw_text[header_match.end():value_end].strip().strip("*_").strip()
+        sections.append((_HEADER_TO_KEY[_normalize_header(header_match.group("header"))], value))
+    return sections
+
+def split_profile_message(raw_text, max_length=4096):
+    """
+    Делит текст профиля на части не длиннее max_length (лимит сообщения Telegram).
+    Резать стараемся по началу поля, затем по абзацу, строке или пробелу - и не в первой
+    половине части, чтобы не получались короткие обрывки.
+    """
+    text = (raw_text or "").strip()
+    chunks = []
+    while len(text) > max_length:
+        window = text[:max_length + 1]
+        field_starts = [header_match.start() for header_match in _PROFILE_HEADER_RE.finditer(window)]
+        cut = 0
+        for min_cut in (max_length // 2, 1):
+            candidates = [
+                max((start for start in field_starts if start >= min_cut), default=-1),
+                window.rfind("\n\n", min_cut),
+                window.rfind("\n", min_cut),
+                window.rfind(" ", min_cut),
+            ]
+            cut = next((candidate for candidate in candidates if candidate >= min_cut), 0)
+            if cut:
+                break
+        cut = cut or max_length
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
 def parse_character_profile(raw_text):
     profile = {}
-    fields_ordered = [
-        ("Имя", "name"),
-        ("Раса", "race"),
-        ("Класс", "class"),
-        ("Предыстория (Background)", "background_name"),
-        ("Мировоззрение", "alignment"),
-        ("Характеристики", "stats"),
-        ("Инвентарь", "inventory"),
-        ("Черта Характера", "trait"),
-        ("Идеал", "ideal"),
-        ("Привязанность", "bond"),
-        ("Слабость", "flaw")
-    ]
-
-    current_text = raw_text
-    for field_ru, field_en in fields_ordered:
-        pattern = re.compile(rf"^{re.escape(field_ru)}:\s*([\s\S]+?)(?=\n[А-ЯЁ][\w\s\(\)-]+:|$)", re.MULTILINE | re.UNICODE)
-        match = pattern.search(current_text)
-        if match:
-            value = match.group(1).strip()
-            profile[field_en] = value
+    found = {}
+    plain_backstory_values = []
+    for field_key, value in _split_profile_sections(raw_text or ""):
+        if field_key == BACKSTORY_TEXT_KEY:
+            plain_backstory_values.append(value)
+        elif field_key not in found and value:
+            found[field_key] = value
+
+    # Если модель написала "Предыстория:" и для названия бэкграунда, и для описания,
+    # первое вхождение считаем названием, второе - текстом предыстории.
+    if "background_name" not in found and len(plain_backstory_values) >= 2:
+        found["background_name"] = plain_backstory_values.pop(0)
+    backstory_text = next((value for value in plain_backstory_values if value), None)
+
+    for field_ru, field_en in PROFILE_FIELDS_ORDERED:
+        if field_en in found:
+            profile[field_en] = found[field_en]
         else:
-            pattern_looser = re.compile(rf"{re.escape(field_ru)}:\s*([\s\S]+?)(?=\n[А-ЯЁ][\w\s\(\)-]+:|$)", re.MULTILINE | re.UNICODE)
-            match_looser = pattern_looser.search(raw_text)
-            if match_looser:
-                 profile[field_en] = match_looser.group(1).strip()
-            else:
-                profile[field_en] = "Не указано"
+            profile[field_en] = MISSING_FIELD_VALUE
+            if field_en not in LOCAL_PROFILE_KEYS:
                 logger.warning(f"Не удалось извлечь поле '{field_ru}' из ответа LLM.")
 
-    backstory_text_match = re.search(
-        r"\nИнвентарь:[^\n]*\n+Предыстория:\s*([\s\S]+?)(?=\nЧерта Характера:|$)",
-        raw_text,
-        re.MULTILINE | re.UNICODE
-    )
-    if backstory_text_match:
-        profile["backstory_text"] = backstory_text_match.group(1).strip()
+    if backstory_text:
+        profile[BACKSTORY_TEXT_KEY] = backstory_text
     else:
-        simple_bs_match = re.search(r"(?<!\(Background\):\s*\n)Предыстория:\s*([\s\S]+?)(?=\n[А-ЯЁ][\w\s\(\)-]+:|$)", raw_text, re.MULTILINE | re.UNICODE)
-        if simple_bs_match:
-            if "Предыстория (Background):" not in simple_bs_match.group(0):
-                 profile["backstory_text"] = simple_bs_match.group(1).strip()
-            else:
-                 profile["backstory_text"] = "Не удалось извлечь описание предыстории."
-                 logger.warning("Не удалось извлечь текстовое описание 'Предыстория:' (возможно, конфликт с 'Предыстория (Background):').")
-        else:
-            profile["backstory_text"] = "Не удалось извлечь описание предыстории."
-            logger.warning("Не удалось извлечь текстовое описание 'Предыстория:'. Проверьте структуру ответа LLM.")
-
+        profile[BACKSTORY_TEXT_KEY] = MISSING_BACKSTORY_VALUE
+        logger.warning("Не удалось извлечь текстовое описание 'Предыстория:'. Проверьте структуру ответа LLM.")
 
     logger.info(f"Распарсенный профиль (первые несколько полей): "
                 f"Name: {profile.get('name')}, Race: {profile.get('race')}, Class: {profile.get('class')}")
-    return profile
\ No newline at end of file
+    return profile
+
+
+# Схема профиля для режима структурированного ответа (JSON).
+# Текстовая предыстория идёт после инвентаря - как и в текстовом формате.
+PROFILE_JSON_FIELDS = PROFILE_FIELDS_ORDERED[:7] + [("Предыстория", BACKSTORY_TEXT_KEY)] + PROFILE_FIELDS_ORDERED[7:]
+_LLM_JSON_FIELDS = [(field_ru, field_en) for field_ru, field_en in PROFILE_JSON_FIELDS if field_en not in LOCAL_PROFILE_KEYS]
+PROFILE_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {field_en: {"type": "string", "description": field_ru} for field_ru, field_en in _LLM_JSON_FIELDS},
+    "required": [field_en for _, field_en in _LLM_JSON_FIELDS],
+}
+
+# Счётчики разбора ответов по режимам: сколько ответов разобрано полностью и сколько с потерями
+profile_decode_stats = {
+    "json": {"ok": 0, "failed": 0},
+    "text": {"ok": 0, "failed": 0},
+}
+
+def record_profile_decode(mode, success):
+    profile_decode_stats[mode]["ok" if success else "failed"] += 1
+    if not success:
+        PARSE_FAILURES.inc(mode=mode)
+        summary = ", ".join(f"{m}: {c['failed']}/{c['ok'] + c['failed']}" for m, c in profile_decode_stats.items())
+        logger.warning(f"Ответ LLM в режиме '{mode}' разобран с потерями. Ошибки разбора по режимам: {summary}")
+
+def is_profile_complete(profile):
+    """Все ли поля профиля, которые пишет модель, извлечены из ответа."""
+    return all(profile.get(field_en) not in (None, MISSING_FIELD_VALUE)
+               for _, field_en in PROFILE_FIELDS_ORDERED if field_en not in LOCAL_PROFILE_KEYS) \
+        and profile.get(BACKSTORY_TEXT_KEY) not in (None, MISSING_BACKSTORY_VALUE)
+
+# Поля из одной короткой строки: значение длиннее - признак того, что в поле попал чужой текст
+SHORT_PROFILE_KEYS = ("name", "race", "class", "background_name", "alignment")
+SHORT_FIELD_MAX_LENGTH = 100
+_PLACEHOLDER_RE = re.compile(r"^\[.*\]$", re.DOTALL)
+
+def profile_fields_to_repair(profile):
+    """
+    Поля профиля (заголовок, ключ), которые модель должна была написать, но которые
+    не извлечены или испорчены: пустые, шаблон "[текст]" вместо значения, слишком длинные однострочные.
+    """
+    fields = []
+    for field_ru, field_en in PROFILE_JSON_FIELDS:
+        if field_en in LOCAL_PROFILE_KEYS:
+            continue
+        value = (profile.get(field_en) or "").strip()
+        if (value in ("", MISSING_FIELD_VALUE, MISSING_BACKSTORY_VALUE) or _PLACEHOLDER_RE.match(value)
+                or (field_en in SHORT_PROFILE_KEYS and len(value) > SHORT_FIELD_MAX_LENGTH)):
+            fields.append((field_ru, field_en))
+    return fields
+
+def profile_repair_schema(fields):
+    """Схема JSON-ответа только с полями fields (пары заголовок, ключ)."""
+    return {
+        "type": "object",
+        "properties": {field_en: {"type": "string", "description": field_ru} for field_ru, field_en in fields},
+        "required": [field_en for _, field_en in fields],
+    }
+
+def parse_profile_repair_json(raw_text, fields):
+    """Значения полей fields из JSON-ответа дозапроса; поля без значения пропускаются."""
+    try:
+        data = json.loads(raw_text)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Ответ LLM на дозапрос полей не является корректным JSON: {e}")
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    values = {}
+    for _, field_en in fields:
+        value = data.get(field_en)
+        if isinstance(value, list):
+            value = ", ".join(str(item) for item in value)
+        if value is not None and str(value).strip():
+            values[field_en] = str(value).strip()
+    return values
+
+def parse_character_profile_json(raw_text):
+    """
+    Разбирает ответ модели в режиме JSON.
+    Возвращает профиль в том же виде, что parse_character_profile, или None,
+    если ответ не является JSON-объектом со всеми полями схемы.
+    """
+    try:
+        data = json.loads(raw_text)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Ответ LLM не является корректным JSON: {e}")
+        return None
+    if not isinstance(data, dict):
+        logger.warning("Ответ LLM в режиме JSON не является объектом.")
+        return None
+
+    profile = {field_en: MISSING_FIELD_VALUE for field_en in LOCAL_PROFILE_KEYS}
+    for field_ru, field_en in _LLM_JSON_FIELDS:
+        value = data.get(field_en)
+        if isinstance(value, list):
+            value = ", ".join(str(item) for item in value)
+        elif isinstance(value, dict):
+            value = ", ".join(f"{key} {item}" for key, item in value.items())
+        if value is None or not str(value).strip():
+            logger.warning(f"В JSON-ответе LLM нет поля '{field_en}' ({field_ru}).")
+            return None
+        profile[field_en] = str(value).strip()
+
+    logger.info(f"Распарсенный JSON-профиль: Name: {profile.get('name')}, Race: {profile.get('race')}, Class: {profile.get('class')}")
+    return profile
+
+def format_character_profile(profile):
+    """Представляет профиль в текстовом формате с заголовками (как в ответе текстового режима)."""
+    return "\n".join(f"{field_ru}: {profile.get(field_en, MISSING_FIELD_VALUE)}" for field_ru, field_en in PROFILE_JSON_FIELDS)
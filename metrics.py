@@ -0,0 +1,185 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Гистограммы длительности этапов генерации, счётчики исходов и датчики очередей
+отдаются по HTTP на METRICS_PORT (GET /metrics), если порт задан.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from config import METRICS_LISTEN, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_registry = []
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # метки -> [счётчики по корзинам, сумма, количество]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (bucket_counts, total, count) in sorted(self._series.items()):
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', upper_bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Gauge:
+    """Датчик, значение которого вычисляется функцией в момент чтения метрик."""
+
+    def __init__(self, name, documentation, value_function):
+        self.name = name
+        self.documentation = documentation
+        self.value_function = value_function
+        _registry.append(self)
+
+    def render(self):
+        try:
+            value = self.value_function()
+        except Exception as e:
+            logger.warning(f"Не удалось получить значение метрики {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Метрики конвейера генерации
+STAGE_SECONDS = Histogram(
+    "dndbot_stage_seconds",
+    "Длительность этапов генерации персонажа в секундах.",
+    ["stage"]
+)
+GEMINI_ATTEMPTS = Counter(
+    "dndbot_gemini_attempts_total",
+    "Попытки запроса к Gemini по результату.",
+    ["result"]
+)
+GEMINI_HEDGED_REQUESTS = Counter(
+    "dndbot_gemini_hedged_requests_total",
+    "Попытки, для которых был отправлен дублирующий запрос к Gemini."
+)
+GEMINI_TOKENS = Counter(
+    "dndbot_gemini_tokens_total",
+    "Токены Gemini по данным ответов: prompt - входные, cached - из них взятые из кэша модели, output - ответ.",
+    ["kind"]
+)
+PARSE_FAILURES = Counter(
+    "dndbot_parse_failures_total",
+    "Ответы модели, разобранные с потерями полей, по формату ответа.",
+    ["mode"]
+)
+PROFILE_REPAIRS = Counter(
+    "dndbot_profile_repairs_total",
+    "Дозапросы недостающих полей профиля по результату: repaired - все поля восстановлены, partial - часть, failed - ни одного.",
+    ["result"]
+)
+GENERATION_OUTCOMES = Counter(
+    "dndbot_generation_outcomes_total",
+    "Итог генерации персонажа для пользователя.",
+    ["outcome"]
+)
+
+SESSIONS_EVICTED = Counter(
+    "dndbot_sessions_evicted_total",
+    "Сессии диалога /create, удалённые из памяти до завершения: idle - по простою, lru - при переполнении.",
+    ["reason"]
+)
+
+LOOP_SLOW_CALLBACKS = Counter(
+    "dndbot_loop_slow_callbacks_total",
+    "Обработчики, заблокировавшие цикл событий дольше SLOW_CALLBACK_THRESHOLD."
+)
+
+TELEGRAM_REQUESTS = Counter(
+    "dndbot_telegram_requests_total",
+    "Запросы к Bot API по результату: отправлен, пропущен как повторный, отложен по RetryAfter.",
+    ["result"]
+)
+
+
+
+async def start_metrics_server():
+    """Запускает HTTP-сервер метрик на METRICS_LISTEN:METRICS_PORT. Возвращает runner или None."""
+    if METRICS_PORT <= 0:
+        return None
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_LISTEN, METRICS_PORT).start()
+    logger.info(f"Метрики доступны на http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+    return runner
@@ -2,6 +2,7 @@ import logging
 import os
 import traceback
 import io
+from xml.sax.saxutils import escape
 
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import (
@@ -9,25 +10,35 @@ from reportlab.platypus import (
     Paragraph,
     Spacer,
     Table,
-    TableStyle
+    TableStyle,
+    PageBreak
 )
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
 from reportlab.lib import colors
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import simpleSplit
 
-from config import FONT_PATH_FOR_BOT_SESSION
+from config import FONT_PATH_FOR_BOT_SESSION, PDF_FAST_RENDERER
 
 logger = logging.getLogger(__name__)
 HAS_DEJAVU_FONT = False
 
+PAGE_WIDTH, PAGE_HEIGHT = A4
+PAGE_MARGIN = 40
+FRAME_PADDING = 6  # внутренний отступ рамки SimpleDocTemplate
+CONTENT_LEFT = PAGE_MARGIN + FRAME_PADDING
+LABEL_COLUMN_WIDTH = 120
+
 def register_font():
     """
     Регистрирует шрифт для использования в PDF.
     Эту функцию следует вызывать один раз при старте приложения.
     """
-    global HAS_DEJAVU_FONT
+    global HAS_DEJAVU_FONT, _sheet_template
+    _sheet_template = None # Шаблон листа готовится заново под зарегистрированный шрифт
     if FONT_PATH_FOR_BOT_SESSION and os.path.exists(FONT_PATH_FOR_BOT_SESSION):
         try:
             pdfmetrics.registerFont(TTFont('DejaVuSans', FONT_PATH_FOR_BOT_SESSION))
@@ -41,73 +52,266 @@ def register_font():
         logger.warning(f"Файл шрифта для PDF не найден или не определён: '{path_info}'. Будет использован Helvetica.")
         HAS_DEJAVU_FONT = False
 
+def _paragraph_text(text):
+    """
+    Текст персонажа для Paragraph: без разметки (символы & и < выводятся как есть)
+    и с сохранёнными переносами строк - так же, как его рисует _render_fast.
+    """
+    return escape(str(text)).replace('\n', '<br/>\n')
+
+def _character_sheet_story(character_data):
+    """Возвращает список flowable-элементов листа одного персонажа."""
+    story = []
+
+    styles = getSampleStyleSheet()
+    font_name = 'DejaVuSans' if HAS_DEJAVU_FONT else 'Helvetica'
+    font_name_bold = 'DejaVuSans' if HAS_DEJAVU_FONT else 'Helvetica-Bold'
+
+    style_normal = ParagraphStyle('NormalCustom', parent=styles['Normal'], fontName=font_name, fontSize=10, leading=12, alignment=TA_JUSTIFY)
+    style_h1 = ParagraphStyle('H1Custom', parent=styles['h1'], fontName=font_name_bold, fontSize=18, leading=22, alignment=TA_CENTER, spaceAfter=12)
+    style_h2 = ParagraphStyle('H2Custom', parent=styles['h2'], fontName=font_name_bold, fontSize=12, leading=14, spaceBefore=10, spaceAfter=4, alignment=TA_LEFT)
+    style_label = ParagraphStyle('LabelCustom', parent=style_normal, fontName=font_name_bold)
+
+    story.append(Paragraph(_paragraph_text(character_data.get("name", "Безымянный Герой")), style_h1))
+    story.append(Spacer(1, 6))
+
+    info_data = [
+        [Paragraph("Раса:", style_label), Paragraph(_paragraph_text(character_data.get("race", "-")), style_normal)],
+        [Paragraph("Класс:", style_label), Paragraph(_paragraph_text(character_data.get("class", "-")), style_normal)],
+        [Paragraph("Предыстория (Bkgd):", style_label), Paragraph(_paragraph_text(character_data.get("background_name", "-")), style_normal)],
+        [Paragraph("Мировоззрение:", style_label), Paragraph(_paragraph_text(character_data.get("alignment", "-")), style_normal)],
+    ]
+    info_table = Table(info_data, colWidths=[120, None])
+    info_table.setStyle(TableStyle([
+        ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
+        ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 3)
+    ]))
+    story.append(info_table)
+    story.append(Spacer(1, 6))
+
+    story.append(Paragraph("Характеристики:", style_h2))
+    story.append(Paragraph(_paragraph_text(character_data.get("stats", "-")), style_normal))
+
+    story.append(Paragraph("Инвентарь:", style_h2))
+    story.append(Paragraph(_paragraph_text(character_data.get("inventory", "-")), style_normal))
+
+    story.append(Paragraph("Предыстория:", style_h2))
+    story.append(Paragraph(_paragraph_text(character_data.get("backstory_text", "-")), style_normal))
+
+    story.append(Paragraph("Черты Личности:", style_h2))
+    traits_data = [
+        [Paragraph("Черта Характера:", style_label), Paragraph(_paragraph_text(character_data.get("trait", "-")), style_normal)],
+        [Paragraph("Идеал:", style_label), Paragraph(_paragraph_text(character_data.get("ideal", "-")), style_normal)],
+        [Paragraph("Привязанность:", style_label), Paragraph(_paragraph_text(character_data.get("bond", "-")), style_normal)],
+        [Paragraph("Слабость:", style_label), Paragraph(_paragraph_text(character_data.get("flaw", "-")), style_normal)],
+    ]
+    traits_table = Table(traits_data, colWidths=[120, None])
+    traits_table.setStyle(TableStyle([
+         ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
+         ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 3)
+    ]))
+    story.append(traits_table)
+    return story
+
+class _SheetTemplate:
+    """
+    Неизменная часть листа персонажа для быстрого рендеринга: шрифты, размеры, отступы
+    и подписи (уже разбитые на строки). Готовится один раз на процесс; на каждый лист
+    раскладывается только текст персонажа.
+    """
+    TITLE_SIZE, TITLE_LEADING, TITLE_SPACE_AFTER = 18, 22, 12
+    HEADING_SIZE, HEADING_LEADING, HEADING_SPACE_BEFORE, HEADING_SPACE_AFTER = 12, 14, 10, 4
+    TEXT_SIZE, TEXT_LEADING, SPACER_HEIGHT = 10, 12, 6
+    ROW_TOP_PADDING, ROW_BOTTOM_PADDING = 3, 3  # TOPPADDING таблиц по умолчанию и BOTTOMPADDING из их стиля
+
+    def __init__(self, font_name, font_name_bold):
+        self.font_name = font_name
+        self.font_name_bold = font_name_bold
+        self.text_width = PAGE_WIDTH - 2 * CONTENT_LEFT
+        self.value_width = self.text_width - LABEL_COLUMN_WIDTH
+        self.info_rows = self._rows([("Раса:", "race"), ("Класс:", "class"),
+                                     ("Предыстория (Bkgd):", "background_name"), ("Мировоззрение:", "alignment")])
+        self.sections = [("Характеристики:", "stats"), ("Инвентарь:", "inventory"), ("Предыстория:", "backstory_text")]
+        self.traits_heading = "Черты Личности:"
+        self.trait_rows = self._rows([("Черта Характера:", "trait"), ("Идеал:", "ideal"),
+                                      ("Привязанность:", "bond"), ("Слабость:", "flaw")])
+
+    def _rows(self, labels):
+        return [(self.split(label, LABEL_COLUMN_WIDTH, self.font_name_bold), key) for label, key in labels]
+
+    def split(self, text, width, font_name=None, font_size=TEXT_SIZE):
+        """
+        Разбивает текст на строки по ширине, сохраняя переносы строк исходного текста.
+        Возвращает пары (строка, последняя ли это строка абзаца): её, как и platypus, не выравнивают по ширине.
+        """
+        lines = []
+        # Перенос в конце текста platypus не рисует как пустую строку
+        for paragraph in str(text).rstrip("\n").split("\n"):
+            paragraph_lines = simpleSplit(paragraph, font_name or self.font_name, font_size, width) or [""]
+            lines.extend((text_line, index == len(paragraph_lines) - 1) for index, text_line in enumerate(paragraph_lines))
+        return lines
+
+_sheet_template = None
+
+def _get_sheet_template():
+    global _sheet_template
+    if _sheet_template is None:
+        _sheet_template = _SheetTemplate('DejaVuSans' if HAS_DEJAVU_FONT else 'Helvetica',
+                                         'DejaVuSans' if HAS_DEJAVU_FONT else 'Helvetica-Bold')
+    return _sheet_template
+
+def _layout_character_page(character_data, template):
+    """
+    Раскладывает лист персонажа по тем же размерам и выравниванию, что и _character_sheet_story:
+    заголовок по центру, текст и подписи по ширине (кроме последней строки абзаца), разделы влево.
+    Возвращает список строк (шрифт, размер, x, y, текст, выравнивание, ширина колонки) или None,
+    если текст не помещается на одну страницу.
+    """
+    lines = []
+    y = PAGE_HEIGHT - CONTENT_LEFT
+
+    def add_lines(text_lines, font_name, font_size, leading, x, align="left", width=0):
+        nonlocal y
+        line_y = y
+        for text_line, paragraph_end in text_lines:
+            line_y -= leading
+            line_align = "left" if align == "justify" and paragraph_end else align
+            lines.append((font_name, font_size, x, line_y + leading - font_size, text_line, line_align, width))
+        return y - line_y
+
+    def add_rows(rows):
+        nonlocal y
+        for label_lines, key in rows:
+            value_lines = template.split(character_data.get(key, "-"), template.value_width)
+            y -= template.ROW_TOP_PADDING
+            label_height = add_lines(label_lines, template.font_name_bold, template.TEXT_SIZE, template.TEXT_LEADING,
+                                     CONTENT_LEFT, "justify", LABEL_COLUMN_WIDTH)
+            value_height = add_lines(value_lines, template.font_name, template.TEXT_SIZE, template.TEXT_LEADING,
+                                     CONTENT_LEFT + LABEL_COLUMN_WIDTH, "justify", template.value_width)
+            y -= max(label_height, value_height) + template.ROW_BOTTOM_PADDING
+
+    def add_heading(text):
+        nonlocal y
+        y -= template.HEADING_SPACE_BEFORE
+        y -= add_lines([(text, True)], template.font_name_bold, template.HEADING_SIZE, template.HEADING_LEADING, CONTENT_LEFT)
+        y -= template.HEADING_SPACE_AFTER
+
+    title_lines = template.split(character_data.get("name", "Безымянный Герой"), template.text_width,
+                                 template.font_name_bold, template.TITLE_SIZE)
+    y -= add_lines(title_lines, template.font_name_bold, template.TITLE_SIZE, template.TITLE_LEADING,
+                   PAGE_WIDTH / 2, "center")
+    y -= template.TITLE_SPACE_AFTER + template.SPACER_HEIGHT
+
+    add_rows(template.info_rows)
+    y -= template.SPACER_HEIGHT
+    for heading, key in template.sections:
+        add_heading(heading)
+        y -= add_lines(template.split(character_data.get(key, "-"), template.text_width),
+                       template.font_name, template.TEXT_SIZE, template.TEXT_LEADING, CONTENT_LEFT,
+                       "justify", template.text_width)
+    add_heading(template.traits_heading)
+    add_rows(template.trait_rows)
+
+    if y < CONTENT_LEFT:
+        return None
+    return lines
+
+def _render_fast(characters_data):
+    """
+    Рисует листы персонажей прямо на canvas, без раскладки platypus.
+    Возвращает io.BytesIO или None, если какой-то лист не помещается на страницу.
+    """
+    template = _get_sheet_template()
+    pages = []
+    for character_data in characters_data:
+        page_lines = _layout_character_page(character_data, template)
+        if page_lines is None:
+            return None
+        pages.append(page_lines)
+
+    pdf_buffer = io.BytesIO()
+    pdf_canvas = canvas.Canvas(pdf_buffer, pagesize=A4)
+    for page_lines in pages:
+        # Весь текст страницы - один текстовый объект; шрифт переключается только при смене
+        text_object = pdf_canvas.beginText()
+        current_font = None
+        for font_name, font_size, x, y, text_line, align, width in page_lines:
+            if (font_name, font_size) != current_font:
+                text_object.setFont(font_name, font_size)
+                current_font = (font_name, font_size)
+            word_space = 0
+            if align == "center":
+                x -= pdfmetrics.stringWidth(text_line, font_name, font_size) / 2
+            elif align == "justify" and " " in text_line:
+                # Как в platypus: свободное место строки делится поровну между пробелами
+                extra_space = width - pdfmetrics.stringWidth(text_line, font_name, font_size)
+                word_space = extra_space / text_line.count(" ") if extra_space > 0 else 0
+            text_object.setTextOrigin(x, y)
+            if word_space:
+                text_object.setWordSpace(word_space)
+                text_object.textOut(text_line)
+                text_object.setWordSpace(0)
+            else:
+                text_object.textOut(text_line)
+        pdf_canvas.drawText(text_object)
+        pdf_canvas.showPage()
+    pdf_canvas.save()
+    pdf_buffer.seek(0)
+    return pdf_buffer
+
+def _build_pdf(story):
+    pdf_buffer = io.BytesIO()
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=A4,
+                            rightMargin=40, leftMargin=40,
+                            topMargin=40, bottomMargin=40)
+    doc.build(story)
+    pdf_buffer.seek(0)
+    return pdf_buffer
+
 def create_character_sheet_pdf(character_data):
     """
     Создает PDF-файл с листом персонажа в буфере памяти.
     Возвращает объект io.BytesIO с PDF-данными или None в случае ошибки.
     """
-    pdf_buffer = io.BytesIO()
     try:
-        doc = SimpleDocTemplate(pdf_buffer, pagesize=A4,
-                                rightMargin=40, leftMargin=40,
-                                topMargin=40, bottomMargin=40)
-        story = []
-
-        styles = getSampleStyleSheet()
-        font_name = 'DejaVuSans' if HAS_DEJAVU_FONT else 'Helvetica'
-        font_name_bold = 'DejaVuSans' if HAS_DEJAVU_FONT else 'Helvetica-Bold'
-
-        style_normal = ParagraphStyle('NormalCustom', parent=styles['Normal'], fontName=font_name, fontSize=10, leading=12, alignment=TA_JUSTIFY)
-        style_h1 = ParagraphStyle('H1Custom', parent=styles['h1'], fontName=font_name_bold, fontSize=18, leading=22, alignment=TA_CENTER, spaceAfter=12)
-        style_h2 = ParagraphStyle('H2Custom', parent=styles['h2'], fontName=font_name_bold, fontSize=12, leading=14, spaceBefore=10, spaceAfter=4, alignment=TA_LEFT)
-        style_label = ParagraphStyle('LabelCustom', parent=style_normal, fontName=font_name_bold)
-
-        story.append(Paragraph(character_data.get("name", "Безымянный Герой"), style_h1))
-        story.append(Spacer(1, 6))
-
-        info_data = [
-            [Paragraph("Раса:", style_label), Paragraph(character_data.get("race", "-"), style_normal)],
-            [Paragraph("Класс:", style_label), Paragraph(character_data.get("class", "-"), style_normal)],
-            [Paragraph("Предыстория (Bkgd):", style_label), Paragraph(character_data.get("background_name", "-"), style_normal)],
-            [Paragraph("Мировоззрение:", style_label), Paragraph(character_data.get("alignment", "-"), style_normal)],
-        ]
-        info_table = Table(info_data, colWidths=[120, None])
-        info_table.setStyle(TableStyle([
-            ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
-            ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 3)
-        ]))
-        story.append(info_table)
-        story.append(Spacer(1, 6))
-
-        story.append(Paragraph("Характеристики:", style_h2))
-        story.append(Paragraph(character_data.get("stats", "-"), style_normal))
-
-        story.append(Paragraph("Инвентарь:", style_h2))
-        story.append(Paragraph(character_data.get("inventory", "-"), style_normal))
-
-        story.append(Paragraph("Предыстория:", style_h2))
-        backstory_text_html = character_data.get("backstory_text", "-").replace('\n', '<br/>\n')
-        story.append(Paragraph(backstory_text_html, style_normal))
-
-        story.append(Paragraph("Черты Личности:", style_h2))
-        traits_data = [
-            [Paragraph("Черта Характера:", style_label), Paragraph(character_data.get("trait", "-"), style_normal)],
-            [Paragraph("Идеал:", style_label), Paragraph(character_data.get("ideal", "-"), style_normal)],
-            [Paragraph("Привязанность:", style_label), Paragraph(character_data.get("bond", "-"), style_normal)],
-            [Paragraph("Слабость:", style_label), Paragraph(character_data.get("flaw", "-"), style_normal)],
-        ]
-        traits_table = Table(traits_data, colWidths=[120, None])
-        traits_table.setStyle(TableStyle([
-             ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
-             ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 3)
-        ]))
-        story.append(traits_table)
-
-        doc.build(story)
+        pdf_buffer = _render_fast([character_data]) if PDF_FAST_RENDERER else None
+        if pdf_buffer is None:
+            # Длинный текст не помещается на страницу шаблона - раскладка platypus с переносом на новые страницы
+            pdf_buffer = _build_pdf(_character_sheet_story(character_data))
         logger.info(f"PDF успешно создан в памяти.")
-        pdf_buffer.seek(0)
         return pdf_buffer
     except Exception as e:
         logger.error(f"Ошибка при создании PDF в памяти: {e}")
         logger.error(traceback.format_exc())
         return None
+
+def create_party_sheet_pdf(characters_data):
+    """
+    Создает многостраничный PDF: лист каждого персонажа группы начинается с новой страницы.
+    Возвращает объект io.BytesIO с PDF-данными или None в случае ошибки.
+    """
+    try:
+        pdf_buffer = _render_fast(characters_data) if PDF_FAST_RENDERER else None
+        if pdf_buffer is None:
+            story = []
+            for index, character_data in enumerate(characters_data):
+                if index:
+                    story.append(PageBreak())
+                story.extend(_character_sheet_story(character_data))
+            pdf_buffer = _build_pdf(story)
+        logger.info(f"PDF группы из {len(characters_data)} персонажей успешно создан в памяти.")
+        return pdf_buffer
+    except Exception as e:
+        logger.error(f"Ошибка при создании PDF группы в памяти: {e}")
+        logger.error(traceback.format_exc())
+        return None
+
+def render_character_pdf_bytes(character_data):
+    """То же, что create_character_sheet_pdf, но возвращает bytes (для запуска в отдельном процессе)."""
+    pdf_buffer = create_character_sheet_pdf(character_data)
+    return pdf_buffer.getvalue() if pdf_buffer else None
+
+def render_party_pdf_bytes(characters_data):
+    """То же, что create_party_sheet_pdf, но возвращает bytes (для запуска в отдельном процессе)."""
+    pdf_buffer = create_party_sheet_pdf(characters_data)
+    return pdf_buffer.getvalue() if pdf_buffer else None
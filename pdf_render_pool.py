@@ -0,0 +1,91 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import PDF_RENDER_WORKERS
+from metrics import STAGE_SECONDS
+from profiling import current_run, profile_call
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_tasks_in_flight = 0
+
+
+# pdf_generator (и reportlab) импортируются при первом рендеринге или прогреве, а не при запуске бота
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        from pdf_generator import register_font
+        # spawn вместо fork: дочерние процессы не наследуют потоки grpc и цикл событий бота.
+        # register_font выполняется один раз при старте каждого процесса.
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=register_font
+        )
+        logger.info(f"Пул процессов для рендеринга PDF запущен: {PDF_RENDER_WORKERS} процессов.")
+    return _executor
+
+
+async def _render(render_function, data):
+    global _tasks_in_flight
+    started = time.perf_counter()
+    if PDF_RENDER_WORKERS <= 0:
+        pdf_bytes = await asyncio.to_thread(render_function, data)
+    else:
+        _tasks_in_flight += 1
+        if _tasks_in_flight > PDF_RENDER_WORKERS:
+            logger.warning(f"Пул рендеринга PDF насыщен: {_tasks_in_flight} задач на {PDF_RENDER_WORKERS} процессов, "
+                           f"в очереди {_tasks_in_flight - PDF_RENDER_WORKERS}.")
+        try:
+            loop = asyncio.get_running_loop()
+            profiled_run = current_run()
+            if profiled_run is None:
+                pdf_bytes = await loop.run_in_executor(_get_executor(), render_function, data)
+            else:
+                # Рендеринг в процессе пула не виден профилировщику основного процесса
+                pdf_bytes, stats_data = await loop.run_in_executor(_get_executor(), profile_call, render_function, data)
+                profiled_run.add_worker_stats("pdf", stats_data)
+        except BrokenProcessPool as e:
+            logger.error(f"Пул рендеринга PDF недоступен ({e}), PDF создаётся в потоке основного процесса.")
+            await shutdown_pdf_render_pool()
+            pdf_bytes = await asyncio.to_thread(render_function, data)
+        finally:
+            _tasks_in_flight -= 1
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="pdf")
+    return io.BytesIO(pdf_bytes) if pdf_bytes else None
+
+
+async def render_character_pdf(character_data):
+    """Создает PDF листа персонажа в пуле процессов. Возвращает io.BytesIO или None."""
+    from pdf_generator import render_character_pdf_bytes
+    return await _render(render_character_pdf_bytes, character_data)
+
+
+async def render_party_pdf(characters_data):
+    """Создает многостраничный PDF группы в пуле процессов. Возвращает io.BytesIO или None."""
+    from pdf_generator import render_party_pdf_bytes
+    return await _render(render_party_pdf_bytes, characters_data)
+
+
+async def warm_up_pdf_render_pool():
+    """Запускает процессы пула заранее, чтобы первый PDF не ждал их старта и импорта reportlab."""
+    if PDF_RENDER_WORKERS <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(PDF_RENDER_WORKERS)))
+
+async def shutdown_pdf_render_pool():
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+        logger.info("Пул процессов для рендеринга PDF остановлен.")
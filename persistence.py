@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import (
+    PERSISTENCE_BACKEND,
+    PERSISTENCE_SQLITE_PATH,
+    PERSISTENCE_UPDATE_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Хранит состояния ConversationHandler и user_data в SQLite, чтобы незавершённые диалоги
+    пережили перезапуск бота.
+
+    Записи не выполняются на каждом шаге диалога: Application передаёт изменения
+    раз в update_interval секунд, а они накапливаются и записываются одной транзакцией
+    в отдельном потоке, не блокируя цикл событий.
+    База рассчитана на один процесс бота: состояния диалогов ConversationHandler читает
+    только при запуске, поэтому шаги, сделанные в другом процессе, он не увидит.
+    """
+
+    def __init__(self, path, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._path = path
+        self._connection = None
+        self._db_lock = threading.Lock()
+        self._pending_conversations = {}  # (name, key) -> (state, updated_at)
+        self._pending_user_data = {}  # user_id -> (data | None, updated_at)
+        self._flush_task = None
+
+    # --- Работа с базой (выполняется в отдельном потоке) ---
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    name TEXT NOT NULL,
+                    conversation_key TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (name, conversation_key)
+                );
+                CREATE TABLE IF NOT EXISTS user_data (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+            """)
+        return self._connection
+
+    def _query(self, sql, parameters=()):
+        with self._db_lock:
+            return self._connect().execute(sql, parameters).fetchall()
+
+    def _write_batch(self, conversations, user_data):
+        with self._db_lock:
+            connection = self._connect()
+            with connection:
+                for (name, key), (state, updated_at) in conversations.items():
+                    if state is None:
+                        connection.execute("DELETE FROM conversations WHERE name = ? AND conversation_key = ?",
+                                           (name, json.dumps(key)))
+                    else:
+                        connection.execute(
+                            "INSERT INTO conversations (name, conversation_key, state, updated_at) VALUES (?, ?, ?, ?) "
+                            "ON CONFLICT (name, conversation_key) DO UPDATE SET state = excluded.state, "
+                            "updated_at = excluded.updated_at",
+                            (name, json.dumps(key), json.dumps(state), updated_at))
+                for user_id, (data, updated_at) in user_data.items():
+                    if data is None:
+                        connection.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+                    else:
+                        connection.execute(
+                            "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+                            "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                            (user_id, json.dumps(data, ensure_ascii=False), updated_at))
+
+    # --- Пакетная запись ---
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_pending())
+
+    async def _flush_pending(self):
+        await asyncio.sleep(0) # Даём Application передать все изменения текущего цикла
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        user_data, self._pending_user_data = self._pending_user_data, {}
+        if not conversations and not user_data:
+            return
+        try:
+            await asyncio.to_thread(self._write_batch, conversations, user_data)
+            logger.debug(f"Сохранено состояний диалогов: {len(conversations)}, user_data: {len(user_data)}.")
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояния диалогов в {self._path}: {e}")
+            # Возвращаем несохранённое, не затирая более свежие изменения
+            for conversation, value in conversations.items():
+                self._pending_conversations.setdefault(conversation, value)
+            for user_id, value in user_data.items():
+                self._pending_user_data.setdefault(user_id, value)
+
+    # --- Интерфейс BasePersistence ---
+
+    async def get_conversations(self, name):
+        rows = await asyncio.to_thread(
+            self._query, "SELECT conversation_key, state FROM conversations WHERE name = ?", (name,))
+        conversations = {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+        logger.info(f"Восстановлено незавершённых диалогов '{name}': {len(conversations)}.")
+        return conversations
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, key)] = (new_state, time.time())
+        self._schedule_flush()
+
+    async def get_user_data(self):
+        rows = await asyncio.to_thread(self._query, "SELECT user_id, data FROM user_data")
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def update_user_data(self, user_id, data):
+        self._pending_user_data[user_id] = (dict(data), time.time())
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._pending_user_data[user_id] = (None, time.time())
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass # Данные меняет только этот процесс: в памяти всегда самая свежая версия
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_pending()
+        if self._connection is not None:
+            with self._db_lock:
+                self._connection.close()
+                self._connection = None
+        logger.info(f"Состояние диалогов сохранено в {self._path}.")
+
+    # Данные бота, чатов и callback_data не хранятся (store_data их исключает)
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+
+def create_persistence():
+    """Создает хранилище состояния диалогов согласно PERSISTENCE_BACKEND или возвращает None."""
+    if PERSISTENCE_BACKEND == "sqlite":
+        logger.info(f"Состояние диалогов хранится в SQLite: {PERSISTENCE_SQLITE_PATH}")
+        return SQLitePersistence(PERSISTENCE_SQLITE_PATH, PERSISTENCE_UPDATE_INTERVAL)
+    if PERSISTENCE_BACKEND not in ("", "none", "memory"):
+        logger.warning(f"Неизвестное хранилище состояния '{PERSISTENCE_BACKEND}', состояние хранится только в памяти.")
+    return None
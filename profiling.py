@@ -0,0 +1,209 @@
+"""
+Профилирование по запросу: выборочные запуски генерации под cProfile и tracemalloc
+и детектор обработчиков, надолго блокирующих цикл событий.
+
+Доля вызовов, обёрнутых sampled_profile (PROFILING_SAMPLE_RATE или команда /profile),
+выполняется под cProfile и tracemalloc. В PROFILING_DIR пишутся файлы с меткой времени:
+<время>_<user_id>.prof (открывается pstats или snakeviz), <время>_<user_id>_pdf.prof -
+рендеринг PDF в процессе пула, и <время>_<user_id>_alloc.txt - места, где за запуск
+выделено больше всего памяти. cProfile профилирует весь поток цикла событий, поэтому
+одновременно профилируется только один запуск, а в профиль попадают и другие
+обработчики, работавшие в это время.
+"""
+import asyncio
+import cProfile
+import contextvars
+import datetime
+import functools
+import logging
+import marshal
+import os
+import random
+import time
+import tracemalloc
+
+from config import PROFILING_SAMPLE_RATE, PROFILING_DIR, PROFILING_TOP_ALLOCATIONS, SLOW_CALLBACK_THRESHOLD
+from metrics import LOOP_SLOW_CALLBACKS
+
+logger = logging.getLogger(__name__)
+
+_sample_rate = PROFILING_SAMPLE_RATE
+_forced_runs = 0  # запуски, которые будут профилированы вне зависимости от доли (/profile next)
+_run_in_progress = False
+_current_run = contextvars.ContextVar("profiling_run", default=None)
+_saved_runs = 0
+
+_slow_callback_threshold = 0.0
+_original_handle_run = None
+
+
+def set_sample_rate(rate):
+    global _sample_rate
+    _sample_rate = min(max(rate, 0.0), 1.0)
+
+def profile_next_run():
+    global _forced_runs
+    _forced_runs += 1
+
+def disable_profiling():
+    """Выключает выборочное профилирование и детектор медленных обработчиков."""
+    global _forced_runs
+    _forced_runs = 0
+    set_sample_rate(0.0)
+    set_slow_callback_threshold(0.0)
+
+def profiling_status():
+    return {
+        "sample_rate": _sample_rate,
+        "forced_runs": _forced_runs,
+        "saved_runs": _saved_runs,
+        "slow_callback_threshold": _slow_callback_threshold,
+        "directory": PROFILING_DIR,
+    }
+
+
+class ProfiledRun:
+    """Файлы одного профилируемого запуска и статистика, собранная в процессах пула."""
+
+    def __init__(self, label):
+        self.path_prefix = os.path.join(PROFILING_DIR, f"{datetime.datetime.now():%Y%m%d_%H%M%S_%f}_{label}")
+        self.worker_stats = []  # (название, статистика cProfile в формате marshal)
+
+    def add_worker_stats(self, name, stats_data):
+        self.worker_stats.append((name, stats_data))
+
+    def save(self, profiler, snapshot_before, snapshot_after, peak_bytes, elapsed):
+        allocations = snapshot_after.compare_to(snapshot_before, "lineno")
+        os.makedirs(PROFILING_DIR, exist_ok=True)
+        profiler.dump_stats(f"{self.path_prefix}.prof")
+        for name, stats_data in self.worker_stats:
+            with open(f"{self.path_prefix}_{name}.prof", "wb") as f:
+                f.write(stats_data)
+        lines = [f"Длительность: {elapsed:.2f} с, пик памяти tracemalloc: {peak_bytes / 1024:.0f} КБ",
+                 f"Места с наибольшим приростом памяти за запуск (топ {PROFILING_TOP_ALLOCATIONS}):"]
+        lines.extend(str(stat) for stat in allocations[:PROFILING_TOP_ALLOCATIONS])
+        with open(f"{self.path_prefix}_alloc.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def current_run():
+    """Профилируемый запуск, в контексте которого выполняется код, или None."""
+    return _current_run.get()
+
+
+def _should_profile():
+    global _forced_runs
+    if _run_in_progress:
+        return False
+    if _forced_runs > 0:
+        _forced_runs -= 1
+        return True
+    return _sample_rate > 0 and random.random() < _sample_rate
+
+
+def sampled_profile(coroutine_function):
+    """Декоратор корутины: выбранные вызовы выполняются под cProfile и tracemalloc (см. описание модуля)."""
+    @functools.wraps(coroutine_function)
+    async def wrapper(*args, **kwargs):
+        global _run_in_progress, _saved_runs
+        if not _should_profile():
+            return await coroutine_function(*args, **kwargs)
+
+        _run_in_progress = True
+        run = ProfiledRun(kwargs.get("user_id", coroutine_function.__name__))
+        run_token = _current_run.set(run)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        snapshot_before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            return await coroutine_function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            snapshot_after = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            _current_run.reset(run_token)
+            _run_in_progress = False
+            try:
+                # Сравнение снимков памяти и запись файлов - в отдельном потоке, чтобы не блокировать цикл событий
+                await asyncio.to_thread(run.save, profiler, snapshot_before, snapshot_after, peak_bytes, elapsed)
+                _saved_runs += 1
+                logger.info(f"Профиль запуска сохранён: {run.path_prefix}.prof ({elapsed:.2f} с).")
+            except OSError as e:
+                logger.error(f"Не удалось сохранить профиль в {PROFILING_DIR}: {e}")
+    return wrapper
+
+
+def profile_call(function, *args):
+    """
+    Выполняет function(*args) под cProfile - для процессов пула рендеринга PDF.
+    Возвращает результат и статистику в формате файла .prof.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args)
+    profiler.create_stats()
+    return result, marshal.dumps(profiler.stats)
+
+
+def _describe_callback(handle):
+    """Корутина, которую выполнял обработчик цикла событий, с текущей строкой; иначе repr обработчика."""
+    task = getattr(handle._callback, "__self__", None)
+    if not isinstance(task, asyncio.Task):
+        return repr(handle)
+    # Самая вложенная корутина задачи - обработчик, который только что выполнялся
+    coroutine, innermost = task.get_coro(), None
+    while coroutine is not None and getattr(coroutine, "cr_frame", None) is not None:
+        innermost = coroutine
+        coroutine = coroutine.cr_await
+    if innermost is None:
+        return f"задача {task.get_name()}"
+    frame = innermost.cr_frame
+    return (f"задача {task.get_name()}, {innermost.__qualname__} "
+            f"({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+
+
+def _timed_handle_run(handle):
+    started = time.perf_counter()
+    try:
+        _original_handle_run(handle)
+    finally:
+        duration = time.perf_counter() - started
+        if _slow_callback_threshold and duration > _slow_callback_threshold:
+            LOOP_SLOW_CALLBACKS.inc()
+            logger.warning(f"Цикл событий заблокирован на {duration * 1000:.0f} мс: {_describe_callback(handle)}")
+
+
+def set_slow_callback_threshold(seconds):
+    """
+    Включает (seconds > 0) или выключает детектор медленных обработчиков.
+
+    Замер подменяет asyncio.Handle._run - внутренний метод CPython, через который цикл событий
+    вызывает все обратные вызовы. Подмена действует на весь процесс, пока детектор включён,
+    и снимается при выключении. Циклы с собственными Handle (например, uvloop) этот метод
+    не вызывают - там детектор ничего не замеряет.
+    """
+    global _slow_callback_threshold, _original_handle_run
+    _slow_callback_threshold = max(seconds, 0.0)
+    if _slow_callback_threshold and _original_handle_run is None:
+        _original_handle_run = asyncio.Handle._run
+        asyncio.Handle._run = _timed_handle_run
+        logger.info(f"Детектор медленных обработчиков включен: порог {_slow_callback_threshold * 1000:.0f} мс.")
+    elif not _slow_callback_threshold and _original_handle_run is not None:
+        asyncio.Handle._run = _original_handle_run
+        _original_handle_run = None
+        logger.info("Детектор медленных обработчиков выключен.")
+
+
+def init_profiling():
+    """Включает детектор медленных обработчиков, если он задан в config."""
+    if SLOW_CALLBACK_THRESHOLD > 0:
+        set_slow_callback_threshold(SLOW_CALLBACK_THRESHOLD)
+    if _sample_rate > 0:
+        logger.info(f"Профилирование генерации включено: доля запусков {_sample_rate}, файлы в {PROFILING_DIR}.")
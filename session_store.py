@@ -0,0 +1,180 @@
+"""
+Компактное хранилище ответов диалога /create.
+
+Ответы пользователя (раса, класс, предыстория, мировоззрение, локация, пожелания
+по характеристикам, детали) хранятся в записи со слотами, а варианты с клавиатуры -
+общими экземплярами строк, так что одинаковые выборы разных пользователей не
+занимают память повторно. Число сессий ограничено: при переполнении вытесняется
+давно не использованная, а простаивающие дольше idle_timeout удаляются.
+
+Пределы - по числу сессий и по оценке занятой ими памяти (approximate_bytes: записи,
+узлы словаря и собственные строки ответов, без накладных расходов аллокатора).
+Функция on_evict(user_id), если задана, вызывается для каждой вытесненной сессии.
+"""
+import logging
+import sys
+import time
+from collections import OrderedDict
+
+from config import SESSION_MAX_COUNT, SESSION_MAX_BYTES, SESSION_IDLE_TIMEOUT, SESSION_TEXT_MAX_LENGTH
+from metrics import SESSIONS_EVICTED, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Ключи ответов в порядке шагов диалога
+SESSION_FIELDS = ("race", "class", "background", "alignment", "location", "stats_preference", "details")
+ENTRY_OVERHEAD_BYTES = 160  # узел OrderedDict, ключ user_id и время обращения
+
+
+class CharacterSession:
+    """Ответы одного пользователя; слот class назван char_class (class - ключевое слово)."""
+    __slots__ = ("race", "char_class", "background", "alignment", "location", "stats_preference", "details",
+                 "touched_at", "size")
+
+    _SLOT_NAMES = {"class": "char_class"}
+
+    def __init__(self):
+        self.race = self.char_class = self.background = self.alignment = None
+        self.location = self.stats_preference = self.details = None
+        self.touched_at = time.monotonic()
+        self.size = 0
+
+    def get(self, field):
+        return getattr(self, self._SLOT_NAMES.get(field, field))
+
+    def set_field(self, field, value):
+        setattr(self, self._SLOT_NAMES.get(field, field), value)
+
+    def as_list(self):
+        return [self.get(field) for field in SESSION_FIELDS]
+
+
+SESSION_BASE_BYTES = sys.getsizeof(CharacterSession()) + ENTRY_OVERHEAD_BYTES
+
+
+class SessionStore:
+    def __init__(self, max_sessions, idle_timeout, max_text_length, max_bytes=None):
+        self._max_sessions = max_sessions
+        self._max_bytes = max_bytes
+        self._idle_timeout = idle_timeout
+        self._max_text_length = max_text_length
+        self._sessions = OrderedDict()  # user_id -> CharacterSession, давно не использованные - в начале
+        self._choices = {}  # вариант клавиатуры -> общий экземпляр строки
+        self._total_bytes = 0
+        self.on_evict = None
+
+    def register_choices(self, options):
+        for option in options:
+            option = sys.intern(option)
+            self._choices[option] = option
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @property
+    def approximate_bytes(self):
+        """Оценка памяти сессий: записи, узлы словаря и собственные (не общие) строки ответов."""
+        return self._total_bytes
+
+    def _value_size(self, value):
+        if value is None or self._choices.get(value) is value:
+            return 0
+        return sys.getsizeof(value)
+
+    def _normalize(self, value):
+        if value is None:
+            return None
+        choice = self._choices.get(value)
+        if choice is not None:
+            return choice
+        return value[:self._max_text_length]
+
+    def _remove(self, user_id, reason=None):
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self._total_bytes -= session.size
+            if reason:
+                SESSIONS_EVICTED.inc(reason=reason)
+                if self.on_evict is not None:
+                    self.on_evict(user_id)
+        return session
+
+    def _over_limit(self):
+        if len(self._sessions) > self._max_sessions:
+            return True
+        # Последнюю (текущую) сессию по памяти не вытесняем: её размер ограничен длиной ответов
+        return self._max_bytes is not None and self._total_bytes > self._max_bytes and len(self._sessions) > 1
+
+    def _evict(self, now):
+        # Сессии упорядочены по последнему обращению, поэтому достаточно проверять самую старую;
+        # вызывается при создании сессии и росте ответов - только тогда растут число и размер сессий
+        while self._sessions:
+            user_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.touched_at > self._idle_timeout:
+                self._remove(user_id, "idle")
+            elif self._over_limit():
+                self._remove(user_id, "lru")
+                logger.debug(f"Хранилище сессий заполнено ({len(self._sessions)} сессий, {self._total_bytes} Б), "
+                             f"вытеснена сессия пользователя {user_id}.")
+            else:
+                break
+
+    def _touch(self, user_id, session, now):
+        session.touched_at = now
+        self._sessions.move_to_end(user_id)
+
+    def start(self, user_id):
+        """Начинает новую пустую сессию пользователя вместо прежней."""
+        self._remove(user_id)
+        session = self._sessions[user_id] = CharacterSession()
+        session.size = SESSION_BASE_BYTES
+        self._total_bytes += session.size
+        self._evict(session.touched_at)
+        return session
+
+    def get(self, user_id):
+        """Сессия пользователя или None, если её нет, она вытеснена или простаивала дольше idle_timeout."""
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.touched_at > self._idle_timeout:
+            self._remove(user_id, "idle")
+            return None
+        self._touch(user_id, session, now)
+        return session
+
+    def set_answer(self, user_id, field, value):
+        """Записывает ответ; если сессии нет (вытеснена или потеряна), начинает новую."""
+        session = self.get(user_id) or self.start(user_id)
+        value = self._normalize(value)
+        size_change = self._value_size(value) - self._value_size(session.get(field))
+        session.set_field(field, value)
+        session.size += size_change
+        self._total_bytes += size_change
+        if size_change > 0 and self._max_bytes is not None and self._total_bytes > self._max_bytes:
+            self._evict(session.touched_at)
+        return session
+
+    def restore(self, user_id, values):
+        """Восстанавливает сессию из списка ответов (см. CharacterSession.as_list)."""
+        session = self.start(user_id)
+        for field, value in zip(SESSION_FIELDS, values):
+            self.set_answer(user_id, field, value)
+        return session
+
+    def end(self, user_id):
+        self._remove(user_id)
+
+
+_store = None
+
+Gauge("dndbot_sessions", "Незавершённые сессии диалога /create в памяти.", lambda: len(_store) if _store else 0)
+Gauge("dndbot_sessions_bytes", "Оценка памяти, занятой сессиями диалога /create, в байтах.",
+      lambda: _store.approximate_bytes if _store else 0)
+
+def get_session_store():
+    global _store
+    if _store is None:
+        _store = SessionStore(SESSION_MAX_COUNT, SESSION_IDLE_TIMEOUT, SESSION_TEXT_MAX_LENGTH, SESSION_MAX_BYTES)
+    return _store
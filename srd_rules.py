@@ -0,0 +1,185 @@
+"""
+Локальный расчёт характеристик и производных параметров персонажа по правилам SRD 5.1.
+
+Шесть характеристик распределяются стандартным набором или покупкой очков в порядке
+важности для класса (пожелания пользователя поднимают упомянутые характеристики выше),
+затем добавляются расовые бонусы. По итоговым значениям считаются модификаторы, бонус
+мастерства, хиты и класс доспеха со стартовым снаряжением класса.
+
+Результат зависит только от расы, класса, пожеланий и уровня, поэтому листы кэшируются:
+build_character_sheets для группы или пула персонажей считает каждое сочетание один раз.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+ABILITIES = ("Сила", "Ловкость", "Телосложение", "Интеллект", "Мудрость", "Харизма")
+STR, DEX, CON, INT, WIS, CHA = range(6)
+
+STANDARD_ARRAY = (15, 14, 13, 12, 10, 8)
+POINT_BUY_SPREAD = (15, 15, 13, 10, 10, 8)  # 9 + 9 + 5 + 2 + 2 + 0 = 27 очков покупки
+MAX_ABILITY_SCORE = 20
+
+# Расовые бонусы: индекс характеристики -> прибавка.
+# Полуэльф дополнительно получает +1 к двум характеристикам на выбор (HALF_ELF_FREE_BONUSES).
+RACE_BONUSES = {
+    "Человек": {STR: 1, DEX: 1, CON: 1, INT: 1, WIS: 1, CHA: 1},
+    "Эльф (Высший)": {DEX: 2, INT: 1},
+    "Дварф (Холмовой)": {CON: 2, WIS: 1},
+    "Полурослик (Легконогий)": {DEX: 2, CHA: 1},
+    "Драконорожденный": {STR: 2, CHA: 1},
+    "Гном (Лесной)": {INT: 2, DEX: 1},
+    "Полуэльф": {CHA: 2},
+    "Полуорк": {STR: 2, CON: 1},
+    "Тифлинг": {INT: 1, CHA: 2},
+}
+HALF_ELF_FREE_BONUSES = 2
+HILL_DWARF_HP_PER_LEVEL = 1  # Дварфийская выдержка
+
+# Основы названий для сопоставления свободного текста (ответ модели, ввод пользователя)
+# с расами таблицы; более длинные основы проверяются раньше ("полуэльф" до "эльф").
+RACE_STEMS = (
+    ("полуэльф", "Полуэльф"), ("полуорк", "Полуорк"), ("полурослик", "Полурослик (Легконогий)"),
+    ("драконорожд", "Драконорожденный"), ("тифлинг", "Тифлинг"), ("гном", "Гном (Лесной)"),
+    ("дварф", "Дварф (Холмовой)"), ("дворф", "Дварф (Холмовой)"), ("эльф", "Эльф (Высший)"),
+    ("человек", "Человек"),
+)
+
+# hit_die - кость хитов; priority - порядок характеристик по важности для класса;
+# armor - стартовый доспех: название, базовый КД, предел бонуса Ловкости (None - без предела),
+# щит (+2) и характеристика, добавляемая к КД без доспехов (Защита без доспехов)
+ClassRules = namedtuple("ClassRules", "hit_die priority armor_name armor_base dex_cap shield unarmored_ability")
+
+CLASS_RULES = {
+    "Варвар": ClassRules(12, (STR, CON, DEX, WIS, CHA, INT), "без доспехов", 10, None, False, CON),
+    "Бард": ClassRules(8, (CHA, DEX, CON, WIS, INT, STR), "кожаный доспех", 11, None, False, None),
+    "Жрец": ClassRules(8, (WIS, CON, STR, CHA, DEX, INT), "чешуйчатый доспех", 14, 2, True, None),
+    "Друид": ClassRules(8, (WIS, CON, DEX, INT, CHA, STR), "кожаный доспех", 11, None, True, None),
+    "Воин": ClassRules(10, (STR, CON, DEX, WIS, CHA, INT), "кольчуга", 16, 0, True, None),
+    "Монах": ClassRules(8, (DEX, WIS, CON, STR, INT, CHA), "без доспехов", 10, None, False, WIS),
+    "Паладин": ClassRules(10, (STR, CHA, CON, WIS, DEX, INT), "кольчуга", 16, 0, True, None),
+    "Следопыт": ClassRules(10, (DEX, WIS, CON, STR, INT, CHA), "чешуйчатый доспех", 14, 2, False, None),
+    "Плут": ClassRules(8, (DEX, CON, INT, CHA, WIS, STR), "кожаный доспех", 11, None, False, None),
+    "Чародей": ClassRules(6, (CHA, CON, DEX, WIS, INT, STR), "без доспехов", 10, None, False, None),
+    "Колдун (Исчадие)": ClassRules(8, (CHA, CON, DEX, WIS, INT, STR), "кожаный доспех", 11, None, False, None),
+    "Волшебник": ClassRules(6, (INT, CON, DEX, WIS, CHA, STR), "без доспехов", 10, None, False, None),
+}
+DEFAULT_CLASS_RULES = ClassRules(8, (CON, DEX, STR, WIS, INT, CHA), "без доспехов", 10, None, False, None)
+CLASS_STEMS = (
+    ("варвар", "Варвар"), ("бард", "Бард"), ("жрец", "Жрец"), ("друид", "Друид"), ("воин", "Воин"),
+    ("монах", "Монах"), ("паладин", "Паладин"), ("следопыт", "Следопыт"), ("плут", "Плут"),
+    ("чародей", "Чародей"), ("колдун", "Колдун (Исчадие)"), ("волшебник", "Волшебник"),
+)
+
+# Основы слов в пожеланиях пользователя, поднимающие характеристику в порядке важности
+ABILITY_STEMS = (
+    ("сил", STR), ("ловк", DEX), ("проворн", DEX), ("телосл", CON), ("вынослив", CON),
+    ("интеллект", INT), ("умн", INT), ("мудр", WIS), ("харизм", CHA), ("обаян", CHA),
+)
+POINT_BUY_STEMS = ("покупк", "очк", "point")
+_EXPLICIT_SCORE_RE = re.compile(r"(" + "|".join(ABILITIES) + r")\s*[:=]?\s*(\d{1,2})", re.IGNORECASE)
+
+CharacterSheet = namedtuple(
+    "CharacterSheet",
+    "race class_name method scores modifiers proficiency_bonus hit_points armor_class armor text"
+)
+
+
+def ability_modifier(score):
+    return (score - 10) // 2
+
+def proficiency_bonus(level):
+    return 2 + (level - 1) // 4
+
+def _match_stem(text, stems):
+    text = (text or "").lower().replace("ё", "е")
+    return next((name for stem, name in stems if stem in text), None)
+
+def normalize_race(race):
+    """Раса таблицы RACE_BONUSES для свободного текста или None."""
+    return race if race in RACE_BONUSES else _match_stem(race, RACE_STEMS)
+
+def normalize_class(class_name):
+    """Класс таблицы CLASS_RULES для свободного текста или None."""
+    return class_name if class_name in CLASS_RULES else _match_stem(class_name, CLASS_STEMS)
+
+def _explicit_scores(preference):
+    """Значения всех шести характеристик, если пользователь указал их явно."""
+    found = {}
+    for match in _EXPLICIT_SCORE_RE.finditer(preference):
+        found[ABILITIES.index(match.group(1).capitalize())] = int(match.group(2))
+    if len(found) < len(ABILITIES) or not all(3 <= score <= 18 for score in found.values()):
+        return None
+    return tuple(found[ability] for ability in range(len(ABILITIES)))
+
+def _priority_for(preference, class_priority):
+    """Порядок характеристик класса; упомянутые в пожеланиях - в начале, в порядке упоминания."""
+    first_mention = {}
+    for stem, ability in ABILITY_STEMS:
+        position = preference.find(stem)
+        if position >= 0:
+            first_mention[ability] = min(position, first_mention.get(ability, position))
+    emphasized = sorted(first_mention, key=first_mention.get)
+    return tuple(emphasized + [ability for ability in class_priority if ability not in emphasized])
+
+def _base_scores(preference, priority):
+    """Характеристики до расовых бонусов и название способа распределения."""
+    explicit = _explicit_scores(preference)
+    if explicit is not None:
+        return list(explicit), "указаны пользователем"
+    point_buy = any(stem in preference for stem in POINT_BUY_STEMS)
+    spread, method = (POINT_BUY_SPREAD, "покупка очков") if point_buy else (STANDARD_ARRAY, "стандартный набор")
+    scores = [0] * len(ABILITIES)
+    for ability, score in zip(priority, spread):
+        scores[ability] = score
+    return scores, method
+
+def _armor_class(rules, modifiers):
+    dex_bonus = modifiers[DEX] if rules.dex_cap is None else min(modifiers[DEX], rules.dex_cap)
+    armor_class = rules.armor_base + dex_bonus + (2 if rules.shield else 0)
+    if rules.unarmored_ability is not None:
+        armor_class += modifiers[rules.unarmored_ability]
+    armor = rules.armor_name + (" и щит" if rules.shield else "")
+    return armor_class, armor
+
+def _format_sheet(scores, modifiers, bonus, hit_points, armor_class, armor):
+    abilities = ", ".join(f"{name} {score} ({modifier:+d})" for name, score, modifier in zip(ABILITIES, scores, modifiers))
+    return f"{abilities}. Бонус мастерства {bonus:+d}, Хиты {hit_points}, Класс доспеха {armor_class} ({armor})"
+
+@lru_cache(maxsize=4096)
+def _build_sheet(race, class_name, preference, level):
+    rules = CLASS_RULES.get(class_name, DEFAULT_CLASS_RULES)
+    priority = _priority_for(preference, rules.priority)
+    scores, method = _base_scores(preference, priority)
+
+    for ability, bonus in RACE_BONUSES.get(race, {}).items():
+        scores[ability] += bonus
+    if race == "Полуэльф":
+        free_abilities = [ability for ability in priority if ability != CHA][:HALF_ELF_FREE_BONUSES]
+        for ability in free_abilities:
+            scores[ability] += 1
+    scores = tuple(min(score, MAX_ABILITY_SCORE) for score in scores)
+    modifiers = tuple(ability_modifier(score) for score in scores)
+
+    # Первый уровень - максимум кости хитов, дальше - среднее значение кости
+    hit_points_per_level = modifiers[CON] + (HILL_DWARF_HP_PER_LEVEL if race == "Дварф (Холмовой)" else 0)
+    hit_points = rules.hit_die + (level - 1) * (rules.hit_die // 2 + 1) + level * hit_points_per_level
+    hit_points = max(hit_points, level)
+    armor_class, armor = _armor_class(rules, modifiers)
+    bonus = proficiency_bonus(level)
+    return CharacterSheet(race, class_name, method, scores, modifiers, bonus, hit_points, armor_class, armor,
+                          _format_sheet(scores, modifiers, bonus, hit_points, armor_class, armor))
+
+def build_character_sheet(race, class_name, stats_preference=None, level=1):
+    """
+    Лист характеристик персонажа. race и class_name - названия из SRD или свободный текст
+    (неизвестная раса - без расовых бонусов, неизвестный класс - кость хитов d8 и КД без доспехов).
+    stats_preference - пожелания пользователя: явные значения шести характеристик,
+    способ распределения ("покупка очков") или характеристики, которые важнее других.
+    """
+    preference = (stats_preference or "").lower().replace("ё", "е")
+    return _build_sheet(normalize_race(race), normalize_class(class_name), preference, level)
+
+def build_character_sheets(characters, stats_preference=None, level=1):
+    """Листы для нескольких персонажей: characters - пары (раса, класс)."""
+    return [build_character_sheet(race, class_name, stats_preference, level) for race, class_name in characters]
@@ -0,0 +1,114 @@
+"""
+Быстрый запуск бота: замер времени импортов, фоновый прогрев и флаг готовности.
+
+Бот начинает принимать обновления сразу, а тяжёлая подготовка (клиенты Gemini, шрифт
+и процессы рендеринга PDF) выполняется шагами прогрева в фоне. Обработчики, которым
+нужна генерация, проверяют is_ready() и при необходимости ждут wait_until_ready().
+Модуль импортируется первым, поэтому время запуска считается от его импорта.
+"""
+import asyncio
+import inspect
+import time
+from contextlib import contextmanager
+
+PROCESS_STARTED = time.perf_counter()
+
+from logger_setup import logger
+
+_import_timings = []  # (название, секунды)
+_ready_event = None
+_warm_up_error = None
+
+
+@contextmanager
+def timed_import(name):
+    """Замеряет время импорта блока модулей для отчёта log_import_timings."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _import_timings.append((name, time.perf_counter() - started))
+
+
+def log_import_timings():
+    breakdown = ", ".join(f"{name} {seconds:.2f} с" for name, seconds in
+                          sorted(_import_timings, key=lambda timing: timing[1], reverse=True))
+    total = sum(seconds for _, seconds in _import_timings)
+    logger.info(f"Импорт модулей: {total:.2f} с ({breakdown}).")
+
+
+def seconds_since_start():
+    return time.perf_counter() - PROCESS_STARTED
+
+
+def _get_ready_event():
+    global _ready_event
+    if _ready_event is None:
+        _ready_event = asyncio.Event()
+    return _ready_event
+
+
+def is_ready():
+    """Завершён ли прогрев: модели Gemini и шрифт PDF готовы к генерации."""
+    return _ready_event is not None and _ready_event.is_set() and _warm_up_error is None
+
+
+def warm_up_error():
+    return _warm_up_error
+
+
+async def wait_until_ready(timeout):
+    """Ждёт окончания прогрева не дольше timeout секунд. Возвращает is_ready()."""
+    try:
+        await asyncio.wait_for(_get_ready_event().wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return is_ready()
+
+
+async def _run_step(name, step):
+    if inspect.iscoroutinefunction(step):
+        result = await step()
+    else:
+        result = await asyncio.to_thread(step)
+    if result is False:
+        raise RuntimeError(f"шаг '{name}' завершился неудачно")
+
+
+async def run_warm_up(steps, retries=0, retry_delay=1.0):
+    """
+    Выполняет шаги прогрева по порядку и отмечает готовность. steps - пары (название, функция);
+    синхронная функция выполняется в отдельном потоке, чтобы не блокировать приём обновлений.
+    Функция, вернувшая False или выбросившая исключение, повторяется до retries раз с удвоением
+    паузы от retry_delay секунд; если все попытки неудачны, прогрев завершается с ошибкой.
+    Возвращает is_ready().
+    """
+    global _warm_up_error
+    ready_event = _get_ready_event()
+    try:
+        for name, step in steps:
+            started = time.perf_counter()
+            for attempt in range(retries + 1):
+                try:
+                    await _run_step(name, step)
+                    break
+                except Exception as e:
+                    if attempt == retries:
+                        raise
+                    delay = retry_delay * 2 ** attempt
+                    logger.warning(f"Прогрев: {name} - ошибка ({e}), повтор {attempt + 1}/{retries} через {delay:.1f} с.")
+                    await asyncio.sleep(delay)
+            logger.info(f"Прогрев: {name} - {time.perf_counter() - started:.2f} с.")
+    except Exception as e:
+        _warm_up_error = str(e)
+        logger.error(f"Прогрев бота не удался: {e}. Генерация персонажей недоступна.")
+    else:
+        logger.info(f"Бот готов к генерации через {seconds_since_start():.2f} с после запуска.")
+    finally:
+        ready_event.set()
+    return is_ready()
+
+
+def mark_ready():
+    """Отмечает готовность без фонового прогрева (всё подготовлено до запуска бота)."""
+    _get_ready_event().set()
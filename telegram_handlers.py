@@ -1,7 +1,8 @@
 import logging
 import os
+import re
 import time
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import (
     CommandHandler,
     MessageHandler,
@@ -10,7 +11,20 @@ from telegram.ext import (
     ConversationHandler,
 )
 
-from character_generator import generate_dnd_character_profile_for_bot
+from character_generator import generate_dnd_character_profile_for_bot, generate_dnd_party_for_bot, LLM_ERROR_PREFIXES
+from gemini_utils import split_profile_message
+from config import (
+    PARTY_DEFAULT_SIZE, PARTY_MAX_SIZE, GENERATION_STREAMING, STREAM_EDIT_INTERVAL, BOT_WARM_UP_WAIT,
+    SESSION_TEXT_MAX_LENGTH, ADMIN_USER_IDS,
+)
+from character_pool import take_pooled_character
+from metrics import STAGE_SECONDS, GENERATION_OUTCOMES
+from startup import is_ready, wait_until_ready, warm_up_error
+from session_store import get_session_store, CharacterSession, SESSION_FIELDS
+from profiling import (
+    set_sample_rate, profile_next_run, set_slow_callback_threshold, disable_profiling, profiling_status,
+)
+from srd_rules import ABILITY_STEMS, POINT_BUY_STEMS
 
 logger = logging.getLogger(__name__)
 
@@ -32,27 +46,219 @@ srd_alignments_options = [
     "Законно-Злой", "Нейтрально-Злой", "Хаотично-Злой", "Авто (подходящее)"
 ]
 
+# Названия ответов для показа пользователю
+ANSWER_DISPLAY_NAMES = {
+    'race': 'Раса',
+    'class': 'Класс',
+    'background': 'Предыстория (Background)',
+    'alignment': 'Мировоззрение',
+    'location': 'Локация/Происхождение',
+    'stats_preference': 'Пожелания по характеристикам',
+    'details': 'Дополнительные детали'
+}
+
+# Варианты клавиатур хранятся в сессиях общими экземплярами строк
+get_session_store().register_choices(srd_races_options + srd_classes_options + srd_backgrounds_options + srd_alignments_options)
+
+# Ответы диалога хранятся в session_store; при включённом persistence их копия лежит
+# в user_data под этим ключом, чтобы незавершённый диалог пережил перезапуск. Копия живёт
+# не дольше сессии: user_data удаляется при завершении диалога и при вытеснении сессии
+SESSION_USER_DATA_KEY = "session"
+
+def _persistent_sessions(context):
+    if context.application.persistence is None:
+        return False
+    store = get_session_store()
+    if store.on_evict is None:
+        store.on_evict = context.application.drop_user_data
+    return True
+
+def _load_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сессия пользователя; после перезапуска или вытеснения - из копии в user_data, если она есть."""
+    store, user_id = get_session_store(), update.effective_user.id
+    session = store.get(user_id)
+    if session is None and _persistent_sessions(context) and SESSION_USER_DATA_KEY in context.user_data:
+        session = store.restore(user_id, context.user_data[SESSION_USER_DATA_KEY])
+    return session
+
+def _save_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, key, value):
+    _load_session(update, context)
+    session = get_session_store().set_answer(update.effective_user.id, key, value)
+    if _persistent_sessions(context):
+        context.user_data[SESSION_USER_DATA_KEY] = session.as_list()
+
+def _end_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    get_session_store().end(update.effective_user.id)
+    if _persistent_sessions(context):
+        context.application.drop_user_data(update.effective_user.id)
+
+# Разбор /quick: сначала идут варианты клавиатур, с первого не распознанного слова - свободный текст,
+# который делится на части запятыми
+QUICK_PART_SEPARATORS_RE = re.compile(r"[,;\n]+")
+QUICK_WORD_RE = re.compile(r"\w+")
+QUICK_AUTO_WORDS = {"авто", "случайный", "случайная", "случайно", "пропустить"}
+# Падежные окончания, с которыми слово варианта ещё узнаётся ("мудрецом", "эльфа", "воины")
+QUICK_WORD_ENDINGS = ("", "а", "у", "ом", "е", "ы", "и", "ов", "ем", "ой")
+# Написания, которые не выводятся из названий вариантов
+QUICK_WORD_ALIASES = (
+    ("дворф", "race", "Дварф (Холмовой)"), ("эльфийка", "race", "Эльф (Высший)"),
+    ("дварфийка", "race", "Дварф (Холмовой)"), ("полуэльфийка", "race", "Полуэльф"),
+    ("полурослица", "race", "Полурослик (Легконогий)"), ("воительница", "class", "Воин"),
+    ("жрица", "class", "Жрец"), ("волшебница", "class", "Волшебник"), ("чародейка", "class", "Чародей"),
+    ("колдунья", "class", "Колдун (Исчадие)"), ("монахиня", "class", "Монах"), ("плутовка", "class", "Плут"),
+)
+# Слова мировоззрения: ось порядка, ось морали и "нейтральный" для Истинно Нейтрального
+ALIGNMENT_WORDS = {
+    **dict.fromkeys(("законно", "законный", "законная", "законопослушный", "законопослушная"), ("law", "Законно")),
+    **dict.fromkeys(("хаотично", "хаотичный", "хаотичная", "хаотический", "хаотическая"), ("law", "Хаотично")),
+    **dict.fromkeys(("добрый", "добрая", "добро"), ("moral", "Добрый")),
+    **dict.fromkeys(("злой", "злая", "зло"), ("moral", "Злой")),
+    **dict.fromkeys(("нейтрально", "нейтральный", "нейтральная", "истинно"), ("neutral", True)),
+}
+
+def _word_forms(word):
+    base = word[:-1] if word[-1] in "йья" else word
+    return {word} | {base + ending for ending in QUICK_WORD_ENDINGS}
+
+def _build_option_words():
+    """Словоформа -> (поле, вариант) для рас, классов и предысторий; уточнения в скобках не учитываются."""
+    option_words = {}
+    for field, options in (('race', srd_races_options), ('class', srd_classes_options),
+                           ('background', srd_backgrounds_options)):
+        for option in options[:-1]: # без варианта "Авто"
+            for word in option.split("(")[0].lower().split():
+                for form in _word_forms(word):
+                    option_words.setdefault(form, (field, option))
+    for alias, field, option in QUICK_WORD_ALIASES:
+        option_words[alias] = (field, option)
+    return option_words
+
+QUICK_OPTION_WORDS = _build_option_words()
+
+def _mentions_abilities(text):
+    text = text.lower()
+    return any(stem in text for stem, _ in ABILITY_STEMS) or any(stem in text for stem in POINT_BUY_STEMS)
+
+def _alignment_option(law, moral, neutral):
+    """Вариант мировоззрения из осей порядка и морали; недостающая ось - нейтральная."""
+    if law is None and moral is None:
+        return "Истинно Нейтральный" if neutral else None
+    return f"{law or 'Нейтрально'}-{moral or 'Нейтральный'}"
+
+def resolve_quick_request(text):
+    """
+    Ответы диалога /create из одного сообщения: "эльф волшебник мудрец, упор на интеллект, ищет брата".
+    Слова в начале сообщения, совпавшие с вариантом расы, класса, предыстории или мировоззрения
+    (целиком или в падежной форме), становятся выбором. С первого другого слова начинается
+    свободный текст: его части с упоминанием характеристик - пожелания по ним, остальные -
+    дополнительные детали. Не найденное остаётся "Авто" (None).
+    """
+    answers = dict.fromkeys(SESSION_FIELDS)
+    alignment = {"law": None, "moral": None, "neutral": False}
+    free_text = ""
+    for match in QUICK_WORD_RE.finditer(text):
+        key = match.group().lower().replace("ё", "е")
+        option = QUICK_OPTION_WORDS.get(key)
+        axis = ALIGNMENT_WORDS.get(key)
+        if option is not None and answers[option[0]] in (None, option[1]):
+            answers[option[0]] = option[1]
+        elif axis is not None and alignment[axis[0]] in (None, False, axis[1]):
+            alignment[axis[0]] = axis[1]
+        elif key not in QUICK_AUTO_WORDS:
+            free_text = text[match.start():]
+            break
+    answers['alignment'] = _alignment_option(alignment["law"], alignment["moral"], alignment["neutral"])
+
+    stats_parts, details_parts = [], []
+    for part in QUICK_PART_SEPARATORS_RE.split(free_text):
+        part = part.strip()
+        if part:
+            (stats_parts if _mentions_abilities(part) else details_parts).append(part)
+    answers['stats_preference'] = ", ".join(stats_parts)[:SESSION_TEXT_MAX_LENGTH] or None
+    answers['details'] = ", ".join(details_parts)[:SESSION_TEXT_MAX_LENGTH] or None
+    return answers
+
+def _answers_summary(answers, separator="\n"):
+    return separator.join(f"{ANSWER_DISPLAY_NAMES[key]}: {answers[key] or 'Авто'}"
+                          for key in SESSION_FIELDS if key != 'location')
+
 def create_reply_keyboard(options_list, items_per_row=2):
     return [options_list[i:i + items_per_row] for i in range(0, len(options_list), items_per_row)]
 
+async def _ensure_generation_ready(message) -> bool:
+    """Перед генерацией ждёт окончания фоновой подготовки бота после запуска."""
+    if is_ready():
+        return True
+    if warm_up_error() is None:
+        await message.reply_text("Бот только что перезапустился и ещё готовится, генерация начнётся через несколько секунд...")
+        if await wait_until_ready(BOT_WARM_UP_WAIT):
+            return True
+    await message.reply_text("Генерация сейчас недоступна: бот не смог подготовиться к работе. Попробуйте позже.")
+    return False
+
+def _generation_outcome(text_profile):
+    """Итог генерации для метрики GENERATION_OUTCOMES."""
+    if not text_profile:
+        return "error"
+    if text_profile.startswith("Ошибка квоты"):
+        return "quota"
+    if "ЗАБЛОКИРОВАН" in text_profile[:30]:
+        return "blocked"
+    if text_profile.startswith(LLM_ERROR_PREFIXES) or text_profile.startswith("ОШИБКА"):
+        return "error"
+    return "ok"
+
+class ProgressiveMessage:
+    """
+    Одно сообщение, которое создаётся при первом показе и затем редактируется
+    не чаще min_interval секунд (ограничение Telegram на частоту правок).
+    """
+
+    def __init__(self, reply_to_message, min_interval):
+        self._reply_to_message = reply_to_message
+        self._min_interval = min_interval
+        self.message = None
+        self._shown_text = None
+        self._last_edit_at = 0.0
+
+    async def show(self, text, force=False):
+        text = text[:4096]
+        if text == self._shown_text:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_edit_at < self._min_interval:
+            return
+        self._last_edit_at = now
+        try:
+            if self.message is None:
+                self.message = await self._reply_to_message.reply_text(text)
+            else:
+                await self.message.edit_text(text)
+            self._shown_text = text
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение с прогрессом генерации: {e}")
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
     await update.message.reply_html(
         rf"Привет, {user.mention_html()}! Я D&D Генератор Персонажей v0.5 (PDF в памяти!). "
-        "Давай создадим персонажа. Используй /create для начала или /cancel для отмены.",
+        "Давай создадим персонажа. Используй /create для начала или /cancel для отмены. "
+        "Без вопросов, одним сообщением: /quick эльф волшебник мудрец. "
+        f"Для целой группы персонажей используй /party N (от 2 до {PARTY_MAX_SIZE}).",
     )
-    context.user_data.clear()
+    _end_session(update, context)
     return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
     logger.info(f"Пользователь {user.first_name} ({user.id}) отменил диалог.")
     await update.message.reply_text("Создание персонажа отменено. Начать заново: /create.", reply_markup=ReplyKeyboardRemove())
-    context.user_data.clear()
+    _end_session(update, context)
     return ConversationHandler.END
 
 async def create_character_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data.clear()
+    _end_session(update, context)
+    get_session_store().start(update.effective_user.id)
     reply_keyboard = create_reply_keyboard(srd_races_options)
     await update.message.reply_text(
         "Начинаем создание персонажа! 🧙‍♂️\nВыбери расу или 'Авто'.",
@@ -73,22 +279,12 @@ async def _handle_choice_and_proceed(update: Update, context: ContextTypes.DEFAU
     is_auto = any(auto_keyword in user_choice.lower() for auto_keyword in ["авто", "случайная", "подходящее", "пропустить", "skip"])
 
     if is_auto or not user_choice: # Пустой ввод также считаем за "авто"
-        context.user_data[current_data_key] = None
+        _save_answer(update, context, current_data_key, None)
     else:
-        context.user_data[current_data_key] = user_choice
+        _save_answer(update, context, current_data_key, user_choice)
         chosen_value_display = user_choice
 
-    # Формируем имя ключа для отображения пользователю
-    key_display_name_map = {
-        'race': 'Раса',
-        'class': 'Класс',
-        'background': 'Предыстория (Background)',
-        'alignment': 'Мировоззрение',
-        'location': 'Локация/Происхождение',
-        'stats_preference': 'Пожелания по характеристикам',
-        'details': 'Дополнительные детали'
-    }
-    display_key = key_display_name_map.get(current_data_key, current_data_key.replace('_', ' ').capitalize())
+    display_key = ANSWER_DISPLAY_NAMES.get(current_data_key, current_data_key.replace('_', ' ').capitalize())
 
     await update.message.reply_text(f"{display_key}: {chosen_value_display}.")
 
@@ -135,9 +331,9 @@ async def get_details_and_generate(update: Update, context: ContextTypes.DEFAULT
 
     details_display = 'На усмотрение модели'
     if is_auto or not user_details_input:
-        context.user_data['details'] = None
+        _save_answer(update, context, 'details', None)
     else:
-        context.user_data['details'] = user_details_input
+        _save_answer(update, context, 'details', user_details_input)
         details_display = user_details_input
 
     await update.message.reply_text(
@@ -145,35 +341,73 @@ async def get_details_and_generate(update: Update, context: ContextTypes.DEFAULT
         "Спасибо! Начинаю генерацию персонажа и PDF. Это может занять до минуты...",
         reply_markup=ReplyKeyboardRemove()
     )
+    # Сессия могла быть вытеснена из памяти при нехватке места - тогда все ответы "Авто"
+    ud = _load_session(update, context) or CharacterSession()
+    _end_session(update, context)
+    if await _ensure_generation_ready(update.message):
+        await _generate_and_send(update, ud)
+    return ConversationHandler.END
 
-    ud = context.user_data
+async def _generate_and_send(update: Update, ud) -> None:
+    """Генерирует персонажа по ответам ud (объект с методом get(ключ)) и отправляет профиль и PDF."""
     await update.message.chat.send_action(action="typing")
 
-    generation_result = await generate_dnd_character_profile_for_bot(
+    queue_status_message = None
+    async def report_queue_position(position):
+        nonlocal queue_status_message
+        if position > 0:
+            status_text = f"Сейчас много желающих. Твоё место в очереди: {position}."
+        else:
+            status_text = "Очередь подошла, генерирую персонажа..."
+        if queue_status_message is None:
+            queue_status_message = await update.message.reply_text(status_text)
+        else:
+            await queue_status_message.edit_text(status_text)
+
+    progress_message = None
+    show_partial_profile = None
+    if GENERATION_STREAMING:
+        progress_message = ProgressiveMessage(update.message, STREAM_EDIT_INTERVAL)
+        async def show_partial_profile(partial_text):
+            # Показываем только полностью полученные строки, чтобы поля не обрывались на полуслове
+            completed_text = partial_text[:partial_text.rfind("\n") + 1].strip()
+            if completed_text:
+                await progress_message.show(completed_text + "\n\n✍️ ...")
+
+    generation_result = take_pooled_character(
+            race=ud.get('race'), char_class=ud.get('class'),
+            background=ud.get('background'), alignment=ud.get('alignment'),
+            location=ud.get('location'), stats_preference=ud.get('stats_preference'),
+            details=ud.get('details')
+        )
+    if generation_result is not None:
+        GENERATION_OUTCOMES.inc(outcome="pooled")
+    else:
+        generation_result = await generate_dnd_character_profile_for_bot(
             user_race=ud.get('race'), user_class=ud.get('class'),
             user_background=ud.get('background'), user_alignment=ud.get('alignment'),
             user_location=ud.get('location'), user_stats_preference=ud.get('stats_preference'),
-            user_details=ud.get('details'), user_id=str(update.effective_user.id)
+            user_details=ud.get('details'), user_id=str(update.effective_user.id),
+            on_queue_position=report_queue_position, on_partial_text=show_partial_profile
         )
+        GENERATION_OUTCOMES.inc(outcome=_generation_outcome(generation_result.get("text_profile")))
 
     text_profile = generation_result.get("text_profile")
     pdf_buffer = generation_result.get("pdf_buffer") # Получаем буфер PDF
     parsed_data = generation_result.get("parsed_data") # Получаем распарсенные данные для имени файла
 
-    error_prefix_tuple = ("ЗАПРОС ЗАБЛОКИРОВАН", "КОНТЕНТ ЗАБЛОКИРОВАН", "ОШИБКА API", "Модель не вернула", "Модель вернула пустой")
-
-    if text_profile and not any(text_profile.startswith(prefix) for prefix in error_prefix_tuple):
-        # Отправка текстового профиля частями, если он слишком длинный
-        if len(text_profile) > 4096: # Максимальная длина сообщения Telegram
-             await update.message.reply_text("Сгенерированный текстовый профиль слишком длинный. Вот его части:")
-             for i in range(0, len(text_profile), 4090): # Делим с небольшим запасом
-                 await update.message.chat.send_action(action="typing")
-                 await update.message.reply_text(text_profile[i:i + 4090])
-                 if hasattr(context, 'application') and hasattr(context.application, 'bot'):
-                     await context.application.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-                 time.sleep(0.5) # Небольшая задержка между частями
-        else:
-            await update.message.reply_text(text_profile)
+    send_started = time.perf_counter()
+    if text_profile and not text_profile.startswith(LLM_ERROR_PREFIXES):
+        # Длинный профиль делится на сообщения по границам полей; темп отправки
+        # задаёт очередь исходящих запросов (telegram_rate_limiter)
+        message_parts = split_profile_message(text_profile)
+        if progress_message and progress_message.message:
+            await progress_message.show(message_parts[0], force=True) # Итоговый текст - в то же сообщение
+            message_parts = message_parts[1:]
+        elif len(message_parts) > 1:
+            await update.message.reply_text("Сгенерированный текстовый профиль слишком длинный. Вот его части:")
+        for message_part in message_parts:
+            await update.message.reply_text(message_part)
 
         # Отправка PDF, если он был успешно сгенерирован
         if pdf_buffer:
@@ -208,5 +442,113 @@ async def get_details_and_generate(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("К сожалению, не удалось сгенерировать персонажа (не получен ответ от модели). Попробуйте еще раз: /create")
 
     await update.message.reply_text("Чтобы создать еще одного персонажа, используй /create.")
-    context.user_data.clear() # Очищаем данные пользователя для следующей сессии
-    return ConversationHandler.END
+    STAGE_SECONDS.observe(time.perf_counter() - send_started, stage="telegram_send")
+
+
+async def quick_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Создаёт персонажа по одному сообщению без диалога: /quick эльф волшебник мудрец."""
+    command_and_text = update.message.text.split(maxsplit=1)
+    answers = resolve_quick_request(command_and_text[1] if len(command_and_text) > 1 else "")
+    await update.message.reply_text(
+        f"{_answers_summary(answers)}\n\nНачинаю генерацию персонажа и PDF. Это может занять до минуты...",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    if await _ensure_generation_ready(update.message):
+        await _generate_and_send(update, answers)
+
+
+async def inline_quick(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Инлайн-режим: "@бот эльф волшебник" предлагает отправить в чат команду /quick с этими параметрами."""
+    query = update.inline_query.query.strip()
+    answers = resolve_quick_request(query)
+    await update.inline_query.answer([
+        InlineQueryResultArticle(
+            id="quick",
+            title="Создать персонажа",
+            description=_answers_summary(answers, separator=", "),
+            input_message_content=InputTextMessageContent(f"/quick {query}".strip()),
+        )
+    ], cache_time=300)
+
+
+async def party_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Генерирует группу персонажей одним запросом к модели: /party 4."""
+    party_size = PARTY_DEFAULT_SIZE
+    if context.args:
+        try:
+            party_size = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text(f"Укажи размер группы числом, например: /party {PARTY_DEFAULT_SIZE}")
+            return
+    if not 2 <= party_size <= PARTY_MAX_SIZE:
+        await update.message.reply_text(f"Размер группы должен быть от 2 до {PARTY_MAX_SIZE}.")
+        return
+
+    await update.message.reply_text(
+        f"Генерирую группу из {party_size} персонажей и общий PDF. Это может занять пару минут...",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    if not await _ensure_generation_ready(update.message):
+        return
+    await update.message.chat.send_action(action="typing")
+
+    party_result = await generate_dnd_party_for_bot(party_size, user_id=str(update.effective_user.id))
+    text_profiles = party_result.get("text_profiles")
+
+    if not text_profiles:
+        error_text = party_result.get("error") or "не получен ответ от модели"
+        await update.message.reply_text(f"Произошла ошибка при генерации группы: {error_text}\nПопробуйте еще раз: /party {party_size}")
+        return
+
+    for text_profile in text_profiles:
+        for message_part in split_profile_message(text_profile):
+            await update.message.reply_text(message_part)
+
+    pdf_buffer = party_result.get("pdf_buffer")
+    if pdf_buffer:
+        try:
+            await update.message.chat.send_action(action="upload_document")
+            await update.message.reply_document(
+                document=pdf_buffer,
+                filename=f"DND_Party_{update.effective_user.id}.pdf",
+                caption=f"Вот PDF с твоей группой из {len(text_profiles)} персонажей!"
+            )
+            logger.info(f"PDF группы успешно отправлен пользователю {update.effective_user.id}")
+        except Exception as e_send_pdf:
+            logger.error(f"Ошибка при отправке PDF группы пользователю {update.effective_user.id}: {e_send_pdf}")
+            await update.message.reply_text("К сожалению, не удалось отправить PDF файл группы. Пожалуйста, используйте текстовую версию выше.")
+    else:
+        await update.message.reply_text("Не удалось создать PDF файл группы. Пожалуйста, используйте текстовую версию выше.")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Профилирование для администраторов (ADMIN_USER_IDS): /profile - состояние, /profile 0.05 - доля
+    генераций под профилировщиком, /profile next - профилировать следующую генерацию,
+    /profile slow 0.1 - порог детектора медленных обработчиков в секундах, /profile off - выключить.
+    """
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    args = [arg.lower() for arg in context.args]
+    try:
+        if args == ["off"]:
+            disable_profiling()
+        elif args == ["next"]:
+            profile_next_run()
+        elif len(args) == 2 and args[0] == "slow":
+            set_slow_callback_threshold(float(args[1]))
+        elif len(args) == 1:
+            set_sample_rate(float(args[0]))
+        elif args:
+            raise ValueError(args)
+    except ValueError:
+        await update.message.reply_text("Использование: /profile [доля от 0 до 1 | next | slow секунды | off]")
+        return
+
+    status = profiling_status()
+    threshold = status["slow_callback_threshold"]
+    await update.message.reply_text(
+        f"Профилирование генерации: доля {status['sample_rate']}, ждут профилирования {status['forced_runs']}, "
+        f"сохранено профилей {status['saved_runs']} в {status['directory']}.\n"
+        f"Детектор медленных обработчиков: {f'порог {threshold * 1000:.0f} мс' if threshold else 'выключен'}."
+    )
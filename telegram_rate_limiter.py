@@ -0,0 +1,169 @@
+"""
+Очередь исходящих запросов к Bot API с учётом лимитов Telegram.
+
+Все сообщения, правки, документы и действия в чате проходят через ChatRateLimiter
+(подключается к Application через builder.rate_limiter): запросы в один чат
+выполняются по порядку и не чаще лимита чата (допуская короткую серию подряд), все вместе - не чаще общего лимита
+бота; ожидание одного чата не задерживает остальные. Повторное действие в чате
+("печатает...") в пределах срока его показа не отправляется. Если Telegram всё же
+ответил RetryAfter, запрос повторяется после указанной паузы.
+"""
+import asyncio
+import datetime
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import (
+    TELEGRAM_GLOBAL_MESSAGES_PER_SECOND,
+    TELEGRAM_CHAT_MESSAGE_INTERVAL,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_GROUP_MESSAGES_PER_MINUTE,
+    TELEGRAM_CHAT_ACTION_TTL,
+    TELEGRAM_MAX_RETRIES,
+)
+from metrics import TELEGRAM_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+CHAT_ACTION_ENDPOINT = "sendChatAction"
+MAX_IDLE_CHATS = 10000  # после стольких записей о чатах неактивные удаляются
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class _ChatState:
+    """Очередь чата и маркерная корзина его сообщений: burst подряд, затем одно за interval секунд."""
+    __slots__ = ("lock", "tokens", "updated_at", "resume_at", "last_action", "last_action_at")
+
+    def __init__(self, burst):
+        self.lock = asyncio.Lock()
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.resume_at = 0.0  # пауза чата после RetryAfter
+        self.last_action = None
+        self.last_action_at = 0.0
+
+    def time_until_send(self, burst, interval):
+        now = time.monotonic()
+        self.tokens = min(float(burst), self.tokens + (now - self.updated_at) / interval)
+        self.updated_at = now
+        wait = self.resume_at - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) * interval)
+        return wait
+
+
+class ChatRateLimiter(BaseRateLimiter):
+    def __init__(self, global_per_second, chat_interval, chat_burst, group_per_minute, chat_action_ttl, max_retries):
+        self._global_per_second = global_per_second
+        self._chat_interval = chat_interval
+        self._chat_burst = chat_burst
+        self._group_interval = 60.0 / group_per_minute
+        self._chat_action_ttl = chat_action_ttl
+        self._max_retries = max_retries
+        self._chats = {}
+        self._global_sent_at = deque()
+        self._global_lock = asyncio.Lock()
+        self._paused_until = 0.0  # общая пауза после RetryAfter
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_state(self, chat_id):
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) >= MAX_IDLE_CHATS:
+                self._forget_idle_chats()
+            state = self._chats[chat_id] = _ChatState(self._chat_burst)
+        return state
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, state in self._chats.items()
+                        if not state.lock.locked() and state.resume_at < now
+                        and now - state.updated_at > self._chat_burst * self._interval_for(chat_id)
+                        and now - state.last_action_at > self._chat_action_ttl]:
+            del self._chats[chat_id]
+
+    def _interval_for(self, chat_id):
+        # Отрицательные id - группы и каналы, у них лимит строже
+        return self._group_interval if isinstance(chat_id, int) and chat_id < 0 else self._chat_interval
+
+    async def _wait_global_slot(self):
+        async with self._global_lock:
+            while True:
+                now = time.monotonic()
+                while self._global_sent_at and now - self._global_sent_at[0] >= 1.0:
+                    self._global_sent_at.popleft()
+                wait = self._paused_until - now
+                if len(self._global_sent_at) >= self._global_per_second:
+                    wait = max(wait, 1.0 - (now - self._global_sent_at[0]))
+                if wait <= 0:
+                    self._global_sent_at.append(now)
+                    return
+                await asyncio.sleep(wait)
+
+    async def _call_with_retries(self, callback, args, kwargs, endpoint, chat_state=None):
+        for attempt in range(self._max_retries + 1):
+            await self._wait_global_slot()
+            try:
+                result = await callback(*args, **kwargs)
+                TELEGRAM_REQUESTS.inc(result="sent")
+                return result
+            except RetryAfter as e:
+                if attempt >= self._max_retries:
+                    raise
+                retry_after = _retry_after_seconds(e)
+                TELEGRAM_REQUESTS.inc(result="retry_after")
+                logger.warning(f"Telegram ограничил частоту запросов ({endpoint}), повтор через {retry_after:.0f} с.")
+                resume_at = time.monotonic() + retry_after
+                self._paused_until = max(self._paused_until, resume_at)
+                if chat_state is not None:
+                    chat_state.resume_at = max(chat_state.resume_at, resume_at)
+                await asyncio.sleep(retry_after)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None: # Запросы не к чату (getMe, ответы на inline-запросы) - только общий лимит
+            return await self._call_with_retries(callback, args, kwargs, endpoint)
+
+        chat_state = self._chat_state(chat_id)
+        if endpoint == CHAT_ACTION_ENDPOINT:
+            # Действие уже показывается или в чат вот-вот уйдёт сообщение - повтор ничего не добавит
+            action = data.get("action")
+            now = time.monotonic()
+            if chat_state.lock.locked() or (action == chat_state.last_action
+                                            and now - chat_state.last_action_at < self._chat_action_ttl):
+                TELEGRAM_REQUESTS.inc(result="dropped_action")
+                return True
+            chat_state.last_action, chat_state.last_action_at = action, now
+            return await self._call_with_retries(callback, args, kwargs, endpoint)
+
+        interval = self._interval_for(chat_id)
+        async with chat_state.lock:
+            wait = chat_state.time_until_send(self._chat_burst, interval)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = chat_state.time_until_send(self._chat_burst, interval)
+            chat_state.tokens -= 1
+            try:
+                return await self._call_with_retries(callback, args, kwargs, endpoint, chat_state)
+            finally:
+                chat_state.last_action = None # Новое сообщение скрывает действие в чате
+
+
+def create_rate_limiter():
+    return ChatRateLimiter(TELEGRAM_GLOBAL_MESSAGES_PER_SECOND, TELEGRAM_CHAT_MESSAGE_INTERVAL, TELEGRAM_CHAT_BURST,
+                           TELEGRAM_GROUP_MESSAGES_PER_MINUTE, TELEGRAM_CHAT_ACTION_TTL, TELEGRAM_MAX_RETRIES)
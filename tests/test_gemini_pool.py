@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+import pytest
+from google.generativeai import client as genai_client
+
+import gemini_utils
+from gemini_pool import check_client_internals
+
+
+def test_installed_library_has_the_client_internals():
+    model = gemini_utils.load_genai().GenerativeModel("gemini-test")
+    check_client_internals(model)
+
+
+def test_missing_internals_are_named(monkeypatch):
+    monkeypatch.delattr(genai_client, "_ClientManager")
+    with pytest.raises(RuntimeError, match=r"client\._ClientManager.*GenerativeModel\._async_client"):
+        check_client_internals(SimpleNamespace(_client=None))
+
+
+def test_init_gemini_fails_clearly_with_several_keys(monkeypatch, caplog):
+    monkeypatch.setattr(gemini_utils, "GOOGLE_API_KEYS", ["test-key-1", "test-key-2"])
+    monkeypatch.setattr(gemini_utils, "_model_pool", None)
+    monkeypatch.delattr(genai_client._ClientManager, "get_default_client")
+    assert not gemini_utils.init_gemini()
+    assert "client._ClientManager.get_default_client" in caplog.text
+    assert gemini_utils.get_model_pool() is None
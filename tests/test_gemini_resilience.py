@@ -0,0 +1,91 @@
+import pytest
+
+import gemini_resilience
+from gemini_resilience import CircuitBreaker, CircuitBreakerOpen
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(gemini_resilience.time, "monotonic", fake_clock)
+    return fake_clock
+
+
+def _breaker():
+    return CircuitBreaker(error_rate=0.5, min_requests=4, window=60, open_seconds=30)
+
+
+def _open(breaker):
+    for _ in range(4):
+        breaker.before_request()
+        breaker.record_failure()
+    assert breaker.is_open
+
+
+def test_stays_closed_until_min_requests_and_error_rate(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_success()
+    breaker.record_success()
+    assert not breaker.is_open  # 3 ошибки из 5 - 60%, но порог проверяется только при новой ошибке
+    breaker.record_failure()
+    assert breaker.is_open
+
+
+def test_old_results_leave_the_window(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 61
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_open_breaker_rejects_until_pause_then_lets_one_probe_through(clock):
+    breaker = _breaker()
+    _open(breaker)
+    with pytest.raises(CircuitBreakerOpen):
+        breaker.before_request()
+    clock.now += 30
+    breaker.before_request()  # пробный запрос
+    with pytest.raises(CircuitBreakerOpen):
+        breaker.before_request()  # второй запрос ждёт результата пробного
+
+
+def test_successful_probe_closes_and_failed_probe_extends_the_pause(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.now += 30
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.is_open
+    clock.now += 29
+    with pytest.raises(CircuitBreakerOpen):
+        breaker.before_request()
+    clock.now += 1
+    breaker.before_request()
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.before_request()
+
+
+def test_probe_without_result_does_not_block_forever(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.now += 30
+    breaker.before_request()  # пробный запрос отменён и не сообщил результат
+    clock.now += 30
+    breaker.before_request()
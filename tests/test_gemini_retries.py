@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+
+import gemini_utils
+from benchmarks.load_test import StubResponse
+from gemini_pool import ModelPool, ModelPoolEntry
+
+RESPONSE_TEXT = "Имя: Лиара\nРаса: Эльф\n" * 5
+
+
+class StreamingModel:
+    """Присылает ответ фрагментами с паузой chunk_delay; после stall_after фрагментов замолкает."""
+
+    def __init__(self, chunk_delay, chunks=6, stall_after=None):
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+        self.stall_after = stall_after
+
+    async def generate_content_async(self, contents=None, generation_config=None, stream=False, **kwargs):
+        response = StubResponse(RESPONSE_TEXT, self.chunk_delay * self.chunks, self.chunks)
+        if self.stall_after is None:
+            return response
+        return StallingStream(response, self.stall_after)
+
+
+class StallingStream(StubResponse):
+    def __init__(self, response, stall_after):
+        super().__init__(response.text, response._stream_latency, response._chunks)
+        self._stall_after = stall_after
+
+    async def __aiter__(self):
+        index = 0
+        async for chunk in super().__aiter__():
+            if index == self._stall_after:
+                await asyncio.sleep(3600)
+            index += 1
+            yield chunk
+
+
+class QuotaModel:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content_async(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("429 Resource has been exhausted (e.g. check quota).")
+
+
+@pytest.fixture
+def use_models(monkeypatch):
+    monkeypatch.setattr(gemini_utils, "GEMINI_ATTEMPT_TIMEOUT", 0.2)
+    monkeypatch.setattr(gemini_utils, "GEMINI_REQUEST_DEADLINE", 1.0)
+    monkeypatch.setattr(gemini_utils, "GEMINI_HEDGE_MIN_DELAY", 0.05)
+    monkeypatch.setattr(gemini_utils, "GEMINI_HEDGE_ENABLED", False)
+    monkeypatch.setattr(gemini_utils, "_circuit_breaker", None)
+    monkeypatch.setattr(gemini_utils, "_gemini_semaphore", None)
+    monkeypatch.setattr(gemini_utils, "_latency_trackers", {})
+
+    def use(*models, quarantine_seconds=60):
+        entries = [ModelPoolEntry(f"key{index}", "stub", model) for index, model in enumerate(models)]
+        monkeypatch.setattr(gemini_utils, "_model_pool", ModelPool(entries, 1000, quarantine_seconds))
+    return use
+
+
+async def _ignore_partial_text(text):
+    pass
+
+
+def _generate(**kwargs):
+    return asyncio.run(gemini_utils.generate_content_with_gemini_async(["промпт"], delay=0.01, **kwargs))
+
+
+def test_attempt_timeout_limits_gaps_between_chunks_not_the_whole_stream(use_models):
+    # Поток идёт 0.6 с - втрое дольше GEMINI_ATTEMPT_TIMEOUT, но паузы между фрагментами короткие
+    use_models(StreamingModel(chunk_delay=0.1))
+    assert _generate(on_partial_text=_ignore_partial_text) == RESPONSE_TEXT
+
+
+def test_stalled_stream_fails_after_attempt_timeout(use_models):
+    use_models(StreamingModel(chunk_delay=0.01, stall_after=2))
+    started = time.monotonic()
+    result = _generate(retries=1, on_partial_text=_ignore_partial_text)
+    assert result.startswith("ОШИБКА API") and "продолжение ответа" in result
+    assert time.monotonic() - started < 0.5
+
+
+def test_quota_retries_in_other_pairs_stop_at_the_deadline(use_models):
+    model = QuotaModel()
+    use_models(model, model, quarantine_seconds=0)
+    started = time.monotonic()
+    result = _generate()
+    assert result.startswith("ОШИБКА API: Модель не ответила за")
+    assert 0.9 < time.monotonic() - started < 1.2
+    assert model.calls > 2
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+import gemini_scheduler
+from gemini_scheduler import GeminiScheduler, TokenBucket
+from gemini_utils import GeminiQuotaError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_at_its_rate_up_to_capacity(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gemini_scheduler.time, "monotonic", clock)
+    bucket = TokenBucket(60)
+    assert bucket.time_until_available(60) == 0.0
+    bucket.consume(60)
+    assert bucket.time_until_available(1) == pytest.approx(1.0)
+    clock.now += 30
+    assert bucket.time_until_available(30) == 0.0
+    assert bucket.time_until_available(31) == pytest.approx(1.0)
+    clock.now += 3600
+    bucket.consume(0)
+    assert bucket.tokens == 60
+    assert bucket.time_until_available(1000) == 0.0  # запрос больше ёмкости ждёт только полную корзину
+    bucket.drain()
+    assert bucket.time_until_available(1) == pytest.approx(1.0)
+
+
+def _run_scheduler(monkeypatch, submissions, fail_first_call=False):
+    calls = []
+
+    async def fake_generate(prompt_parts, **kwargs):
+        calls.append(prompt_parts[0])
+        if fail_first_call and len(calls) == 1:
+            raise GeminiQuotaError("429 quota")
+        await asyncio.sleep(0)
+        return f"ответ на {prompt_parts[0]}"
+
+    monkeypatch.setattr(gemini_scheduler, "generate_content_with_gemini_async", fake_generate)
+
+    async def run():
+        scheduler = GeminiScheduler(rpm_limit=1000, tpm_limit=10 ** 7, quota_cooldown=0.05, max_quota_wait=60)
+        results = await asyncio.gather(*(scheduler.submit(user_id, [prompt]) for user_id, prompt in submissions))
+        return scheduler, results
+
+    scheduler, results = asyncio.run(run())
+    return calls, results, scheduler
+
+
+def test_users_are_served_round_robin(monkeypatch):
+    submissions = [(1, "A1"), (1, "A2"), (1, "A3"), (2, "B1"), (3, "C1"), (2, "B2")]
+    calls, results, scheduler = _run_scheduler(monkeypatch, submissions)
+    assert calls == ["A1", "B1", "C1", "A2", "B2", "A3"]
+    assert results == [f"ответ на {prompt}" for _, prompt in submissions]
+    assert scheduler.is_idle
+
+
+def _queued_scheduler(requests):
+    scheduler = GeminiScheduler(rpm_limit=1000, tpm_limit=10 ** 7, quota_cooldown=1, max_quota_wait=60)
+    scheduler._wakeup = asyncio.Event()
+    for user_id, prompt in requests:
+        request = gemini_scheduler._QueuedRequest(user_id, [prompt], 0.7, None, 0)
+        scheduler._queues.setdefault(user_id, gemini_scheduler.deque()).append(request)
+    return scheduler
+
+
+def _order(scheduler):
+    return [request.prompt_parts[0] for request in scheduler._ordered_requests()]
+
+
+def test_queue_positions_follow_round_robin_order():
+    async def run():
+        return _order(_queued_scheduler([(1, "A1"), (1, "A2"), (2, "B1")]))
+
+    assert asyncio.run(run()) == ["A1", "B1", "A2"]
+
+
+def test_request_returned_after_quota_error_goes_first():
+    async def run():
+        scheduler = _queued_scheduler([(1, "A1"), (2, "B1"), (3, "C1")])
+        scheduler._requeue_front(gemini_scheduler._QueuedRequest(3, ["C0"], 0.7, None, 0))
+        return _order(scheduler)
+
+    assert asyncio.run(run()) == ["C0", "A1", "B1", "C1"]
+
+
+def test_quota_error_is_retried_after_the_cooldown(monkeypatch):
+    calls, results, scheduler = _run_scheduler(monkeypatch, [(1, "A1"), (2, "B1")], fail_first_call=True)
+    assert sorted(calls) == ["A1", "A1", "B1"]
+    assert results == ["ответ на A1", "ответ на B1"]
+    assert scheduler.is_idle
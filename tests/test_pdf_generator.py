@@ -0,0 +1,24 @@
+import pdf_generator
+
+PROFILE = {
+    "name": "Торин Дубощит", "race": "Дварф", "class": "Воин", "background_name": "Солдат",
+    "alignment": "Законно-Добрый", "stats": "Сила 15, Ловкость 10",
+    "inventory": "Меч & щит, <b>зелье</b>\nверёвка 15 м",
+    "backstory_text": "Торин служил в гарнизоне горной крепости, пока орки не сожгли его родной клан. " * 3 + "\n",
+    "trait": "Держит слово.", "ideal": "Долг.", "bond": "Клан.", "flaw": "Не доверяет эльфам.",
+}
+
+
+def test_platypus_fallback_draws_markup_characters_as_text(monkeypatch):
+    monkeypatch.setattr(pdf_generator, "PDF_FAST_RENDERER", False)
+    assert pdf_generator._paragraph_text("a & <b>\nc") == "a &amp; &lt;b&gt;<br/>\nc"
+    assert pdf_generator.create_character_sheet_pdf(PROFILE) is not None
+
+
+def test_fast_layout_justifies_all_but_the_last_line_of_each_paragraph():
+    lines = pdf_generator._layout_character_page(PROFILE, pdf_generator._get_sheet_template())
+    backstory = [(text, align) for _, _, _, _, text, align, _ in lines if "Торин служил" in text or "клан." in text]
+    assert [align for _, align in backstory] == ["justify"] * (len(backstory) - 1) + ["left"]
+    assert ("Меч & щит, <b>зелье</b>", "left") in [(text, align) for _, _, _, _, text, align, _ in lines]
+    assert lines[0][5] == "center"
+    assert all(text for _, _, _, _, text, _, _ in lines)  # завершающий перенос строки не даёт пустой строки
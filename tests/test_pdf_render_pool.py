@@ -0,0 +1,32 @@
+import asyncio
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pdf_render_pool
+
+
+class BrokenExecutor:
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("процесс пула завершился")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def _render_in_thread(data):
+    return threading.current_thread().name.encode()
+
+
+def test_broken_pool_falls_back_to_a_thread(monkeypatch):
+    monkeypatch.setattr(pdf_render_pool, "PDF_RENDER_WORKERS", 1)
+    monkeypatch.setattr(pdf_render_pool, "_executor", BrokenExecutor())
+    pdf = asyncio.run(pdf_render_pool._render(_render_in_thread, {}))
+    assert pdf.getvalue() != threading.main_thread().name.encode()
+    assert pdf_render_pool._executor is None
+    assert pdf_render_pool._tasks_in_flight == 0
+
+
+def test_rendering_without_a_pool_runs_in_a_thread(monkeypatch):
+    monkeypatch.setattr(pdf_render_pool, "PDF_RENDER_WORKERS", 0)
+    pdf = asyncio.run(pdf_render_pool._render(_render_in_thread, {}))
+    assert pdf.getvalue() != threading.main_thread().name.encode()
@@ -0,0 +1,70 @@
+import asyncio
+
+from persistence import SQLitePersistence
+
+
+def _reopen(path):
+    return SQLitePersistence(str(path), update_interval=1)
+
+
+def test_conversations_and_user_data_survive_restart(tmp_path):
+    path = tmp_path / "state.sqlite3"
+
+    async def first_run():
+        persistence = _reopen(path)
+        await persistence.update_conversation("character_creation", (1, 1), 3)
+        await persistence.update_conversation("character_creation", (2, 2), 1)
+        await persistence.update_user_data(1, {"session": ["Эльф (Высший)", None, None]})
+        await persistence.update_user_data(2, {"session": []})
+        await persistence.flush()
+
+    async def second_run():
+        persistence = _reopen(path)
+        return (await persistence.get_conversations("character_creation"), await persistence.get_user_data(),
+                persistence)
+
+    asyncio.run(first_run())
+    conversations, user_data, persistence = asyncio.run(second_run())
+    assert conversations == {(1, 1): 3, (2, 2): 1}
+    assert user_data == {1: {"session": ["Эльф (Высший)", None, None]}, 2: {"session": []}}
+    asyncio.run(persistence.flush())
+
+
+def test_ended_conversation_and_dropped_user_data_are_removed(tmp_path):
+    path = tmp_path / "state.sqlite3"
+
+    async def run():
+        persistence = _reopen(path)
+        await persistence.update_conversation("character_creation", (1, 1), 3)
+        await persistence.update_user_data(1, {"session": ["Человек"]})
+        await persistence.flush()
+
+        persistence = _reopen(path)
+        await persistence.update_conversation("character_creation", (1, 1), None)
+        await persistence.drop_user_data(1)
+        await persistence.flush()
+
+        persistence = _reopen(path)
+        result = await persistence.get_conversations("character_creation"), await persistence.get_user_data()
+        await persistence.flush()
+        return result
+
+    assert asyncio.run(run()) == ({}, {})
+
+
+def test_latest_change_in_a_batch_wins(tmp_path):
+    path = tmp_path / "state.sqlite3"
+
+    async def run():
+        persistence = _reopen(path)
+        await persistence.update_conversation("character_creation", (1, 1), 1)
+        await persistence.update_conversation("character_creation", (1, 1), 2)
+        await persistence.update_user_data(1, {"step": 1})
+        await persistence.update_user_data(1, {"step": 2})
+        await persistence.flush()
+        persistence = _reopen(path)
+        result = await persistence.get_conversations("character_creation"), await persistence.get_user_data()
+        await persistence.flush()
+        return result
+
+    assert asyncio.run(run()) == ({(1, 1): 2}, {1: {"step": 2}})
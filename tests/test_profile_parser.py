@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+from benchmarks.bench_parser import CORPUS_PATH
+from gemini_utils import MISSING_FIELD_VALUE, PROFILE_FIELDS_ORDERED, parse_character_profile
+
+with open(CORPUS_PATH, encoding="utf-8") as f:
+    CORPUS = [case for case in json.load(f) if "raw" in case]
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=[case["name"] for case in CORPUS])
+def test_corpus_fields(case):
+    profile = parse_character_profile(case["raw"])
+    assert {field: profile.get(field) for field in case["expected"]} == case["expected"]
+
+
+def test_empty_response_fills_every_field():
+    profile = parse_character_profile("")
+    assert all(profile[key] == MISSING_FIELD_VALUE for _, key in PROFILE_FIELDS_ORDERED)
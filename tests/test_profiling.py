@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import profiling
+from metrics import LOOP_SLOW_CALLBACKS
+
+
+def _slow_callbacks():
+    return LOOP_SLOW_CALLBACKS._values.get((), 0)
+
+
+def test_slow_callback_detector_counts_blocking_callbacks_and_restores_handle_run():
+    original_run = asyncio.Handle._run
+
+    async def block_loop():
+        time.sleep(0.05)
+
+    before = _slow_callbacks()
+    profiling.set_slow_callback_threshold(0.02)
+    try:
+        assert asyncio.Handle._run is not original_run
+        asyncio.run(block_loop())
+    finally:
+        profiling.set_slow_callback_threshold(0.0)
+    assert _slow_callbacks() > before
+    assert asyncio.Handle._run is original_run
+
+    asyncio.run(block_loop())
+    assert asyncio.Handle._run is original_run
+
+
+def test_disabling_from_inside_a_callback_is_safe():
+    async def turn_off():
+        profiling.set_slow_callback_threshold(0.0)
+        await asyncio.sleep(0)
+
+    original_run = asyncio.Handle._run
+    profiling.set_slow_callback_threshold(0.5)
+    asyncio.run(turn_off())
+    assert asyncio.Handle._run is original_run
@@ -0,0 +1,50 @@
+import pytest
+
+from telegram_handlers import resolve_quick_request
+
+
+def _chosen(text):
+    return {key: value for key, value in resolve_quick_request(text).items() if value is not None}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("эльф волшебник мудрец",
+     {"race": "Эльф (Высший)", "class": "Волшебник", "background": "Мудрец"}),
+    ("полуэльф бард хаотично-добрый народный герой, упор на харизму, ищет пропавшего брата",
+     {"race": "Полуэльф", "class": "Бард", "background": "Народный Герой", "alignment": "Хаотично-Добрый",
+      "stats_preference": "упор на харизму", "details": "ищет пропавшего брата"}),
+    ("дварфийка воительница законно злая солдат",
+     {"race": "Дварф (Холмовой)", "class": "Воин", "background": "Солдат", "alignment": "Законно-Злой"}),
+    ("человек плут нейтральный",
+     {"race": "Человек", "class": "Плут", "alignment": "Истинно Нейтральный"}),
+    ("тифлинг колдун, покупка очков",
+     {"race": "Тифлинг", "class": "Колдун (Исчадие)", "stats_preference": "покупка очков"}),
+    ("гнома мудрецом", {"race": "Гном (Лесной)", "background": "Мудрец"}),
+])
+def test_options_are_resolved(text, expected):
+    assert _chosen(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("эльф волшебник, вырос у моря",
+     {"race": "Эльф (Высший)", "class": "Волшебник", "details": "вырос у моря"}),
+    ("дварф воин, героиня войны",
+     {"race": "Дварф (Холмовой)", "class": "Воин", "details": "героиня войны"}),
+    ("человек плут, злится на брата",
+     {"race": "Человек", "class": "Плут", "details": "злится на брата"}),
+])
+def test_free_text_is_not_matched_against_options(text, expected):
+    assert _chosen(text) == expected
+
+
+def test_options_after_free_text_are_details():
+    assert _chosen("воин, ищет эльфа-солдата") == {"class": "Воин", "details": "ищет эльфа-солдата"}
+
+
+def test_second_value_for_a_field_starts_free_text():
+    assert _chosen("эльф гном") == {"race": "Эльф (Высший)", "details": "гном"}
+
+
+@pytest.mark.parametrize("text", ["", "авто", "Авто случайно"])
+def test_empty_or_auto_leaves_everything_auto(text):
+    assert _chosen(text) == {}
@@ -0,0 +1,46 @@
+import sys
+
+from session_store import SESSION_BASE_BYTES, SessionStore
+
+
+def _store(max_sessions=100, max_bytes=None):
+    store = SessionStore(max_sessions, idle_timeout=3600, max_text_length=1000, max_bytes=max_bytes)
+    evicted = []
+    store.on_evict = evicted.append
+    return store, evicted
+
+
+def test_count_limit_evicts_least_recently_used():
+    store, evicted = _store(max_sessions=2)
+    store.start(1)
+    store.start(2)
+    store.get(1)
+    store.start(3)
+    assert evicted == [2]
+    assert store.get(2) is None and store.get(1) is not None and len(store) == 2
+
+
+def test_byte_limit_evicts_oldest_sessions_when_answers_grow():
+    details = "а" * 1000
+    max_bytes = 3 * SESSION_BASE_BYTES + sys.getsizeof(details) - 1
+    store, evicted = _store(max_bytes=max_bytes)
+    for user_id in (1, 2, 3):
+        store.start(user_id)
+    store.set_answer(3, "details", details)
+    assert evicted == [1]
+    assert store.approximate_bytes <= max_bytes
+    assert store.get(3).details == details
+
+
+def test_current_session_is_not_evicted_by_byte_limit():
+    store, evicted = _store(max_bytes=SESSION_BASE_BYTES)
+    store.start(1)
+    store.set_answer(1, "details", "очень длинная история" * 10)
+    assert evicted == [] and store.get(1) is not None
+
+
+def test_ending_a_session_is_not_an_eviction():
+    store, evicted = _store()
+    store.set_answer(1, "race", "Эльф")
+    store.end(1)
+    assert evicted == [] and len(store) == 0 and store.approximate_bytes == 0
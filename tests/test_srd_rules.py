@@ -0,0 +1,71 @@
+import pytest
+
+from srd_rules import (
+    CHA, CON, DEX, INT, WIS,
+    POINT_BUY_SPREAD, RACE_BONUSES, STANDARD_ARRAY,
+    build_character_sheet, normalize_class, normalize_race,
+)
+
+POINT_BUY_COST = {8: 0, 9: 1, 10: 2, 11: 3, 12: 4, 13: 5, 14: 7, 15: 9}
+
+
+def test_point_buy_spread_costs_27_points():
+    assert sum(POINT_BUY_COST[score] for score in POINT_BUY_SPREAD) == 27
+
+
+def test_point_buy_follows_class_priority():
+    sheet = build_character_sheet("неизвестная раса", "Воин", "покупка очков")
+    assert sheet.method == "покупка очков"
+    assert sheet.scores == (15, 13, 15, 8, 10, 10)  # Сила, Телосложение, Ловкость, Мудрость, Харизма, Интеллект
+
+
+def test_standard_array_without_race_bonuses_for_unknown_race():
+    sheet = build_character_sheet("неизвестная раса", "Волшебник")
+    assert sheet.method == "стандартный набор"
+    assert sorted(sheet.scores, reverse=True) == list(STANDARD_ARRAY)
+    assert sheet.scores[INT] == 15
+
+
+@pytest.mark.parametrize("race", sorted(RACE_BONUSES))
+def test_racial_bonuses_are_added_to_base_scores(race):
+    base = build_character_sheet("неизвестная раса", "Плут").scores
+    scores = build_character_sheet(race, "Плут").scores
+    expected = list(base)
+    for ability, bonus in RACE_BONUSES[race].items():
+        expected[ability] += bonus
+    if race == "Полуэльф":
+        expected[DEX] += 1  # два свободных +1 - самым важным для класса характеристикам, кроме Харизмы
+        expected[CON] += 1
+    assert scores == tuple(expected)
+
+
+def test_preference_raises_mentioned_abilities():
+    sheet = build_character_sheet("Человек", "Воин", "хочу высокую харизму и мудрость")
+    assert sheet.scores[CHA] == 16 and sheet.scores[WIS] == 15
+
+
+def test_explicit_scores_are_used_as_given():
+    preference = "Сила 8, Ловкость 10, Телосложение 12, Интеллект 13, Мудрость 14, Харизма 15"
+    sheet = build_character_sheet("Эльф (Высший)", "Бард", preference)
+    assert sheet.method == "указаны пользователем"
+    assert sheet.scores == (8, 12, 12, 14, 14, 15)
+
+
+def test_derived_stats_for_hill_dwarf_fighter():
+    sheet = build_character_sheet("дварф", "воин", level=5)
+    assert sheet.scores[CON] == 16 and sheet.modifiers[CON] == 3
+    assert sheet.proficiency_bonus == 3
+    assert sheet.hit_points == 10 + 4 * 6 + 5 * (3 + 1)
+    assert sheet.armor_class == 18 and sheet.armor == "кольчуга и щит"
+
+
+def test_monk_unarmored_defense():
+    sheet = build_character_sheet("Человек", "Монах")
+    assert sheet.armor_class == 10 + sheet.modifiers[DEX] + sheet.modifiers[WIS]
+
+
+def test_free_text_names_are_normalized():
+    assert normalize_race("Полуэльфийка") == "Полуэльф"
+    assert normalize_race("Горный дворф") == "Дварф (Холмовой)"
+    assert normalize_class("колдунья") == "Колдун (Исчадие)"
+    assert normalize_race("орк") is None
@@ -0,0 +1,41 @@
+import asyncio
+
+from transcript_log import TranscriptWriter, read_transcripts
+
+
+def _writer(tmp_path):
+    return TranscriptWriter(str(tmp_path), segment_max_bytes=10 ** 6, segment_max_age=3600, flush_interval=3600)
+
+
+def _record(writer, user_id):
+    writer.record(user_id, "model", 0.7, "системный промпт", f"запрос {user_id}", "ответ")
+
+
+def test_close_writes_pending_records(tmp_path):
+    async def run():
+        writer = _writer(tmp_path)
+        for user_id in range(3):
+            _record(writer, user_id)
+        await writer.close()
+
+    asyncio.run(run())
+    assert sorted(int(t["user_id"]) for t in read_transcripts(directory=str(tmp_path))) == [0, 1, 2]
+
+
+def test_records_after_close_wait_for_the_flush_interval_again(tmp_path):
+    writer = _writer(tmp_path)
+
+    async def first_run():
+        _record(writer, 1)
+        await writer.close()
+
+    async def second_run():
+        _record(writer, 2)
+        await asyncio.sleep(0.2)
+        written_before_close = [t["user_id"] for t in read_transcripts(directory=str(tmp_path))]
+        await writer.close()
+        return written_before_close
+
+    asyncio.run(first_run())
+    assert asyncio.run(second_run()) == ["1"]
+    assert [t["user_id"] for t in read_transcripts(directory=str(tmp_path))] == ["1", "2"]
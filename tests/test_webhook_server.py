@@ -0,0 +1,30 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import webhook_server
+from config import WEBHOOK_PATH
+
+
+def _post_with_token(monkeypatch, token):
+    monkeypatch.setattr(webhook_server, "WEBHOOK_SECRET_TOKEN", "секрет-token")
+    application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+
+    async def post():
+        async with TestClient(TestServer(webhook_server.create_web_app(application))) as client:
+            response = await client.post(WEBHOOK_PATH, data=b"{}",
+                                         headers={webhook_server.SECRET_TOKEN_HEADER: token})
+            return response.status
+
+    return asyncio.run(post())
+
+
+def test_wrong_secret_token_is_rejected(monkeypatch):
+    assert _post_with_token(monkeypatch, "token") == 403
+    assert _post_with_token(monkeypatch, "чужой-токен") == 403
+
+
+def test_matching_non_ascii_secret_token_is_accepted(monkeypatch):
+    # Тело "{}" - не обновление Telegram, поэтому после проверки токена ответ 400, а не 403
+    assert _post_with_token(monkeypatch, "секрет-token") == 400
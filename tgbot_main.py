@@ -1,67 +1,132 @@
-import nest_asyncio
-nest_asyncio.apply()
+from startup import (
+    timed_import, log_import_timings, run_warm_up, mark_ready, seconds_since_start, warm_up_error,
+) # Первым: от него считается время запуска
 
+import asyncio
 import logging
 import os
 import datetime
 
-from telegram import Update
-from telegram.ext import Application, ConversationHandler, MessageHandler, CommandHandler, filters
+with timed_import("telegram"):
+    from telegram import Update
+    from telegram.ext import Application, ConversationHandler, MessageHandler, CommandHandler, InlineQueryHandler, filters
 
 from config import (
     TELEGRAM_BOT_TOKEN,
+    BOT_CONCURRENT_UPDATES,
+    BOT_MAX_PENDING_UPDATES,
+    BOT_QUEUE_DEPTH_LOG_INTERVAL,
+    CHARACTER_POOL_ENABLED,
+    BOT_MODE,
     TEXT_OUTPUT_DIR,
-    GOOGLE_API_KEY
+    GOOGLE_API_KEYS,
+    BOT_FAST_START,
+    BOT_WARM_UP_RETRIES,
+    BOT_WARM_UP_RETRY_DELAY,
 )
 
 from logger_setup import logger
 
-from pdf_generator import register_font # Импортируем функцию регистрации шрифта
-from gemini_utils import init_gemini
+# google.generativeai и reportlab здесь не импортируются: их загружают init_gemini и register_font
+with timed_import("gemini_utils"):
+    from gemini_utils import init_gemini
+with timed_import("инфраструктура бота"):
+    from update_processor import PerUserUpdateProcessor
+    from pdf_render_pool import shutdown_pdf_render_pool, warm_up_pdf_render_pool
+    from persistence import create_persistence
+    from telegram_rate_limiter import create_rate_limiter
+    from transcript_log import get_transcript_writer
+    from metrics import Gauge, start_metrics_server
+    from profiling import init_profiling
+with timed_import("генерация персонажей"):
+    from character_pool import get_character_pool
+    from character_generator import log_prompt_token_counts
 
 # --- Telegram Handlers ---
-from telegram_handlers import (
-    start,
-    cancel,
-    create_character_start,
-    choose_race,
-    choose_class,
-    choose_background,
-    choose_alignment,
-    get_location,
-    get_stats_preference,
-    get_details_and_generate,
-    CHOOSE_RACE, CHOOSE_CLASS, CHOOSE_BACKGROUND, CHOOSE_ALIGNMENT,
-    GET_LOCATION, GET_STATS_PREF, GET_DETAILS,
-)
+with timed_import("обработчики"):
+    from telegram_handlers import (
+        start,
+        cancel,
+        create_character_start,
+        choose_race,
+        choose_class,
+        choose_background,
+        choose_alignment,
+        get_location,
+        get_stats_preference,
+        get_details_and_generate,
+        party_command,
+        quick_command,
+        inline_quick,
+        profile_command,
+        CHOOSE_RACE, CHOOSE_CLASS, CHOOSE_BACKGROUND, CHOOSE_ALIGNMENT,
+        GET_LOCATION, GET_STATS_PREF, GET_DETAILS,
+    )
 
-def main() -> None:
-    if not GOOGLE_API_KEY or GOOGLE_API_KEY == "api_ключ_google_ai_studio" or \
-       not TELEGRAM_BOT_TOKEN or TELEGRAM_BOT_TOKEN == "токен_твоего_телеграм_бота":
-        logger.error("ОШИБКА: API ключ Google или токен Telegram-бота не установлен в config.py.")
-        logger.error("Пожалуйста, отредактируйте config.py и введите свои ключи.")
-        exit(1)
+_metrics_runner = None
+_background_tasks = set()
 
-    if not init_gemini():
-        logger.error("Не удалось инициализировать Gemini. Проверьте API ключ и настройки. Бот не может запуститься.")
-        exit(1)
+def _start_background_task(coroutine):
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
-    # Создаем директорию только для текстовых логов LLM
-    os.makedirs(TEXT_OUTPUT_DIR, exist_ok=True)
-    logger.info(f"Директория для текстовых логов LLM создана/проверена: {TEXT_OUTPUT_DIR}")
+def register_pdf_font():
+    from pdf_generator import register_font
+    register_font()
 
-    register_font() # Регистрируем шрифт для PDF при старте бота
+def stop_application(application: Application) -> None:
+    if BOT_MODE == "webhook":
+        from webhook_server import request_stop
+        request_stop()
+    else:
+        application.stop_running()
 
-    application = (
-        Application.builder()
-        .token(TELEGRAM_BOT_TOKEN)
-        .read_timeout(60)
-        .write_timeout(60)
-        .connect_timeout(30)
-        .pool_timeout(60)
-        .build()
-    )
+async def warm_up(application: Application):
+    """
+    Фоновая подготовка к генерации; обновления в это время уже принимаются. Если подготовка
+    не удалась и после повторов, бот останавливается (main завершает процесс с кодом 1),
+    чтобы супервизор увидел сбой, а не работающий бот, отказывающий в каждой генерации.
+    """
+    ready = await run_warm_up([
+        ("клиенты Gemini", init_gemini),
+        ("шрифт PDF", register_pdf_font),
+        ("процессы рендеринга PDF", warm_up_pdf_render_pool),
+    ], retries=BOT_WARM_UP_RETRIES, retry_delay=BOT_WARM_UP_RETRY_DELAY)
+    if ready:
+        await log_prompt_token_counts()
+    else:
+        logger.error("Бот останавливается: подготовка к генерации не удалась.")
+        stop_application(application)
+
+async def on_startup(application: Application) -> None:
+    global _metrics_runner
+    if CHARACTER_POOL_ENABLED:
+        get_character_pool().start() # Фоновое пополнение пула готовых персонажей
+    Gauge("dndbot_update_queue_length", "Обновления Telegram, ещё не переданные обработчикам.",
+          lambda: application.update_queue.qsize())
+    if isinstance(application.update_processor, PerUserUpdateProcessor):
+        Gauge("dndbot_update_processor_pending", "Обновления, ожидающие свободного обработчика.",
+              lambda: application.update_processor.queue_depth)
+    _metrics_runner = await start_metrics_server()
+    init_profiling()
+    logger.info(f"Бот принимает обновления через {seconds_since_start():.2f} с после запуска.")
+    if BOT_FAST_START:
+        _start_background_task(warm_up(application))
+    else:
+        # Подсчёт токенов промпта - запрос к API, запуск бота его не ждёт
+        _start_background_task(log_prompt_token_counts())
 
+async def on_shutdown(application: Application) -> None:
+    if CHARACTER_POOL_ENABLED:
+        await get_character_pool().stop()
+    await shutdown_pdf_render_pool()
+    await get_transcript_writer().close() # Дописываем накопленные записи журнала LLM
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+
+def add_handlers(application: Application, persistent: bool = False) -> None:
+    """Регистрирует обработчики команд, диалога /create и инлайн-запросов."""
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("create", create_character_start)],
         states={
@@ -75,15 +140,78 @@ def main() -> None:
         },
         fallbacks=[CommandHandler("cancel", cancel), CommandHandler("start", start)],
         per_user=True,
+        name="character_creation",
+        persistent=persistent,
         conversation_timeout=datetime.timedelta(minutes=20)
     )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(CommandHandler("party", party_command))
+    application.add_handler(CommandHandler("quick", quick_command))
+    application.add_handler(InlineQueryHandler(inline_quick))
+    application.add_handler(CommandHandler("profile", profile_command))
+
+def main() -> None:
+    if not GOOGLE_API_KEYS or GOOGLE_API_KEYS[0] == "api_ключ_google_ai_studio" or \
+       not TELEGRAM_BOT_TOKEN or TELEGRAM_BOT_TOKEN == "токен_твоего_телеграм_бота":
+        logger.error("ОШИБКА: API ключ Google или токен Telegram-бота не установлен в config.py.")
+        logger.error("Пожалуйста, отредактируйте config.py и введите свои ключи.")
+        exit(1)
+    log_import_timings()
+
+    if not BOT_FAST_START:
+        if not init_gemini():
+            logger.error("Не удалось инициализировать Gemini. Проверьте API ключ и настройки. Бот не может запуститься.")
+            exit(1)
+        register_pdf_font() # Регистрируем шрифт для PDF при старте бота
+        mark_ready()
+
+    # Создаем директорию только для текстовых логов LLM
+    os.makedirs(TEXT_OUTPUT_DIR, exist_ok=True)
+    logger.info(f"Директория для текстовых логов LLM создана/проверена: {TEXT_OUTPUT_DIR}")
 
-    logger.info("Бот запускается...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application_builder = Application.builder()
+    if BOT_MODE == "webhook":
+        application_builder = application_builder.updater(None) # Обновления приходят во встроенный HTTP-сервер
+    application_builder = (
+        application_builder
+        .token(TELEGRAM_BOT_TOKEN)
+        .read_timeout(60)
+        .write_timeout(60)
+        .connect_timeout(30)
+        .pool_timeout(60)
+        .rate_limiter(create_rate_limiter()) # Все исходящие запросы - через очередь с лимитами Telegram
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if BOT_CONCURRENT_UPDATES > 0:
+        # Обновления разных пользователей обрабатываются параллельно, одного - по порядку
+        application_builder = application_builder.concurrent_updates(
+            PerUserUpdateProcessor(BOT_CONCURRENT_UPDATES, BOT_MAX_PENDING_UPDATES, BOT_QUEUE_DEPTH_LOG_INTERVAL)
+        )
+    persistence = create_persistence()
+    if persistence:
+        # Незавершённые диалоги переживают перезапуск бота
+        application_builder = application_builder.persistence(persistence)
+    application = application_builder.build()
+
+    add_handlers(application, persistent=persistence is not None)
+
+    if BOT_MODE == "webhook":
+        from webhook_server import run_webhook
+        logger.info("Бот запускается в режиме вебхука...")
+        asyncio.run(run_webhook(application, on_startup, on_shutdown))
+    else:
+        import nest_asyncio
+        nest_asyncio.apply()
+        logger.info("Бот запускается...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    if warm_up_error() is not None:
+        logger.error(f"Бот остановлен из-за ошибки подготовки: {warm_up_error()}")
+        exit(1)
 
 if __name__ == "__main__":
     main()
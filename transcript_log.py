@@ -0,0 +1,220 @@
+"""
+Журнал запросов к LLM и ответов модели.
+
+Записи накапливаются в памяти и фоновой задачей дописываются пакетами в сжатые
+сегменты JSONL (transcripts_<время>_<pid>.jsonl.gz) в TEXT_OUTPUT_DIR; сегменты
+ротируются по размеру и возрасту. Системный промпт хранится один раз на версию
+(prompts/<sha256>.txt), а записи ссылаются на него по хешу.
+
+Поиск записей по пользователю и интервалу времени:
+    python -m transcript_log --user-id 123456 --since 2026-10-01 --until "2026-10-02 12:00"
+"""
+import argparse
+import asyncio
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from config import (
+    TEXT_OUTPUT_DIR,
+    TRANSCRIPT_SEGMENT_MAX_BYTES,
+    TRANSCRIPT_SEGMENT_MAX_AGE,
+    TRANSCRIPT_FLUSH_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "transcripts_"
+SEGMENT_SUFFIX = ".jsonl.gz"
+PROMPTS_SUBDIR = "prompts"
+SEGMENT_TIME_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def prompt_hash(system_prompt):
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+
+class TranscriptWriter:
+    """Фоновая пакетная запись журнала в ротируемые сжатые сегменты JSONL."""
+
+    def __init__(self, directory, segment_max_bytes, segment_max_age, flush_interval):
+        self._directory = directory
+        self._segment_max_bytes = segment_max_bytes
+        self._segment_max_age = segment_max_age
+        self._flush_interval = flush_interval
+        self._pending_records = []
+        self._pending_prompts = {}
+        self._stored_prompt_hashes = set()
+        self._segment_path = None
+        self._segment_started_at = 0.0
+        self._flush_task = None
+        self._close_requested = asyncio.Event()
+        self._write_lock = threading.Lock()  # пакеты дописываются в один сегмент gzip строго по очереди
+
+    def record(self, user_id, model_name, temperature, system_prompt, user_request, response, **extra):
+        """Добавляет запись в очередь на запись; не выполняет дисковых операций."""
+        system_prompt_sha256 = prompt_hash(system_prompt)
+        if system_prompt_sha256 not in self._stored_prompt_hashes:
+            self._pending_prompts[system_prompt_sha256] = system_prompt
+        transcript = {
+            "ts": time.time(),
+            "user_id": str(user_id),
+            "model": model_name,
+            "temperature": temperature,
+            "system_prompt_sha256": system_prompt_sha256,
+            "user_request": user_request,
+            "response": response,
+        }
+        transcript.update(extra)
+        self._pending_records.append(transcript)
+        self._ensure_flush_task()
+
+    def _ensure_flush_task(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError: # Вне цикла событий (например, в скриптах) пишем сразу
+            self._write_batch(*self._take_pending())
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._pending_records or self._pending_prompts:
+            # При закрытии ожидание прерывается, но начатая запись пакета дописывается до конца
+            try:
+                await asyncio.wait_for(self._close_requested.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.to_thread(self._write_batch, *self._take_pending())
+            except Exception as e:
+                logger.error(f"Ошибка при записи журнала LLM в {self._directory}: {e}")
+
+    def _current_segment(self):
+        now = time.time()
+        if self._segment_path is not None:
+            too_old = now - self._segment_started_at > self._segment_max_age
+            too_big = os.path.exists(self._segment_path) and os.path.getsize(self._segment_path) > self._segment_max_bytes
+            if too_old or too_big:
+                logger.info(f"Сегмент журнала LLM закрыт: {self._segment_path}")
+                self._segment_path = None
+        if self._segment_path is None:
+            started = datetime.datetime.fromtimestamp(now).strftime(SEGMENT_TIME_FORMAT)
+            self._segment_path = os.path.join(self._directory, f"{SEGMENT_PREFIX}{started}_{os.getpid()}{SEGMENT_SUFFIX}")
+            self._segment_started_at = now
+        return self._segment_path
+
+    def _take_pending(self):
+        records, self._pending_records = self._pending_records, []
+        prompts, self._pending_prompts = self._pending_prompts, {}
+        return records, prompts
+
+    def _write_batch(self, records, prompts):
+        with self._write_lock:
+            self._write_batch_locked(records, prompts)
+
+    def _write_batch_locked(self, records, prompts):
+        if prompts:
+            prompts_dir = os.path.join(self._directory, PROMPTS_SUBDIR)
+            os.makedirs(prompts_dir, exist_ok=True)
+            for system_prompt_sha256, system_prompt in prompts.items():
+                prompt_path = os.path.join(prompts_dir, f"{system_prompt_sha256}.txt")
+                if not os.path.exists(prompt_path):
+                    with open(prompt_path, "w", encoding="utf-8") as f:
+                        f.write(system_prompt)
+                self._stored_prompt_hashes.add(system_prompt_sha256)
+        if records:
+            os.makedirs(self._directory, exist_ok=True)
+            segment_path = self._current_segment()
+            # Каждый пакет - отдельный gzip-член; такой файл читается как один поток
+            with gzip.open(segment_path, "at", encoding="utf-8") as f:
+                for transcript in records:
+                    f.write(json.dumps(transcript, ensure_ascii=False) + "\n")
+            logger.debug(f"В журнал LLM {segment_path} записано {len(records)} записей.")
+
+    async def close(self):
+        """
+        Дописывает накопленные записи. Фоновая запись не отменяется: отмена не остановила бы её поток.
+        После закрытия журналом можно пользоваться снова - записи опять копятся flush_interval.
+        """
+        self._close_requested.set()
+        if self._flush_task is not None:
+            await self._flush_task
+        await asyncio.to_thread(self._write_batch, *self._take_pending())
+        # Новое событие, а не clear(): прежнее привязано к циклу событий, в котором его ждали
+        self._close_requested = asyncio.Event()
+
+
+_writer = None
+
+def get_transcript_writer():
+    global _writer
+    if _writer is None:
+        _writer = TranscriptWriter(TEXT_OUTPUT_DIR, TRANSCRIPT_SEGMENT_MAX_BYTES, TRANSCRIPT_SEGMENT_MAX_AGE,
+                                   TRANSCRIPT_FLUSH_INTERVAL)
+    return _writer
+
+
+def load_system_prompt(system_prompt_sha256, directory=TEXT_OUTPUT_DIR):
+    prompt_path = os.path.join(directory, PROMPTS_SUBDIR, f"{system_prompt_sha256}.txt")
+    if not os.path.exists(prompt_path):
+        return None
+    with open(prompt_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _segment_started_at(segment_path):
+    name = os.path.basename(segment_path)[len(SEGMENT_PREFIX):]
+    try:
+        return datetime.datetime.strptime(name[:15], SEGMENT_TIME_FORMAT).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def read_transcripts(user_id=None, since=None, until=None, directory=TEXT_OUTPUT_DIR):
+    """
+    Перебирает записи журнала пользователя user_id (или всех) в интервале [since, until].
+    since и until - datetime или None. Сегменты вне интервала не распаковываются.
+    """
+    since_ts = since.timestamp() if since else None
+    until_ts = until.timestamp() if until else None
+    for segment_path in sorted(glob.glob(os.path.join(directory, f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))):
+        if until_ts is not None and _segment_started_at(segment_path) > until_ts:
+            continue
+        if since_ts is not None and os.path.getmtime(segment_path) < since_ts:
+            continue
+        with gzip.open(segment_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                transcript = json.loads(line)
+                if user_id is not None and transcript["user_id"] != str(user_id):
+                    continue
+                if since_ts is not None and transcript["ts"] < since_ts:
+                    continue
+                if until_ts is not None and transcript["ts"] > until_ts:
+                    continue
+                yield transcript
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск записей журнала запросов к LLM.")
+    parser.add_argument("--user-id", help="ID пользователя Telegram")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, help="Начало интервала (ISO, например 2026-10-01 12:00)")
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat, help="Конец интервала (ISO)")
+    parser.add_argument("--dir", default=TEXT_OUTPUT_DIR, help="Директория журнала")
+    parser.add_argument("--with-system-prompt", action="store_true", help="Подставить текст системного промпта")
+    args = parser.parse_args()
+
+    for transcript in read_transcripts(args.user_id, args.since, args.until, args.dir):
+        if args.with_system_prompt:
+            transcript["system_prompt"] = load_system_prompt(transcript["system_prompt_sha256"], args.dir)
+        print(json.dumps(transcript, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
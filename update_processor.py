@@ -0,0 +1,92 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления параллельно, но сохраняет порядок в пределах одного пользователя.
+    Обновления разных пользователей выполняются одновременно (не более workers штук),
+    обновления одного пользователя - строго по очереди, чтобы состояния
+    ConversationHandler не обгоняли друг друга.
+    """
+
+    __slots__ = ("_workers", "_worker_semaphore", "_user_locks", "_queued_updates",
+                 "_max_queue_depth_seen", "_report_interval", "_report_task")
+
+    def __init__(self, workers: int, max_pending_updates: int, report_interval: float = 60):
+        # Семафор базового класса ограничивает общее число принятых обновлений
+        # (включая ожидающие в очереди), собственный - число реально выполняемых.
+        super().__init__(max(max_pending_updates, workers, 2))
+        self._workers = workers
+        self._worker_semaphore = None
+        self._user_locks = {}
+        self._queued_updates = 0
+        self._max_queue_depth_seen = 0
+        self._report_interval = report_interval
+        self._report_task = None
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def queue_depth(self) -> int:
+        """Число принятых обновлений, которые ещё ждут своей очереди на обработку."""
+        return self._queued_updates
+
+    @staticmethod
+    def _user_key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        user_key = self._user_key(update)
+        user_entry = self._user_locks.get(user_key)
+        if user_entry is None:
+            user_entry = self._user_locks[user_key] = [asyncio.Lock(), 0]
+        user_entry[1] += 1
+
+        self._queued_updates += 1
+        self._max_queue_depth_seen = max(self._max_queue_depth_seen, self._queued_updates)
+        started = False
+        try:
+            async with user_entry[0]:
+                async with self._worker_semaphore:
+                    self._queued_updates -= 1
+                    started = True
+                    await coroutine
+        finally:
+            if not started:
+                self._queued_updates -= 1
+            user_entry[1] -= 1
+            # Удаляем замок пользователя, если его обновлений больше нет
+            if user_entry[1] == 0:
+                self._user_locks.pop(user_key, None)
+
+    async def _report_queue_depth(self) -> None:
+        while True:
+            await asyncio.sleep(self._report_interval)
+            if self._queued_updates:
+                logger.info(f"Глубина очереди обновлений: {self._queued_updates} "
+                            f"(активных пользователей: {len(self._user_locks)}, обработчиков: {self._workers}).")
+
+    async def initialize(self) -> None:
+        self._worker_semaphore = asyncio.Semaphore(self._workers)
+        if self._report_interval > 0:
+            self._report_task = asyncio.create_task(self._report_queue_depth())
+        logger.info(f"Параллельная обработка обновлений включена: {self._workers} обработчиков.")
+
+    async def shutdown(self) -> None:
+        if self._report_task:
+            self._report_task.cancel()
+            self._report_task = None
+        logger.info(f"Обработчик обновлений остановлен. Максимальная глубина очереди: {self._max_queue_depth_seen}.")
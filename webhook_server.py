@@ -0,0 +1,109 @@
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from startup import is_ready, warm_up_error
+from config import (
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET_TOKEN,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_stop_event = None
+
+
+def request_stop():
+    """Останавливает бота, запущенный run_webhook (аналог Application.stop_running для режима вебхука)."""
+    if _stop_event is not None:
+        _stop_event.set()
+
+
+def create_web_app(application: Application) -> web.Application:
+    """
+    HTTP-приложение вебхука: POST WEBHOOK_PATH принимает обновления Telegram,
+    GET /healthz сообщает, запущен ли бот и готов ли он к генерации (200 - только после прогрева).
+    """
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET_TOKEN:
+            # compare_digest не принимает строки с не-ASCII символами, поэтому сравниваются байты;
+            # aiohttp декодирует заголовки с surrogateescape, так исходные байты восстанавливаются точно
+            received_token = request.headers.get(SECRET_TOKEN_HEADER, "").encode("utf-8", "surrogateescape")
+            if not hmac.compare_digest(received_token, WEBHOOK_SECRET_TOKEN.encode()):
+                logger.warning(f"Отклонён запрос к вебхуку с неверным секретным токеном от {request.remote}.")
+                return web.Response(status=403)
+        try:
+            update_data = await request.json()
+            update = Update.de_json(update_data, application.bot)
+        except Exception as e:
+            logger.warning(f"Не удалось разобрать обновление, полученное через вебхук: {e}")
+            return web.Response(status=400)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(request: web.Request) -> web.Response:
+        if warm_up_error() is not None:
+            status = "failed"
+        elif not application.running:
+            status = "starting"
+        elif not is_ready():
+            status = "warming_up"
+        else:
+            status = "ok"
+        return web.json_response({"status": status, "error": warm_up_error(),
+                                  "pending_updates": application.update_queue.qsize()},
+                                 status=200 if status == "ok" else 503)
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    web_app.router.add_get("/healthz", handle_health)
+    return web_app
+
+
+async def run_webhook(application: Application, on_startup=None, on_shutdown=None) -> None:
+    """Запускает бота в режиме вебхука со встроенным HTTP-сервером до SIGINT/SIGTERM или request_stop()."""
+    global _stop_event
+    stop_event = _stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stop_event.set)
+
+    runner = web.AppRunner(create_web_app(application))
+    await runner.setup()
+    async with application:
+        if on_startup:
+            await on_startup(application)
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET_TOKEN or None,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"Вебхук Telegram установлен на {WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH}.")
+        else:
+            logger.warning("WEBHOOK_URL не задан: вебхук в Telegram не регистрируется (локальный режим).")
+        if not WEBHOOK_SECRET_TOKEN:
+            logger.warning("WEBHOOK_SECRET_TOKEN не задан: запросы к вебхуку не проверяются.")
+
+        await application.start()
+        site = web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT)
+        await site.start()
+        logger.info(f"Бот принимает обновления на http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        await stop_event.wait()
+
+        logger.info("Остановка бота...")
+        await runner.cleanup()
+        await application.stop()
+        if on_shutdown:
+            await on_shutdown(application)